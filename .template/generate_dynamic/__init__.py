@@ -1,4 +1,6 @@
-import android_tasks, build, check_tasks, customer_goals, customer_phases
-import customer_tasks, firefox_tasks, ie_tasks, internal_goals, internal_tasks
-import ios_tasks, predicates, web_tasks, wp_tasks, migrate_tasks, safari_tasks
-import chrome_tasks
+# lib first: it needs to set things up before build is imported
+import lib
+import build, check_tasks, customer_goals, customer_phases
+import customer_tasks, internal_goals, internal_tasks
+import predicates, migrate_tasks
+# platform-specific task modules are imported when first needed: see task_manifest
@@ -0,0 +1,54 @@
+'''Command line entry point, for the build daemon.
+
+``python .template/generate_dynamic serve`` runs the daemon (see :mod:`daemon`);
+``python .template/generate_dynamic run <goal> <build.json>`` runs a goal, in the
+daemon if one is running, where ``build.json`` holds the keyword arguments for
+:class:`build.Build`.
+'''
+import argparse
+import json
+import logging
+from os import path
+import sys
+
+if not __package__:
+	# run as a directory, rather than with -m: make the package importable
+	sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import generate_dynamic
+from generate_dynamic import daemon
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='generate_dynamic')
+	parser.add_argument('--socket', help='Unix socket the daemon listens on')
+	parser.add_argument('-v', '--verbose', action='store_true', help='show debug output')
+	commands = parser.add_subparsers(dest='command')
+	commands.add_parser('serve', help='run the build daemon until interrupted')
+	run_parser = commands.add_parser('run', help='run a goal, in the daemon if one is running')
+	run_parser.add_argument('goal', choices=daemon.GOALS)
+	run_parser.add_argument('build', help='JSON file of keyword arguments for build.Build')
+	args = parser.parse_args(argv)
+
+	if args.command == 'serve':
+		# the daemon sets up its own logging
+		try:
+			daemon.serve(args.socket)
+		except KeyboardInterrupt:
+			pass
+		except daemon.DaemonError, e:
+			sys.stderr.write('{0}\n'.format(e))
+			return 1
+		return 0
+
+	logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(message)s')
+	with open(args.build) as build_file:
+		build_kwargs = json.load(build_file)
+	try:
+		daemon.run(args.goal, build_kwargs, socket_path=args.socket, log=logging.getLogger('forge'))
+	except daemon.DaemonError, e:
+		logging.getLogger('forge').error(str(e))
+		return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,375 @@
+'''Talk to the adb server directly, over its local socket, instead of running ``adb``.
+
+Every request to the server is a 4 digit hex length followed by the request
+itself, e.g. ``0012host:track-devices``; the server replies ``OKAY``, or ``FAIL``
+followed by a length-prefixed message.
+
+:class:`DeviceTracker` uses ``host:track-devices``, for which the server sends the
+full device list (``serial\\tstate`` lines, again length-prefixed) as soon as we
+connect, and again whenever a device is attached, detached or changes state.
+
+:class:`Device` talks to one device: after ``host:transport:<serial>``, the server
+passes the next request on to the device. ``shell:<command>`` streams the
+command's output until it exits; ``sync:`` is the file transfer protocol, which we
+use to push files. Each stream is a socket of its own, which the server
+multiplexes over the device's connection, so several can be open at once, and
+:class:`LineReader` reads lines from any number of them in one thread.
+'''
+import errno
+import logging
+import os
+import pipes
+import select
+import socket
+import struct
+import threading
+import time
+
+from lib import BASE_EXCEPTION
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5037
+# the adb server answers at once if it's running at all
+CONNECT_TIMEOUT = 5
+
+class AdbError(BASE_EXCEPTION):
+	pass
+
+def server_address():
+	'Where the adb server listens: the same place the ``adb`` command looks'
+	return ('127.0.0.1', int(os.environ.get('ANDROID_ADB_SERVER_PORT', DEFAULT_PORT)))
+
+def _recv_exactly(sock, length):
+	chunks = []
+	while length:
+		chunk = sock.recv(length)
+		if not chunk:
+			raise AdbError('the adb server closed the connection')
+		chunks.append(chunk)
+		length -= len(chunk)
+	return ''.join(chunks)
+
+def _read_block(sock):
+	'A length-prefixed message from the server'
+	length = _recv_exactly(sock, 4)
+	try:
+		length = int(length, 16)
+	except ValueError:
+		raise AdbError('unexpected reply from the adb server: {0!r}'.format(length))
+	return _recv_exactly(sock, length)
+
+def _request(sock, request):
+	sock.sendall('{0:04x}{1}'.format(len(request), request))
+	status = _recv_exactly(sock, 4)
+	if status == 'FAIL':
+		raise AdbError('adb server refused {request}: {message}'.format(
+				request=request, message=_read_block(sock)))
+	if status != 'OKAY':
+		raise AdbError('unexpected reply from the adb server: {0!r}'.format(status))
+
+def connect(request):
+	'''A socket to the adb server, on which ``request`` has been accepted
+
+	:raises AdbError: if the server refuses the request
+	:raises socket.error: if the server isn't running
+	'''
+	sock = socket.create_connection(server_address(), CONNECT_TIMEOUT)
+	try:
+		_request(sock, request)
+	except:
+		sock.close()
+		raise
+	return sock
+
+def _parse_devices(text):
+	devices = {}
+	for line in text.splitlines():
+		if '\t' in line:
+			serial, state = line.split('\t', 1)
+			devices[serial] = state.strip()
+	return devices
+
+def ready(devices):
+	'The serials in ``devices`` which can be used, i.e. not offline, unauthorized etc.'
+	return sorted(serial for serial, state in devices.iteritems() if state == 'device')
+
+class DeviceTracker(object):
+	def __init__(self):
+		'''A live table of the devices known to the adb server, updated as the server
+		reports changes
+
+		:raises AdbError, socket.error: if we can't start tracking
+		'''
+		self._changed = threading.Condition()
+		# serial -> state, None until the server's first report
+		self._devices = None
+		self.closed = False
+		self._sock = connect('host:track-devices')
+		self._sock.settimeout(None)
+		thread = threading.Thread(target=self._follow)
+		thread.daemon = True
+		thread.start()
+
+	def _follow(self):
+		try:
+			while True:
+				devices = _parse_devices(_read_block(self._sock))
+				with self._changed:
+					previous = self._devices or {}
+					for serial in sorted(set(previous) | set(devices)):
+						if previous.get(serial) != devices.get(serial):
+							LOG.debug('adb device {serial}: {state}'.format(
+									serial=serial, state=devices.get(serial, 'detached')))
+					self._devices = devices
+					self._changed.notify_all()
+		except (AdbError, socket.error), e:
+			if not self.closed:
+				LOG.debug('stopped tracking adb devices: {0}'.format(e))
+		finally:
+			with self._changed:
+				self.closed = True
+				self._changed.notify_all()
+
+	def wait_for(self, predicate, timeout):
+		'''Wait until ``predicate`` is true of the device table, for at most
+		``timeout`` seconds
+
+		:return: the device table (serial -> state) at that point, whether or not
+			``predicate`` is true of it
+		:raises AdbError: if we lose the connection to the server before the first
+			report of devices
+		'''
+		now = time.time()
+		deadline = now + timeout
+		# the first report comes as soon as we connect, so is always worth waiting for
+		first_deadline = now + CONNECT_TIMEOUT
+		with self._changed:
+			while not self.closed:
+				if self._devices is None:
+					remaining = first_deadline - time.time()
+				elif predicate(self._devices):
+					break
+				else:
+					remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				self._changed.wait(remaining)
+			if self._devices is None:
+				raise AdbError('the adb server did not report any devices')
+			return dict(self._devices)
+
+	def devices(self):
+		'The current device table, serial -> state'
+		return self.wait_for(lambda devices: True, 0)
+
+	def close(self):
+		self.closed = True
+		try:
+			self._sock.shutdown(socket.SHUT_RDWR)
+		except socket.error:
+			pass
+		self._sock.close()
+
+_lock = threading.Lock()
+_tracker = None
+
+def tracker():
+	'''The shared :class:`DeviceTracker`, reconnecting if the previous one lost its
+	connection (e.g. because the adb server was restarted)
+	'''
+	global _tracker
+	with _lock:
+		if _tracker is None or _tracker.closed:
+			_tracker = DeviceTracker()
+		return _tracker
+
+# largest DATA packet the sync protocol allows
+_SYNC_DATA_MAX = 64 * 1024
+# where packages are pushed to, for the package manager to install them from
+_INSTALL_DIR = '/data/local/tmp'
+
+def _shell_command(args):
+	if isinstance(args, basestring):
+		return args
+	return ' '.join(pipes.quote(arg) for arg in args)
+
+def _file_chunks(filename):
+	with open(filename, 'rb') as in_file:
+		for chunk in iter(lambda: in_file.read(_SYNC_DATA_MAX), ''):
+			yield chunk
+
+class Device(object):
+	def __init__(self, serial):
+		'One device, talked to through the adb server'
+		self.serial = serial
+
+	def open(self, service):
+		'''A socket to ``service`` on this device, e.g. ``shell:ls``
+
+		:raises AdbError: if there's no such device or it refuses the request
+		:raises socket.error: if the server isn't running
+		'''
+		sock = connect('host:transport:' + self.serial)
+		try:
+			_request(sock, service)
+		except:
+			sock.close()
+			raise
+		return sock
+
+	def open_shell(self, args):
+		'''A socket streaming the output of a shell command, until it exits
+
+		:param args: the command, as a list of arguments or a string for the shell
+		'''
+		sock = self.open('shell:' + _shell_command(args))
+		sock.settimeout(None)
+		return sock
+
+	def shell(self, args, timeout=60):
+		'''Run a shell command and return its output
+
+		Devices don't report the exit status of commands, so callers have to look for
+		errors in the output.
+		'''
+		sock = self.open('shell:' + _shell_command(args))
+		try:
+			sock.settimeout(timeout)
+			output = []
+			for chunk in iter(lambda: sock.recv(_SYNC_DATA_MAX), ''):
+				output.append(chunk)
+		except socket.timeout:
+			raise AdbError('{command} timed out after {timeout} seconds on {serial}'.format(
+					command=_shell_command(args), timeout=timeout, serial=self.serial))
+		finally:
+			sock.close()
+		# older devices run commands in a terminal, which turns \n into \r\n
+		return ''.join(output).replace('\r\n', '\n')
+
+	def push(self, chunks, remote_path, mode=0644, mtime=None, timeout=60):
+		'''Write a file to the device
+
+		:param chunks: the contents of the file, as an iterable of strings, which are
+			sent as they're produced
+		:param timeout: how long the device may take to accept any one chunk
+		'''
+		sock = self.open('sync:')
+		try:
+			sock.settimeout(timeout)
+			spec = '{path},{mode}'.format(path=remote_path, mode=0100000 | mode)
+			sock.sendall('SEND' + struct.pack('<I', len(spec)) + spec)
+			for chunk in chunks:
+				for start in xrange(0, len(chunk), _SYNC_DATA_MAX):
+					data = chunk[start:start + _SYNC_DATA_MAX]
+					sock.sendall('DATA' + struct.pack('<I', len(data)) + data)
+			if mtime is None:
+				mtime = time.time()
+			sock.sendall('DONE' + struct.pack('<I', int(mtime)))
+
+			status, length = struct.unpack('<4sI', _recv_exactly(sock, 8))
+			if status == 'FAIL':
+				raise AdbError('failed to push {path} to {serial}: {message}'.format(
+						path=remote_path, serial=self.serial, message=_recv_exactly(sock, length)))
+			if status != 'OKAY':
+				raise AdbError('unexpected reply from the adb server: {0!r}'.format(status))
+			sock.sendall('QUIT' + struct.pack('<I', 0))
+		except socket.timeout:
+			raise AdbError('pushing {path} to {serial} timed out'.format(
+					path=remote_path, serial=self.serial))
+		finally:
+			sock.close()
+
+	def install(self, apk, name='forge.apk', timeout=120):
+		'''Install or reinstall a package, as ``adb install -r`` does
+
+		:param apk: file name of the APK, or its contents as an iterable of strings
+		:param name: what to call the APK on the device, while it's installed
+		'''
+		if isinstance(apk, basestring):
+			apk = _file_chunks(apk)
+		remote_path = _INSTALL_DIR + '/' + name
+		self.push(apk, remote_path, timeout=timeout)
+		try:
+			output = self.shell(['pm', 'install', '-r', remote_path], timeout=timeout)
+		finally:
+			self.shell(['rm', remote_path])
+		if 'Success' not in output:
+			raise AdbError('installing on {serial} failed: {output}'.format(
+					serial=self.serial, output=output.strip()))
+		return output
+
+	def logcat(self, *filters):
+		'A socket streaming the device log, with ``filters`` applied'
+		return self.open_shell(['logcat'] + list(filters))
+
+class LineReader(object):
+	def __init__(self):
+		'''Reads lines from any number of streams, as they come in, in one thread
+
+		Streams can be added from other threads while :meth:`read` is running.
+		'''
+		self._lock = threading.Lock()
+		self._added = threading.Event()
+		self._new = []
+		# socket -> [tag, incomplete line]
+		self._streams = {}
+
+	def add(self, sock, tag):
+		'Start reading from ``sock``; its lines will be reported with ``tag``'
+		with self._lock:
+			self._new.append((sock, tag))
+		self._added.set()
+
+	def __len__(self):
+		with self._lock:
+			return len(self._streams) + len(self._new)
+
+	def read(self, timeout):
+		'''Wait at most ``timeout`` seconds for input
+
+		:return: a list of ``(tag, line)`` for each complete line read; ``line`` is
+			``None`` for a stream which has been closed at the other end, which is
+			closed and forgotten
+		'''
+		with self._lock:
+			self._added.clear()
+			for sock, tag in self._new:
+				self._streams[sock] = [tag, '']
+			self._new = []
+		if not self._streams:
+			self._added.wait(timeout)
+			return []
+
+		try:
+			readable = select.select(list(self._streams), [], [], timeout)[0]
+		except select.error, e:
+			if e.args[0] != errno.EINTR:
+				raise
+			return []
+		lines = []
+		for sock in readable:
+			stream = self._streams[sock]
+			try:
+				data = sock.recv(_SYNC_DATA_MAX)
+			except socket.error, e:
+				LOG.debug('lost stream {tag}: {err}'.format(tag=stream[0], err=e))
+				data = ''
+			if not data:
+				if stream[1]:
+					lines.append((stream[0], stream[1].rstrip('\r')))
+				lines.append((stream[0], None))
+				del self._streams[sock]
+				sock.close()
+				continue
+			complete = (stream[1] + data).split('\n')
+			stream[1] = complete.pop()
+			lines.extend((stream[0], line.rstrip('\r')) for line in complete)
+		return lines
+
+	def close(self):
+		with self._lock:
+			for sock in list(self._streams) + [sock for sock, tag in self._new]:
+				sock.close()
+			self._streams = {}
+			self._new = []
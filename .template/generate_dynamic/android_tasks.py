@@ -5,6 +5,8 @@ import os
 from os import path
 import re
 import shutil
+import socket
+import subprocess
 from subprocess import PIPE, STDOUT
 import threading
 import sys
@@ -12,8 +14,13 @@ import tempfile
 import time
 import zipfile
 
+import adb_client
+import apk_assembly
+import apk_signing
+import filecopy
 import lib
 from lib import temp_file, task, CouldNotLocate, ProgressBar
+from package_names import android as _generate_package_name
 from utils import run_shell
 
 LOG = logging.getLogger(__name__)
@@ -366,6 +373,9 @@ def _create_avd(path_info):
 		raise AndroidError
 	LOG.debug('Output:\n'+proc_std)
 
+def _is_emulator_ready(devices):
+	return any(serial.startswith('emulator-') for serial in adb_client.ready(devices))
+
 def _launch_avd(path_info):
 	run_detached(
 			[path.join(path_info.sdk, "tools", "emulator"),
@@ -373,26 +383,75 @@ def _launch_avd(path_info):
 			wait=False)
 	
 	LOG.info("Started emulator, waiting for device to boot")
-	_run_adb([path_info.adb, 'wait-for-device'], 120, path_info)
-	# adb shell can return too quickly without a small sleep here.
-	time.sleep(1)
-	_run_adb([path_info.adb, "shell", "pm", "path", "android"], 120, path_info)
+	try:
+		devices = adb_client.tracker().wait_for(_is_emulator_ready, 120)
+	except (adb_client.AdbError, socket.error), e:
+		LOG.debug("Couldn't track devices through the adb server ({0}), running adb instead".format(e))
+		_run_adb([path_info.adb, 'wait-for-device'], 120, path_info)
+		# adb shell can return too quickly without a small sleep here.
+		time.sleep(1)
+		_run_adb([path_info.adb, "shell", "pm", "path", "android"], 120, path_info)
+		return
+
+	emulators = [serial for serial in adb_client.ready(devices) if serial.startswith('emulator-')]
+	if not emulators:
+		raise AndroidError("The emulator didn't start within two minutes")
+	# the device is up before the package manager is: this returns once it is too
+	adb_client.Device(emulators[0]).shell(['pm', 'path', 'android'], timeout=120)
 
-def _create_apk_with_aapt(out_apk_name, path_info, package_name, lib_path, dev_dir):
+def _create_apk_with_aapt(out_apk_name, path_info, package_name, lib_path, dev_dir, include_assets=True):
+	'''Package the app with aapt
+
+	:param include_assets: if false, only compile the resources and manifest, leaving
+		out ``assets`` and the raw files in ``output``
+	'''
 	LOG.info('Creating APK with aapt')
 
-	run_shell(path_info.aapt,
+	args = [
+		path_info.aapt,
 		'p', # create APK package
 		'-F', out_apk_name, # output name
 		'-S', path.join(dev_dir, 'res'), # uncompressed resources folder
 		'-M', path.join(dev_dir, 'AndroidManifest.xml'), # uncompressed xml manifest
 		'-I', path.join(lib_path, 'android-platform.apk'), # Android platform to "compile" resources against
-		'-A', path.join(dev_dir, 'assets'), # Assets folder to include
+	]
+	if include_assets:
+		args += ['-A', path.join(dev_dir, 'assets')] # Assets folder to include
+	args += [
 		'-0', '', # Don't compress any assets - Important for content provider access to assets
 		'--rename-manifest-package', package_name, # Package name
 		'-f', # Force overwrite
-		path.join(dev_dir, 'output'), # Location of raw files (app binary)
-		command_log_level=logging.DEBUG)
+	]
+	if include_assets:
+		args.append(path.join(dev_dir, 'output')) # Location of raw files (app binary)
+	run_shell(*args, command_log_level=logging.DEBUG)
+
+def _create_apk_incrementally(build, path_info, package_name, lib_path, dev_dir):
+	'''Update the debug APK kept in the step cache, and return its name
+
+	aapt is only run if the resources or manifest have changed; assets and raw files
+	are stored as aapt would, but only those changed since the last run are rewritten.
+	The cached APK is only ever rewritten by the next build, so it can be read (e.g.
+	installed from) until then, but mustn't be modified.
+	'''
+	keystore = path.join(lib_path, 'debug.keystore')
+	key, chain = apk_signing.load_key(keystore, 'android', 'androiddebugkey', 'android')
+
+	assembly = apk_assembly.ApkAssembly(path.join(build.orig_wd, '.step_cache', 'android_apk'))
+	res_inputs = [
+		path.join(dev_dir, 'res'),
+		path.join(dev_dir, 'AndroidManifest.xml'),
+		path.join(lib_path, 'android-platform.apk'),
+	]
+	assembly.compile_resources(res_inputs, [package_name, path_info.aapt],
+		lambda resources_apk: _create_apk_with_aapt(resources_apk, path_info, package_name,
+			lib_path, dev_dir, include_assets=False))
+
+	LOG.info('Updating APK')
+	files = (apk_assembly.asset_files(path.join(dev_dir, 'assets'), 'assets/') +
+			apk_assembly.asset_files(path.join(dev_dir, 'output')))
+	assembly.update(files, key, chain)
+	return assembly.apk
 
 def _sign_zipf(lib_path, jre, keystore, storepass, keyalias, keypass, signed_zipf_name, zipf_name):
 	args = [
@@ -413,31 +472,46 @@ def _sign_zipf(lib_path, jre, keystore, storepass, keyalias, keypass, signed_zip
 	]
 	run_shell(*args)
 
-def _sign_zipf_debug(lib_path, jre, zipf_name, signed_zipf_name):
+def _sign_and_align(path_info, lib_path, zipf_name, out_apk_name, keystore, storepass, keyalias, keypass):
+	'''Sign the unsigned APK ``zipf_name`` and align it, writing the result to ``out_apk_name``
+
+	Done in-process where we can, otherwise with apk-signer.jar then zipalign.
+	'''
+	try:
+		apk_signing.sign_and_align(zipf_name, out_apk_name, keystore, storepass, keyalias, keypass)
+		return
+	except apk_signing.UnsupportedKeystore, e:
+		LOG.debug("Can't sign without Java ({0}), using apk-signer.jar".format(e))
+
+	with temp_file() as signed_zipf_name:
+		_sign_zipf(lib_path, _get_jre(), keystore, storepass, keyalias, keypass, signed_zipf_name, zipf_name)
+		_align_apk(path_info, signed_zipf_name, out_apk_name)
+
+def _sign_apk_debug(path_info, lib_path, zipf_name, out_apk_name):
 	LOG.info('Signing APK with a debug key')
 
-	return _sign_zipf(
+	return _sign_and_align(
+		path_info=path_info,
 		lib_path=lib_path,
-		jre=jre,
+		zipf_name=zipf_name,
+		out_apk_name=out_apk_name,
 		keystore=path.join(lib_path, 'debug.keystore'),
 		storepass="android",
 		keyalias="androiddebugkey",
 		keypass="android",
-		signed_zipf_name=signed_zipf_name,
-		zipf_name=zipf_name,
 	)
 
-def _sign_zipf_release(lib_path, jre, zipf_name, signed_zipf_name, keystore, storepass, keyalias, keypass):
+def _sign_apk_release(path_info, lib_path, zipf_name, out_apk_name, keystore, storepass, keyalias, keypass):
 	LOG.info('Signing APK with your release key')
-	return _sign_zipf(
+	return _sign_and_align(
+		path_info=path_info,
 		lib_path=lib_path,
-		jre=jre,
+		zipf_name=zipf_name,
+		out_apk_name=out_apk_name,
 		keystore=keystore,
 		storepass=storepass,
 		keyalias=keyalias,
 		keypass=keypass,
-		signed_zipf_name=signed_zipf_name,
-		zipf_name=zipf_name,
 	)
 	
 def _align_apk(path_info, signed_zipf_name, out_apk_name):
@@ -446,22 +520,209 @@ def _align_apk(path_info, signed_zipf_name, out_apk_name):
 	args = [path.join(path_info.sdk, 'tools', 'zipalign'), '-v', '4', signed_zipf_name, out_apk_name]
 	run_shell(*args)
 
-def _generate_package_name(build):
-	if "package_names" not in build.config["modules"]:
-		build.config["modules"]["package_names"] = {}
-	if "android" not in build.config["modules"]["package_names"]:
-		build.config["modules"]["package_names"]["android"] = "io.trigger.forge"+build.config["uuid"]
-	return build.config["modules"]["package_names"]["android"]
-	
-def _follow_log(path_info, chosen_device):
-	LOG.info('Clearing android log')
+# how long to give each device to install the APK and to start the app
+_DEVICE_INSTALL_TIMEOUT = 120
+_DEVICE_COMMAND_TIMEOUT = 60
 
-	args = [path_info.adb, '-s', chosen_device, 'logcat', '-c']
-	run_shell(*args, command_log_level=logging.INFO)
+def _choose_devices(device, available_devices):
+	"""The devices to run on, for ``android.device`` set to ``all`` or a
+	comma-separated list of device IDs
 
-	LOG.info('Showing android log')
+	Listed devices which aren't attached are reported and skipped.
+	"""
+	if device.strip().lower() == 'all':
+		return list(available_devices)
+
+	chosen = []
+	for serial in device.split(','):
+		serial = serial.strip()
+		if not serial or serial in chosen:
+			continue
+		if serial in available_devices:
+			chosen.append(serial)
+		else:
+			LOG.error('No such device "%s", skipping it' % serial)
+	if not chosen:
+		LOG.error('The available devices are:')
+		LOG.error("\n".join(available_devices))
+		raise AndroidError
+	return chosen
 
-	run_shell(path_info.adb, '-s', chosen_device, 'logcat', 'WebCore:D', 'Forge:D', '*:s', command_log_level=logging.INFO, check_for_interrupt=True)
+def _run_adb_on_device(path_info, serial, args, timeout):
+	"""Run an adb command against one device, without disturbing any others
+
+	Unlike :func:`_run_adb`, a hung command is killed on its own rather than by
+	restarting adb, which would break commands running against other devices.
+	"""
+	cmd = [path_info.adb, '-s', serial] + args
+	LOG.debug('Running: {cmd}'.format(cmd=subprocess.list2cmdline(cmd)))
+	proc = lib.PopenWithoutNewConsole(cmd, stdout=PIPE, stderr=STDOUT)
+	timed_out = []
+	def kill():
+		timed_out.append(True)
+		lib.progressive_kill(proc.pid)
+	timer = threading.Timer(timeout, kill)
+	timer.start()
+	try:
+		output = proc.communicate()[0]
+	finally:
+		timer.cancel()
+	if timed_out:
+		raise AndroidError('adb {command} timed out after {timeout} seconds'.format(command=args[0], timeout=timeout))
+	if proc.returncode != 0:
+		raise AndroidError('adb {command} failed: {output}'.format(command=args[0], output=output.strip()))
+	# older versions of adb don't reflect failures in their exit status
+	if 'Failure [' in output:
+		raise AndroidError('adb {command} failed: {output}'.format(command=args[0], output=output.strip()))
+	return output
+
+_LAUNCH_ACTIVITY = 'io.trigger.forge.android.template.LoadActivity'
+_LOG_FILTERS = ['WebCore:D', 'Forge:D', '*:s']
+
+def _install_through_server(serial, apk_name, package_name, purge, prefix):
+	device = adb_client.Device(serial)
+	# If required remove previous installs from device
+	if purge:
+		device.shell(['pm', 'uninstall', package_name], timeout=_DEVICE_COMMAND_TIMEOUT)
+	LOG.debug(prefix + device.install(apk_name, timeout=_DEVICE_INSTALL_TIMEOUT))
+
+def _start_through_server(serial, package_name, log_reader, prefix):
+	device = adb_client.Device(serial)
+	output = device.shell(['am', 'start', '-n', package_name + '/' + _LAUNCH_ACTIVITY],
+			timeout=_DEVICE_COMMAND_TIMEOUT)
+	LOG.debug(prefix + output)
+	if 'Error' in output:
+		raise AndroidError('Failed to start the app: {0}'.format(output.strip()))
+
+	LOG.info(prefix + 'Clearing android log')
+	device.shell(['logcat', '-c'], timeout=_DEVICE_COMMAND_TIMEOUT)
+	LOG.info(prefix + 'Showing android log')
+	log_reader.add(device.logcat(*_LOG_FILTERS), serial)
+
+def _install_with_adb(path_info, serial, apk_name, package_name, purge, prefix):
+	if purge:
+		_run_adb_on_device(path_info, serial, ['uninstall', package_name], _DEVICE_COMMAND_TIMEOUT)
+	LOG.debug(prefix + _run_adb_on_device(path_info, serial, ['install', '-r', apk_name], _DEVICE_INSTALL_TIMEOUT))
+
+def _start_with_adb(path_info, serial, package_name, state, prefix):
+	"""Start the app with adb, then follow the log in this thread until the device
+	disconnects or ``state['stopping']`` is set
+	"""
+	output = _run_adb_on_device(path_info, serial,
+			['shell', 'am', 'start', '-n', package_name + '/' + _LAUNCH_ACTIVITY], _DEVICE_COMMAND_TIMEOUT)
+	LOG.debug(prefix + output)
+	if 'Error' in output:
+		raise AndroidError('Failed to start the app: {0}'.format(output.strip()))
+
+	LOG.info(prefix + 'Clearing android log')
+	_run_adb_on_device(path_info, serial, ['logcat', '-c'], _DEVICE_COMMAND_TIMEOUT)
+	LOG.info(prefix + 'Showing android log')
+	proc = state['proc'] = lib.PopenWithoutNewConsole(
+			[path_info.adb, '-s', serial, 'logcat'] + _LOG_FILTERS, stdout=PIPE, stderr=STDOUT)
+	if state['stopping']:
+		# _run_on_devices finished while we were starting it: it won't kill this for us
+		lib.progressive_kill(proc.pid)
+	for line in iter(proc.stdout.readline, ''):
+		LOG.info(prefix + line.rstrip('\r\n'))
+	if proc.wait() != 0 and not state['stopping']:
+		raise AndroidError('lost connection to the device')
+	LOG.info(prefix + 'Android log closed')
+
+def _run_on_device(path_info, serial, apk_name, package_name, purge, state, log_reader, prefix):
+	"""Install and start the app on one device, then add its log to ``log_reader``
+
+	If we can't reach the adb server's socket, the ``adb`` command is used instead,
+	and the log is followed in this thread until the device disconnects or
+	``state['stopping']`` is set.
+
+	``state['installed']`` is set once ``apk_name`` is no longer needed, whether or
+	not installation succeeded.
+	"""
+	try:
+		through_server = True
+		LOG.info(prefix + 'Installing apk')
+		try:
+			try:
+				_install_through_server(serial, apk_name, package_name, purge, prefix)
+			except socket.error, e:
+				LOG.debug(prefix + "Couldn't reach the adb server ({0}), running adb instead".format(e))
+				through_server = False
+				_install_with_adb(path_info, serial, apk_name, package_name, purge, prefix)
+		finally:
+			state['installed'].set()
+
+		if through_server:
+			_start_through_server(serial, package_name, log_reader, prefix)
+		else:
+			_start_with_adb(path_info, serial, package_name, state, prefix)
+	except Exception, e:
+		state['error'] = e
+		LOG.error(prefix + (str(e) or 'failed: {0!r}'.format(e)))
+		LOG.debug(prefix + 'failure details', exc_info=True)
+
+def _run_on_devices(build, sdk, path_info, serials, interactive, purge):
+	"""Build the APK once, then install it, start it and follow the log on each
+	of ``serials`` concurrently
+
+	Each device is set up in a thread of its own, through the adb server's socket
+	rather than ``adb`` subprocesses where it can (see :func:`_run_on_device`), then
+	the logs of all of them are read in this thread, prefixed with the device ID if
+	there's more than one. A failure on one device is logged against it and doesn't
+	affect the others; :class:`AndroidError` is only raised if every device fails.
+	"""
+	if len(serials) > 1:
+		LOG.info('Running on {count} android devices: {serials}'.format(
+				count=len(serials), serials=', '.join(serials)))
+	prefixes = dict((serial, '[{0}] '.format(serial) if len(serials) > 1 else '') for serial in serials)
+	package_name = _generate_package_name(build)
+	states = dict((serial, {
+		'installed': threading.Event(),
+		'error': None,
+		# only used when falling back to the adb command
+		'proc': None,
+		'stopping': False,
+	}) for serial in serials)
+	threads = []
+	log_reader = adb_client.LineReader()
+
+	call = lib.current_call()
+	try:
+		with temp_file() as out_apk_name:
+			# install straight from the cached APK for incremental builds, rather than a copy
+			apk_name = _create_apk(build, out_apk_name)
+			for serial in serials:
+				thread = threading.Thread(target=_run_on_device, args=(path_info, serial, apk_name,
+						package_name, purge, states[serial], log_reader, prefixes[serial]))
+				thread.daemon = True
+				thread.start()
+				threads.append(thread)
+
+			# a temporary APK is removed when we leave this block
+			for state in states.values():
+				while not state['installed'].wait(1):
+					call.assert_not_interrupted()
+
+		running = threads
+		while running or log_reader:
+			for serial, line in log_reader.read(1):
+				if line is None:
+					LOG.info(prefixes[serial] + 'Android log closed')
+				else:
+					LOG.info(prefixes[serial] + line)
+			call.assert_not_interrupted()
+			running = [thread for thread in running if thread.is_alive()]
+	finally:
+		log_reader.close()
+		for state in states.values():
+			state['stopping'] = True
+			if state['proc'] is not None and state['proc'].poll() is None:
+				lib.progressive_kill(state['proc'].pid)
+
+	failed = [serial for serial in serials if states[serial]['error'] is not None]
+	if len(failed) == len(serials):
+		raise AndroidError('Failed to run on {0}'.format(', '.join(failed)))
+	if failed:
+		LOG.warning('Failed to run on {0}'.format(', '.join(failed)))
 
 def _create_avd_if_necessary(path_info):
 	# Create avd
@@ -471,7 +732,28 @@ def _create_avd_if_necessary(path_info):
 	else:
 		_create_avd(path_info)
 
-def _get_available_devices(path_info, try_count=0):
+# how long to wait for a device to be attached, before asking the user about it
+_DEVICE_WAIT = 6
+
+def _get_available_devices(path_info):
+	"""Serials of the attached devices which are ready to use
+
+	Asks the adb server's device tracker, so a device which is attached while we
+	wait is picked up straight away; if we can't talk to the server directly, we
+	ask the ``adb`` command instead.
+	"""
+	try:
+		devices = adb_client.tracker().wait_for(adb_client.ready, _DEVICE_WAIT)
+	except (adb_client.AdbError, socket.error), e:
+		LOG.debug("Couldn't track devices through the adb server ({0}), running adb instead".format(e))
+		return _poll_available_devices(path_info)
+
+	for serial, state in sorted(devices.iteritems()):
+		if state != 'device':
+			LOG.info('Ignoring android device {serial}, which is {state}'.format(serial=serial, state=state))
+	return adb_client.ready(devices)
+
+def _poll_available_devices(path_info, try_count=0):
 	proc_std = _run_adb([path_info.adb, 'devices'], timeout=10, path_info=path_info)
 		
 	available_devices = _scrape_available_devices(proc_std)
@@ -481,7 +763,7 @@ def _get_available_devices(path_info, try_count=0):
 		time.sleep(2)
 		if try_count == 1:
 			_restart_adb(path_info)
-		return _get_available_devices(path_info, (try_count + 1))
+		return _poll_available_devices(path_info, (try_count + 1))
 	else:
 		return available_devices
 
@@ -500,12 +782,21 @@ def _get_jre():
 
 def create_apk(build, sdk, output_filename, interactive=True):
 	'''
-	:param output_filename: name of the file to which we'll write
+	:param output_filename: name of the file to which we'll write; for incremental
+		builds, this may be a link to the cached APK, so it mustn't be modified
+	'''
+	apk_name = _create_apk(build, output_filename)
+	if apk_name != output_filename:
+		filecopy.copy_file(apk_name, output_filename, 'auto')
+
+def _create_apk(build, output_filename):
+	'''Create the debug APK
+
+	:return: the name of the APK: ``output_filename``, or for incremental builds the
+		cached APK (see :func:`_create_apk_incrementally`), in which case
+		``output_filename`` isn't written
 	'''
 	path_info = _find_or_install_sdk(build)
-	jre = ""
- 
-	jre = _get_jre()
 
 	lib_path = path.normpath(path.join('.template', 'lib'))
 	dev_dir = path.normpath(path.join('development', 'android'))
@@ -513,16 +804,16 @@ def create_apk(build, sdk, output_filename, interactive=True):
 	
 	LOG.info('Creating Android .apk file')
 
+	if build.tool_config.get('general.incremental', False):
+		return _create_apk_incrementally(build, path_info, package_name, lib_path, dev_dir)
+
 	with temp_file() as zipf_name:
 		# Compile XML files into APK
 		_create_apk_with_aapt(zipf_name, path_info, package_name, lib_path, dev_dir)
 		
-		with temp_file() as signed_zipf_name:
-			# Sign APK
-			_sign_zipf_debug(lib_path, jre, zipf_name, signed_zipf_name)
-			
-			# Align APK
-			_align_apk(path_info, signed_zipf_name, output_filename)
+		# Sign and align APK
+		_sign_apk_debug(path_info, lib_path, zipf_name, output_filename)
+	return output_filename
 
 @task
 def run_android(build, build_type_dir, sdk, device, interactive=True,
@@ -551,38 +842,22 @@ def run_android(build, build_type_dir, sdk, device, interactive=True,
 		return run_android(build, build_type_dir, sdk, device,
 				interactive=interactive)
 
-	if device:
+	if device and (device.strip().lower() == 'all' or ',' in device):
+		chosen_devices = _choose_devices(device, available_devices)
+	elif device:
 		if device in available_devices:
-			chosen_device = device
-			LOG.info('Using specified android device %s' % chosen_device)
+			chosen_devices = [device]
+			LOG.info('Using specified android device %s' % device)
 		else:
 			LOG.error('No such device "%s"' % device)
 			LOG.error('The available devices are:')
 			LOG.error("\n".join(available_devices))
 			raise AndroidError
 	else:
-		chosen_device = available_devices[0]
-		LOG.info('No android device specified, defaulting to %s' % chosen_device)
+		chosen_devices = available_devices[:1]
+		LOG.info('No android device specified, defaulting to %s' % chosen_devices[0])
 
-	with temp_file() as out_apk_name:
-		create_apk(build, sdk, out_apk_name, interactive=interactive)
-		package_name = _generate_package_name(build)
-		
-		# If required remove previous installs from device
-		if purge:
-			_run_adb([path_info.adb, 'uninstall', package_name], 30, path_info)
-
-		# Install APK to device
-		LOG.info('Installing apk')
-		proc_std = _run_adb([path_info.adb, '-s', chosen_device, 'install', '-r', out_apk_name], 60, path_info)
-	LOG.debug(proc_std)
-
-	# Start app on device
-	proc_std = _run_adb([path_info.adb, '-s', chosen_device, 'shell', 'am', 'start', '-n', package_name+'/io.trigger.forge.android.template.LoadActivity'], 60, path_info)
-	LOG.debug(proc_std)
-	
-	#follow log
-	_follow_log(path_info, chosen_device)
+	_run_on_devices(build, sdk, path_info, chosen_devices, interactive, purge)
 
 def _create_output_directory(output):
 	'output might be in some other directory which does not yet exist'
@@ -632,8 +907,9 @@ def _lookup_or_prompt_for_signing_info(build):
 	unknown_info = {}
 
 	# figure out which info we have in local_config.json and which we need to ask for
+	profile = build.tool_config.with_prefix('android.profile')
 	for prop_name in required_info.keys():
-		local_config_value = build.tool_config.get('android.profile.%s' % prop_name)
+		local_config_value = profile.get(prop_name)
 
 		if local_config_value:
 			known_info[prop_name] = local_config_value
@@ -664,7 +940,6 @@ def package_android(build):
 	
 	signing_info["keystore"] = lib.expand_relative_path(build,
 			signing_info["keystore"])
-	jre = _get_jre() or ""
 
 	LOG.info('Creating Android .apk file')
 	package_name = _generate_package_name(build)
@@ -672,16 +947,12 @@ def package_android(build):
 	with temp_file() as zipf_name:
 		_create_apk_with_aapt(zipf_name, path_info, package_name, lib_path, dev_dir)
 
-		with temp_file() as signed_zipf_name:
-			#sign
-			_sign_zipf_release(lib_path, jre, zipf_name, signed_zipf_name, **signing_info)
-
-			# create output directory for APK if necessary
-			_create_output_directory(output)
+		# create output directory for APK if necessary
+		_create_output_directory(output)
 
-			#align
-			_align_apk(path_info, signed_zipf_name, output)
-			LOG.debug('removing zipfile and un-aligned APK')
+		#sign and align
+		_sign_apk_release(path_info, lib_path, zipf_name, output, **signing_info)
+		LOG.debug('removing zipfile')
 
-			LOG.info("created APK: {output}".format(output=output))
-			return output
+		LOG.info("created APK: {output}".format(output=output))
+		return output
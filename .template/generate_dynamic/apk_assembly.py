@@ -0,0 +1,208 @@
+'''Assemble the debug APK incrementally, rewriting only what changed since the last run.
+
+Running an app with large assets used to mean re-packing every asset with aapt on
+each run, then copying the whole APK again to sign and align it. Instead,
+:class:`ApkAssembly` keeps the last signed APK it built, with a JSON manifest of its
+entries (where each one's local header is, and the size and mtime of the file it
+came from), and updates that APK in place:
+
+* entries whose source hasn't changed are left where they are
+* changed and added entries are appended, stored and aligned as aapt and zipalign
+  would have done; the old copies become dead space
+* a new v1 signature and central directory are written after them, signing every
+  entry from the digests recorded in the manifest
+
+aapt is only run to compile ``res/`` and ``AndroidManifest.xml``, into an APK of
+their own which is kept between runs, and only when one of those has changed.
+
+Once dead space outweighs the live entries, the APK is written again from scratch.
+The manifest is removed before the APK is touched and saved after it is complete, so
+if an update is interrupted, the next one starts afresh.
+'''
+import json
+import logging
+import os
+from os import path
+import time
+import uuid
+import zipfile
+
+import apk_signing
+
+LOG = logging.getLogger(__name__)
+
+# bump this whenever the layout of the cached APK or manifest changes
+CACHE_VERSION = 1
+
+def _aapt_ignores(name, is_dir):
+	'Whether aapt leaves out the asset ``name`` by default (see ``gDefaultIgnoreAssets``)'
+	lower = name.lower()
+	return (name.startswith('.') or
+			(is_dir and name.startswith('_')) or
+			lower in ('cvs', 'thumbs.db', 'picasa.ini') or
+			lower.endswith('.scc') or
+			name.endswith('~'))
+
+def asset_files(root, prefix=''):
+	'''The files aapt would package from the directory ``root``, as ``(entry name, file name)``
+
+	:param prefix: prepended to entry names, e.g. ``assets/``
+	'''
+	found = []
+	if not path.isdir(root):
+		return found
+	for dirpath, dirnames, filenames in os.walk(root):
+		dirnames[:] = sorted(name for name in dirnames if not _aapt_ignores(name, True))
+		relative = path.relpath(dirpath, root)
+		for name in sorted(filenames):
+			if _aapt_ignores(name, False):
+				continue
+			entry = name if relative == '.' else path.join(relative, name)
+			found.append((prefix + entry.replace(os.sep, '/'), path.join(dirpath, name)))
+	return found
+
+def _stat_key(paths, extra):
+	'A key which changes if any file under ``paths``, or anything in ``extra``, changes'
+	stats = [list(extra)]
+	for top in paths:
+		if path.isfile(top):
+			walked = [(path.dirname(top), [path.basename(top)])]
+		else:
+			walked = ((dirpath, filenames) for dirpath, _, filenames in os.walk(top))
+		for dirpath, filenames in walked:
+			for name in sorted(filenames):
+				filename = path.join(dirpath, name)
+				stat = os.stat(filename)
+				stats.append([filename, stat.st_size, stat.st_mtime])
+	return stats
+
+def _date_time(mtime):
+	return max(time.localtime(mtime)[:6], (1980, 1, 1, 0, 0, 0))
+
+class ApkAssembly(object):
+	def __init__(self, cache_dir):
+		'''A signed APK kept in ``cache_dir`` and updated in place
+
+		:param cache_dir: directory to keep the APK, its manifest and the compiled
+			resources in; created if necessary
+		'''
+		if not path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+		self.apk = path.join(cache_dir, 'app.apk')
+		self.resources_apk = path.join(cache_dir, 'resources.apk')
+		self._manifest_file = path.join(cache_dir, 'manifest.json')
+
+		self._manifest = {}
+		if path.isfile(self._manifest_file):
+			try:
+				with open(self._manifest_file) as manifest_file:
+					self._manifest = json.load(manifest_file)
+			except ValueError:
+				LOG.debug('ignoring corrupt APK manifest')
+		if self._manifest.get('version') != CACHE_VERSION:
+			self._manifest = {}
+		self._resources_key = self._manifest.get('resources_key')
+
+	def _apk_intact(self):
+		'Whether the APK is exactly as the manifest left it'
+		if not self._manifest.get('entries') or not path.isfile(self.apk):
+			return False
+		stat = os.stat(self.apk)
+		return [stat.st_size, stat.st_mtime] == self._manifest.get('apk_stat')
+
+	def compile_resources(self, inputs, extra, run_aapt):
+		'''Make sure :attr:`resources_apk` is up to date
+
+		:param inputs: files and directories aapt compiles
+		:param extra: anything else (e.g. the package name) which affects the result,
+			as a list of strings
+		:param run_aapt: called with the file name to write the compiled resources to,
+			if any of ``inputs`` or ``extra`` have changed since the last run
+		'''
+		key = _stat_key(inputs, extra)
+		if key == self._resources_key and path.isfile(self.resources_apk):
+			LOG.debug('resources unchanged, not running aapt')
+			return
+		tmp_file = self.resources_apk + '.' + uuid.uuid4().hex
+		try:
+			run_aapt(tmp_file)
+			if path.isfile(self.resources_apk):
+				os.remove(self.resources_apk)
+			os.rename(tmp_file, self.resources_apk)
+		finally:
+			if path.isfile(tmp_file):
+				os.remove(tmp_file)
+		# only recorded in a manifest saved after the APK is updated
+		self._resources_key = key
+
+	def update(self, files, key, chain):
+		'''Bring the APK up to date with :attr:`resources_apk` and ``files``, and sign it
+
+		:param files: ``(entry name, file name)`` for every file to store alongside
+			the compiled resources
+		:param key: RSA private key to sign with, as from :func:`apk_signing.load_key`
+		:param chain: the certificate chain for ``key``
+		'''
+		wanted = []
+		with zipfile.ZipFile(self.resources_apk) as resources:
+			for info in resources.infolist():
+				if not apk_signing.is_signature_file(info.filename):
+					fingerprint = ['resources', info.CRC, info.compress_type, info.compress_size,
+							info.file_size]
+					wanted.append((info.filename, fingerprint, info))
+		for name, filename in files:
+			stat = os.stat(filename)
+			wanted.append((name, ['file', stat.st_size, stat.st_mtime], filename))
+
+		previous = {}
+		data_end = 0
+		if self._apk_intact():
+			previous = dict((record['name'], record) for record in self._manifest['entries'])
+			data_end = self._manifest['data_end']
+			live = sum(previous[name]['end'] - previous[name]['offset']
+					for name, fingerprint, _ in wanted
+					if name in previous and previous[name]['fingerprint'] == fingerprint)
+			if data_end - live > live:
+				LOG.debug('compacting APK')
+				previous = {}
+				data_end = 0
+
+		if path.isfile(self._manifest_file):
+			os.remove(self._manifest_file)
+		rewritten = 0
+		with open(self.apk, 'r+b' if data_end else 'wb') as out_file:
+			# drop the old signature's central directory: the new one follows the new entries
+			out_file.truncate(data_end)
+			out_file.seek(data_end)
+			writer = apk_signing.ApkWriter(out_file)
+			with open(self.resources_apk, 'rb') as resources_file:
+				for name, fingerprint, source in wanted:
+					record = previous.get(name)
+					if record is not None and record['fingerprint'] == fingerprint:
+						writer.keep(record)
+						continue
+					rewritten += 1
+					if fingerprint[0] == 'resources':
+						record = apk_signing.copy_entry(writer, resources_file, source)
+					else:
+						record = writer.add_file(name, source, _date_time(fingerprint[2]))
+					record['fingerprint'] = fingerprint
+			entries = list(writer.records)
+
+			apk_signing.add_signature(writer, key, chain)
+			data_end = out_file.tell()
+			writer.close()
+		LOG.debug('rewrote {0} of {1} APK entries'.format(rewritten, len(wanted)))
+
+		stat = os.stat(self.apk)
+		self._manifest = {
+			'version': CACHE_VERSION,
+			'resources_key': self._resources_key,
+			'entries': entries,
+			'data_end': data_end,
+			'apk_stat': [stat.st_size, stat.st_mtime],
+		}
+		tmp_file = self._manifest_file + '.' + uuid.uuid4().hex
+		with open(tmp_file, 'w') as out_file:
+			json.dump(self._manifest, out_file)
+		os.rename(tmp_file, self._manifest_file)
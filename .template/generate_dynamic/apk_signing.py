@@ -0,0 +1,472 @@
+'''Sign and align an APK without running Java or zipalign.
+
+:func:`sign_and_align` reads the unsigned APK made by aapt once, copying each entry
+to the output as-is (compressed entries aren't recompressed) while computing its
+digest. Uncompressed entries are aligned to 4 bytes as they're written, as zipalign
+would. Then the v1 (JAR) signature is appended: ``META-INF/MANIFEST.MF``,
+``META-INF/CERT.SF`` and ``META-INF/CERT.RSA``, using SHA1 with RSA.
+
+Keys are read from JKS keystores, the format of the bundled debug keystore and of
+keystores made by older versions of keytool. For anything else, such as a PKCS12
+or JCEKS keystore or a non-RSA key, :exc:`UnsupportedKeystore` is raised, so that
+the caller can fall back to the Java signer.
+'''
+import base64
+import hashlib
+import os
+import struct
+import zipfile
+import zlib
+
+from lib import BASE_EXCEPTION
+
+# zipalign's alignment for uncompressed entries, which Android mmaps directly
+ALIGNMENT = 4
+
+_COPY_SIZE = 1024 * 1024
+
+class SigningError(BASE_EXCEPTION):
+	pass
+
+class UnsupportedKeystore(SigningError):
+	'The keystore or key is of a kind we can only use through the Java signer'
+	pass
+
+# DER encoding, just enough for PKCS#7 signatures and the structures in keystores
+
+def _der_length(length):
+	if length < 0x80:
+		return chr(length)
+	encoded = '%x' % length
+	encoded = ('0' * (len(encoded) % 2) + encoded).decode('hex')
+	return chr(0x80 | len(encoded)) + encoded
+
+def _der(tag, content):
+	return chr(tag) + _der_length(len(content)) + content
+
+def _der_sequence(*items):
+	return _der(0x30, ''.join(items))
+
+def _der_set(*items):
+	return _der(0x31, ''.join(sorted(items)))
+
+def _der_integer(value):
+	encoded = '%x' % value
+	encoded = ('0' * (len(encoded) % 2) + encoded).decode('hex')
+	if ord(encoded[0]) & 0x80:
+		encoded = '\x00' + encoded
+	return _der(0x02, encoded)
+
+def _der_oid(dotted):
+	numbers = [int(number) for number in dotted.split('.')]
+	encoded = [chr(numbers[0] * 40 + numbers[1])]
+	for number in numbers[2:]:
+		chunk = [chr(number & 0x7f)]
+		number >>= 7
+		while number:
+			chunk.append(chr(0x80 | (number & 0x7f)))
+			number >>= 7
+		encoded.extend(reversed(chunk))
+	return _der(0x06, ''.join(encoded))
+
+_NULL = '\x05\x00'
+_SHA1 = _der_sequence(_der_oid('1.3.14.3.2.26'), _NULL)
+_RSA_ENCRYPTION_OID = _der_oid('1.2.840.113549.1.1.1')
+_RSA_ENCRYPTION = _der_sequence(_RSA_ENCRYPTION_OID, _NULL)
+_DATA_OID = _der_oid('1.2.840.113549.1.7.1')
+_SIGNED_DATA_OID = _der_oid('1.2.840.113549.1.7.2')
+_JKS_KEY_PROTECTOR_OID = _der_oid('1.3.6.1.4.1.42.2.17.1.1')
+
+def _der_read(data, offset=0):
+	'''The element of ``data`` at ``offset``
+
+	:return: (tag, offset of its content, offset just past its end)
+	'''
+	try:
+		tag = ord(data[offset])
+		length = ord(data[offset + 1])
+		start = offset + 2
+		if length & 0x80:
+			count = length & 0x7f
+			length = int(data[start:start + count].encode('hex'), 16)
+			start += count
+	except (IndexError, ValueError):
+		raise SigningError('Malformed DER data')
+	if start + length > len(data):
+		raise SigningError('Malformed DER data')
+	return tag, start, start + length
+
+def _der_children(data, offset=0):
+	'The elements inside the constructed element at ``offset``, as raw DER strings'
+	_, start, end = _der_read(data, offset)
+	children = []
+	while start < end:
+		_, _, child_end = _der_read(data, start)
+		children.append(data[start:child_end])
+		start = child_end
+	return children
+
+def _der_content(element):
+	_, start, end = _der_read(element)
+	return element[start:end]
+
+def _der_to_int(element):
+	return int(_der_content(element).encode('hex') or '0', 16)
+
+# keystores
+
+def _password_bytes(password):
+	'Passwords as Java sees them in keystores: UTF-16 big-endian, no BOM'
+	if isinstance(password, str):
+		password = password.decode('utf-8')
+	return password.encode('utf-16-be')
+
+def _read_java_utf(data, offset):
+	length, = struct.unpack('>H', data[offset:offset + 2])
+	return data[offset + 2:offset + 2 + length].decode('utf-8'), offset + 2 + length
+
+def _xor(one, other):
+	return ('%0*x' % (len(one) * 2, int(one.encode('hex'), 16) ^ int(other.encode('hex'), 16))).decode('hex')
+
+def _recover_jks_key(protected, keypass):
+	'Undo the JKS "key protector", which XORs the key with a SHA1-based stream'
+	algorithm, encrypted = _der_children(protected)
+	if _der_children(algorithm)[0] != _JKS_KEY_PROTECTOR_OID:
+		raise UnsupportedKeystore('key is not protected in the usual JKS way')
+	encrypted = _der_content(encrypted)
+	salt, encrypted_key, check = encrypted[:20], encrypted[20:-20], encrypted[-20:]
+
+	password = _password_bytes(keypass)
+	stream = []
+	digest = salt
+	while len(stream) * 20 < len(encrypted_key):
+		digest = hashlib.sha1(password + digest).digest()
+		stream.append(digest)
+	key = _xor(encrypted_key, ''.join(stream)[:len(encrypted_key)])
+	if hashlib.sha1(password + key).digest() != check:
+		raise SigningError('Cannot recover key: is the key password correct?')
+	return key
+
+def _rsa_private_key(private_key_info):
+	'(n, d, p, q, dp, dq, qinv) from a PKCS#8 PrivateKeyInfo'
+	_, algorithm, key = _der_children(private_key_info)[:3]
+	if _der_children(algorithm)[0] != _RSA_ENCRYPTION_OID:
+		raise UnsupportedKeystore('only RSA keys can be used without Java')
+	numbers = [_der_to_int(element) for element in _der_children(_der_content(key))]
+	n, e, d, p, q, dp, dq, qinv = numbers[1:9]
+	return n, d, p, q, dp, dq, qinv
+
+def load_key(keystore, storepass, keyalias, keypass):
+	'''Read a private key and its certificate chain from a JKS keystore
+
+	:return: (RSA private key numbers, list of DER certificates)
+	'''
+	with open(keystore, 'rb') as keystore_file:
+		data = keystore_file.read()
+	if len(data) < 32:
+		raise UnsupportedKeystore('{0} is not a JKS keystore'.format(keystore))
+	magic, version, count = struct.unpack('>III', data[:12])
+	if magic != 0xfeedfeed or version not in (1, 2):
+		raise UnsupportedKeystore('{0} is not a JKS keystore'.format(keystore))
+	if hashlib.sha1(_password_bytes(storepass) + 'Mighty Aphrodite' + data[:-20]).digest() != data[-20:]:
+		raise SigningError('Keystore was tampered with, or password was incorrect')
+
+	offset = 12
+	for _ in range(count):
+		tag, = struct.unpack('>I', data[offset:offset + 4])
+		alias, offset = _read_java_utf(data, offset + 4)
+		offset += 8 # creation date
+		if tag == 1:
+			key_length, = struct.unpack('>I', data[offset:offset + 4])
+			protected = data[offset + 4:offset + 4 + key_length]
+			offset += 4 + key_length
+			chain_length, = struct.unpack('>I', data[offset:offset + 4])
+			offset += 4
+			chain = []
+			for _ in range(chain_length):
+				if version == 2:
+					_, offset = _read_java_utf(data, offset) # certificate type
+				cert_length, = struct.unpack('>I', data[offset:offset + 4])
+				chain.append(data[offset + 4:offset + 4 + cert_length])
+				offset += 4 + cert_length
+			# JKS aliases are case-insensitive
+			if alias.lower() == keyalias.lower():
+				return _rsa_private_key(_recover_jks_key(protected, keypass)), chain
+		elif tag == 2:
+			if version == 2:
+				_, offset = _read_java_utf(data, offset)
+			cert_length, = struct.unpack('>I', data[offset:offset + 4])
+			offset += 4 + cert_length
+		else:
+			raise SigningError('{0} is corrupt'.format(keystore))
+	raise SigningError('Alias "{0}" not found in {1}'.format(keyalias, keystore))
+
+# signatures
+
+def _rsa_sha1_sign(key, data):
+	'PKCS#1 v1.5 signature of the SHA1 of ``data``'
+	n, d, p, q, dp, dq, qinv = key
+	digest_info = _der_sequence(_SHA1, _der(0x04, hashlib.sha1(data).digest()))
+	size = (len('%x' % n) + 1) // 2
+	padded = '\x00\x01' + '\xff' * (size - len(digest_info) - 3) + '\x00' + digest_info
+	message = int(padded.encode('hex'), 16)
+	# Chinese remainder theorem: much quicker than pow(message, d, n)
+	m1 = pow(message, dp, p)
+	m2 = pow(message, dq, q)
+	signature = m2 + (qinv * (m1 - m2) % p) * q
+	return ('%0*x' % (size * 2, signature)).decode('hex')
+
+def _pkcs7_signature(key, chain, data):
+	'A detached PKCS#7 SignedData signature of ``data``, as jarsigner makes for .RSA files'
+	tbs_certificate = _der_children(chain[0])[0]
+	fields = _der_children(tbs_certificate)
+	if ord(fields[0][0]) == 0xa0:
+		# explicit version
+		fields = fields[1:]
+	serial, _, issuer = fields[:3]
+
+	signer_info = _der_sequence(
+		_der_integer(1),
+		_der_sequence(issuer, serial),
+		_SHA1,
+		_RSA_ENCRYPTION,
+		_der(0x04, _rsa_sha1_sign(key, data)),
+	)
+	signed_data = _der_sequence(
+		_der_integer(1),
+		_der_set(_SHA1),
+		_der_sequence(_DATA_OID),
+		_der(0xa0, ''.join(chain)),
+		_der_set(signer_info),
+	)
+	return _der_sequence(_SIGNED_DATA_OID, _der(0xa0, signed_data))
+
+def _manifest_line(line):
+	'``line``, wrapped to 72 bytes as JAR manifests require'
+	chunks = [line[:72]]
+	line = line[72:]
+	while line:
+		chunks.append(' ' + line[:71])
+		line = line[71:]
+	return '\r\n'.join(chunks) + '\r\n'
+
+def is_signature_file(name):
+	'Whether ``name`` is an entry of a v1 signature, which re-signing replaces'
+	if not name.upper().startswith('META-INF/'):
+		return False
+	base = name[len('META-INF/'):].upper()
+	return base == 'MANIFEST.MF' or base.rsplit('.', 1)[-1] in ('SF', 'RSA', 'DSA', 'EC')
+
+# zip writing
+
+def _dos_date_time(date_time):
+	year, month, day, hour, minute, second = date_time
+	return (hour << 11 | minute << 5 | second // 2), ((year - 1980) << 9 | month << 5 | day)
+
+def _encode_name(name, flags):
+	if isinstance(name, unicode):
+		try:
+			return name.encode('ascii'), flags
+		except UnicodeEncodeError:
+			return name.encode('utf-8'), flags | 0x800
+	return name, flags
+
+class ApkWriter(object):
+	'''Writes zip entries one after another, aligning uncompressed ones.
+
+	Each entry written is described by a record: a dict of plain values, so that
+	it can be saved as JSON and passed to :meth:`keep` when a later APK is written
+	over the same file with the entry left where it is.
+	'''
+	def __init__(self, out_file):
+		self._out = out_file
+		self.records = []
+
+	def _header(self, name, flags, compress_type, crc, compressed_size, size, date_time):
+		name, flags = _encode_name(name, flags)
+		offset = self._out.tell()
+		extra = ''
+		if compress_type == zipfile.ZIP_STORED:
+			extra = '\x00' * (-(offset + 30 + len(name)) % ALIGNMENT)
+		dos_time, dos_date = _dos_date_time(date_time)
+		if max(offset, compressed_size, size) > 0xffffffff:
+			raise SigningError('APKs over 4GB are not supported')
+		self._out.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, flags, compress_type,
+				dos_time, dos_date, crc, compressed_size, size, len(name), len(extra)))
+		self._out.write(name)
+		self._out.write(extra)
+		return offset
+
+	def _record(self, name, flags, compress_type, crc, compressed_size, size, date_time,
+			external_attr, offset):
+		record = {
+			'name': name,
+			'flags': flags,
+			'compress_type': compress_type,
+			'crc': crc,
+			'compress_size': compressed_size,
+			'size': size,
+			'date_time': tuple(date_time),
+			'external_attr': external_attr,
+			'offset': offset,
+			'end': self._out.tell(),
+		}
+		self.records.append(record)
+		return record
+
+	def add(self, name, compress_type, crc, compressed_size, size, date_time,
+			external_attr, data_chunks, flags=0):
+		offset = self._header(name, flags, compress_type, crc, compressed_size, size, date_time)
+		for chunk in data_chunks:
+			self._out.write(chunk)
+		return self._record(name, flags, compress_type, crc, compressed_size, size, date_time,
+				external_attr, offset)
+
+	def add_data(self, name, data, date_time):
+		compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+		compressed = compressor.compress(data) + compressor.flush()
+		return self.add(name, zipfile.ZIP_DEFLATED, zlib.crc32(data) & 0xffffffff,
+				len(compressed), len(data), date_time, 0644 << 16, [compressed])
+
+	def add_file(self, name, filename, date_time):
+		'''Store the file ``filename`` uncompressed, as ``name``
+
+		The file is read once: its CRC is filled in to the local header afterwards.
+		The record has its SHA1 digest as ``digest``.
+		'''
+		size = os.path.getsize(filename)
+		offset = self._header(name, 0, zipfile.ZIP_STORED, 0, size, size, date_time)
+		crc = 0
+		written = 0
+		sha1 = hashlib.sha1()
+		with open(filename, 'rb') as in_file:
+			for chunk in iter(lambda: in_file.read(_COPY_SIZE), ''):
+				sha1.update(chunk)
+				crc = zlib.crc32(chunk, crc)
+				written += len(chunk)
+				self._out.write(chunk)
+		if written != size:
+			raise SigningError('{0} changed while it was being packaged'.format(filename))
+		crc &= 0xffffffff
+		end = self._out.tell()
+		self._out.seek(offset + 14)
+		self._out.write(struct.pack('<I', crc))
+		self._out.seek(end)
+		record = self._record(name, 0, zipfile.ZIP_STORED, crc, size, size, date_time, 0, offset)
+		record['digest'] = base64.b64encode(sha1.digest())
+		return record
+
+	def keep(self, record):
+		'Include an entry already in the file, described by ``record``, in the central directory'
+		self.records.append(record)
+
+	def close(self):
+		start = self._out.tell()
+		for record in self.records:
+			name, flags = _encode_name(record['name'], record['flags'])
+			dos_time, dos_date = _dos_date_time(record['date_time'])
+			self._out.write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, flags,
+					record['compress_type'], dos_time, dos_date, record['crc'],
+					record['compress_size'], record['size'], len(name), 0, 0, 0, 0,
+					record['external_attr'], record['offset']) + name)
+		end = self._out.tell()
+		self._out.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(self.records),
+				len(self.records), end - start, start, 0))
+
+def raw_chunks(in_file, info):
+	'The compressed data of ``info``, straight from the zip file'
+	in_file.seek(info.header_offset)
+	header = in_file.read(30)
+	if header[:4] != 'PK\x03\x04':
+		raise SigningError('Bad local header for {0}'.format(info.filename))
+	name_length, extra_length = struct.unpack('<HH', header[26:30])
+	in_file.seek(info.header_offset + 30 + name_length + extra_length)
+	remaining = info.compress_size
+	while remaining:
+		chunk = in_file.read(min(_COPY_SIZE, remaining))
+		if not chunk:
+			raise SigningError('{0} is truncated'.format(info.filename))
+		remaining -= len(chunk)
+		yield chunk
+
+def digesting(chunks, info, sha1):
+	'Pass on ``chunks`` of the compressed data of ``info``, adding its uncompressed data to ``sha1``'
+	if info.compress_type == zipfile.ZIP_DEFLATED:
+		decompress = zlib.decompressobj(-zlib.MAX_WBITS).decompress
+	elif info.compress_type == zipfile.ZIP_STORED:
+		decompress = None
+	else:
+		raise SigningError('{0} uses an unsupported compression method'.format(info.filename))
+	crc = 0
+	for chunk in chunks:
+		data = decompress(chunk) if decompress else chunk
+		sha1.update(data)
+		crc = zlib.crc32(data, crc)
+		yield chunk
+	if crc & 0xffffffff != info.CRC:
+		raise SigningError('Bad CRC for {0}'.format(info.filename))
+
+def copy_entry(writer, in_file, info):
+	'''Copy the entry ``info`` of the zip file ``in_file`` with ``writer``, without
+	recompressing it; the record has the SHA1 digest of its data as ``digest``
+	'''
+	sha1 = hashlib.sha1()
+	record = writer.add(info.filename, info.compress_type, info.CRC, info.compress_size,
+			info.file_size, info.date_time, info.external_attr,
+			digesting(raw_chunks(in_file, info), info, sha1),
+			flags=info.flag_bits & ~0x08)
+	record['digest'] = base64.b64encode(sha1.digest())
+	return record
+
+def add_signature(writer, key, chain):
+	'''Add the v1 signature of the entries written (or kept) so far by ``writer``
+
+	Every record must have the base64 SHA1 digest of its data as ``digest``.
+	'''
+	manifest = ['Manifest-Version: 1.0\r\nCreated-By: 1.0 (Android)\r\n\r\n']
+	signature_file = []
+	latest = (1980, 1, 1, 0, 0, 0)
+	for record in writer.records:
+		latest = max(latest, tuple(record['date_time']))
+		name = record['name']
+		if name.endswith('/'):
+			continue
+		if isinstance(name, unicode):
+			name = name.encode('utf-8')
+		section = '{name}SHA1-Digest: {digest}\r\n\r\n'.format(
+			name=_manifest_line('Name: ' + name),
+			digest=record['digest'],
+		)
+		manifest.append(section)
+		signature_file.append('{name}SHA1-Digest: {digest}\r\n\r\n'.format(
+			name=_manifest_line('Name: ' + name),
+			digest=base64.b64encode(hashlib.sha1(section).digest()),
+		))
+
+	manifest = ''.join(manifest)
+	signature_file = ''.join([
+		'Signature-Version: 1.0\r\nCreated-By: 1.0 (Android)\r\n',
+		'SHA1-Digest-Manifest: ', base64.b64encode(hashlib.sha1(manifest).digest()), '\r\n\r\n',
+	] + signature_file)
+	writer.add_data('META-INF/MANIFEST.MF', manifest, latest)
+	writer.add_data('META-INF/CERT.SF', signature_file, latest)
+	writer.add_data('META-INF/CERT.RSA', _pkcs7_signature(key, chain, signature_file), latest)
+
+def sign_and_align(in_apk, out_apk, keystore, storepass, keyalias, keypass):
+	'''Write a signed, aligned copy of the unsigned APK ``in_apk`` to ``out_apk``
+
+	:raises UnsupportedKeystore: if the key can't be used without Java; nothing
+		will have been written
+	'''
+	key, chain = load_key(keystore, storepass, keyalias, keypass)
+
+	with open(in_apk, 'rb') as in_file:
+		# only for the central directory: entries are read by raw_chunks
+		apk = zipfile.ZipFile(in_file)
+		with open(out_apk, 'wb') as out_file:
+			writer = ApkWriter(out_file)
+			for info in apk.infolist():
+				if not is_signature_file(info.filename):
+					copy_entry(writer, in_file, info)
+			add_signature(writer, key, chain)
+			writer.close()
@@ -5,6 +5,7 @@ from os import path
 from pprint import pformat
 
 import lib
+import task_manifest
 
 class ConfigurationError(lib.BASE_EXCEPTION):
 	'''Indicates there is a problem with a command.'''
@@ -40,6 +41,10 @@ class ToolConfig(dict):
 		self._flag_args = [
 			"android.purge",
 			"general.interactive",
+			"general.incremental",
+		]
+		self._int_args = [
+			"general.jobs",
 		]
 		self._multi_value_args = [
 		]
@@ -51,12 +56,44 @@ class ToolConfig(dict):
 		self._targets = targets
 		self._overrides = self._arguments_to_overrides(arguments)
 		self._defaults = self._process_defaults(defaults)
+		self._freeze()
+
+	def _freeze(self):
+		'''Merge defaults and overrides into this dictionary, which can't be changed after
+		this, and index it for the lookups we do most'''
+		merged = dict(
+			(_intern_key(key), value)
+			for key, value in self._defaults.items() + self._overrides.items()
+		)
+		dict.update(self, merged)
+		self._override_keys = frozenset(self._overrides)
+		self._exploded = None
+
+		# "a.b" -> {"c": value of "a.b.c", "c.d": value of "a.b.c.d", ...}
+		self._by_prefix = {}
+		for key, value in merged.iteritems():
+			crumbs = key.split('.')
+			for i in range(1, len(crumbs)):
+				prefix = _intern_key('.'.join(crumbs[:i]))
+				self._by_prefix.setdefault(prefix, {})['.'.join(crumbs[i:])] = value
 	
 	def all_config(self):
 		'''
 		Conflate configuration file and command-line overrides
+
+		The result is shared between calls: don't change it.
 		'''
-		return self._explode_dict(dict(self._defaults, **self._overrides))
+		if self._exploded is None:
+			self._exploded = self._explode_dict(self)
+		return self._exploded
+
+	def with_prefix(self, prefix):
+		'''All settings under ``prefix``, keyed on the rest of their names, e.g.
+		``with_prefix("android.profile")["keystore"]``
+
+		The result is shared between calls: don't change it.
+		'''
+		return self._by_prefix.get(prefix, {})
 
 	def _is_key_arg(self, arg):
 		return arg.startswith('--') or arg.startswith('-') and len(arg) == 2
@@ -103,6 +140,8 @@ class ToolConfig(dict):
 				key = self._deprecated[key]
 			if key in self._flag_args:
 				self._handle_flag_arg(key, values, overrides)
+			elif key in self._int_args:
+				self._handle_int_arg(key, values, overrides)
 			else:
 				self._handle_value_arg(key, values, overrides)
 		return overrides
@@ -117,6 +156,16 @@ class ToolConfig(dict):
 			overrides[flag] = values[-1].lower() not in ('false', 'no', 'n')
 		return overrides[flag]
 
+	def _handle_int_arg(self, key, values, overrides):
+		'''set overrides[key] to be the integer given in values'''
+		self._handle_value_arg(key, values, overrides)
+		if overrides[key] is not None:
+			try:
+				overrides[key] = int(overrides[key])
+			except ValueError:
+				raise ArgumentError("{key} requires a whole number, got {value}".format(key=key, value=overrides[key]))
+		return overrides[key]
+
 	def _handle_value_arg(self, key, values, overrides):
 		'''set overrides[key] to be values, respecting if they're multi-valued'''
 		if len(values) < 1:
@@ -203,6 +252,12 @@ class ToolConfig(dict):
 
 	def __setitem__(self, *args, **kw):
 		raise NotImplementedError("{self} is immutable".format(self=self))
+	def __delitem__(self, *args, **kw):
+		raise NotImplementedError("{self} is immutable".format(self=self))
+	def clear(self, *args, **kw):
+		raise NotImplementedError("{self} is immutable".format(self=self))
+	def popitem(self, *args, **kw):
+		raise NotImplementedError("{self} is immutable".format(self=self))
 	def set(self, *args, **kw):
 		raise NotImplementedError("{self} is immutable".format(self=self))
 	def pop(self, *args, **kw):
@@ -213,29 +268,36 @@ class ToolConfig(dict):
 		raise NotImplementedError("{self} is immutable".format(self=self))
 
 	def __getitem__(self, key):
-		if key in self._overrides:
-			value = self._overrides[key]
-			self.log.debug("Using override value {value} for {key}".format(key=key, value=value))
-			return value
-		elif key in self._defaults:
-			value = self._defaults[key]
-			self.log.debug("Using configuration file value {value} for {key}".format(key=key, value=value))
-			return value
-		else:
+		try:
+			value = dict.__getitem__(self, key)
+		except KeyError:
 			raise KeyError("No tool configuration found for key {key}: you must supply "
 					"this in your local_config.json file, or as a command-line argument".format(key=key))
-	def __contains__(self, key):
-		return key in self._overrides or key in self._defaults
+		if self.log.isEnabledFor(logging.DEBUG):
+			if key in self._override_keys:
+				self.log.debug("Using override value {value} for {key}".format(key=key, value=value))
+			else:
+				self.log.debug("Using configuration file value {value} for {key}".format(key=key, value=value))
+		return value
 	def get(self, key, default=None):
-		try:
+		if dict.__contains__(self, key):
 			return self[key]
-		except KeyError:
-			return default
+		return default
 	def has_key(self, key):
 		return key in self
 
+def _intern_key(key):
+	'Intern ASCII keys, so that repeated lookups compare by identity'
+	if isinstance(key, unicode):
+		try:
+			key = key.encode('ascii')
+		except UnicodeError:
+			return key
+	return intern(key)
+
 class Build(object):
 	tasks = {}
+	task_io = {}
 	predicates = {}
 	
 	def __init__(self, config, source_dir, output_dir, external=True,
@@ -264,7 +326,10 @@ class Build(object):
 		:param extra_args: as-yet unhandled command-line arguments
 		'''
 		super(Build, self).__init__()
+		self._config_reads = None # see _evaluate_predicate
 		self.script = []
+		self._step_filters = {} # (platform, predicate) strings -> parsed sets
+		self._predicate_results = {} # predicate name -> (config, revisions of keys read, result)
 		self.log = log if log is not None else logging.getLogger(__name__)
 		self.config = config
 		self.source_dir = path.abspath(source_dir)
@@ -282,20 +347,42 @@ class Build(object):
 		self.packaged = {} # will hold locations of packaged binaries
 		self.tool_config = ToolConfig(self.log, local_config, extra_args, self.enabled_platforms)
 		self.orig_wd = os.getcwd()
+		self.step_cache = None # set up in run(), if incremental builds are enabled
+		self.pending_rewrites = None # see customer_tasks.start_batched_rewrites
+		self.tree_snapshot = lib.TreeSnapshot() # directory listings, shared between tasks
+		self.profiler = None # set up in run(), if general.trace is given
+
+	@property
+	def config(self):
+		if self._config_reads is not None and self._config is not None:
+			return lib.ConfigReads(self._config, self._config_reads)
+		return self._config
+
+	@config.setter
+	def config(self, config):
+		# track top-level changes, so that utils.render_string can cache work derived from it
+		if config is not None and not isinstance(config, lib.RevisionedDict):
+			config = lib.RevisionedDict(config)
+		self._config = config
 		
 	def add_steps(self, steps):
 		'''Append a number of steps to the script that this runner will execute
 		
 		:param steps: a list of 5-tuple commands
 		'''
+		for step in steps:
+			self._parse_step_filters(step[0], step[1])
 		self.script += steps
 		
-	def _run_task(self, func_name, args, kw):
+	def _run_task(self, func_name, args, kw, platform=None):
 		'run an individual task'
 		if func_name == 'debug':
 			import pdb
 			pdb.set_trace()
 			return
+		if func_name not in self.tasks and func_name in task_manifest.MODULE_FOR_TASK:
+			# registers the module's tasks
+			__import__(task_manifest.MODULE_FOR_TASK[func_name], globals())
 		if func_name not in self.tasks:
 			raise ConfigurationError("{func_name} has not been registered as a task".format(func_name=func_name))
 			
@@ -303,39 +390,93 @@ class Build(object):
 		kw = kw or {}
 		self.log.debug('running %s(%s, %s)' % (func_name, args, kw))
 		try:
-			self.tasks[func_name](self, *args, **kw)
+			if self.profiler is not None:
+				with self.profiler.step(self, func_name, platform, args, kw):
+					self._run_task_or_restore(func_name, args, kw)
+			else:
+				self._run_task_or_restore(func_name, args, kw)
+			if func_name not in self.task_io:
+				# we've no idea which files were added or removed, or what in the config changed
+				self.tree_snapshot.invalidate()
+				if self._config is not None:
+					self._config.changed()
 		except Exception, e:
 			self.log.debug('%s while running %s(%s, %s)' % (e, func_name, args, kw))
 			raise
+
+	def _run_task_or_restore(self, func_name, args, kw):
+		if self.step_cache is not None:
+			self.step_cache.run_task(self, func_name, args, kw)
+		else:
+			self.tasks[func_name](self, *args, **kw)
 	
-	def _get_predicate_functions(self, predicate_str):
-		'convert a comma-separated string of predicate names to an array of functions'
-		# predicate_str can be None - meaning do in any situation
-		# or a comma-separated list of predicate names to invoke
-		predicate_meths = []
-		if predicate_str:
-			for pred_name in [p.strip() for p in predicate_str.split(',')]:
-				if pred_name not in self.predicates:
-					raise ConfigurationError(
-							"{pred_name} has not been registered as "
-							"a predicate".format(pred_name=pred_name))
-				predicate_meths.append(self.predicates[pred_name])
-		return predicate_meths
+	def _parse_step_filters(self, platform, predicate_str):
+		'''Split a step's comma-separated platforms and predicates into frozensets
+
+		:return: ``(platforms, predicate_names)``, where ``platforms`` is ``None`` for "all"
+			and ``predicate_names`` is in the order listed
+		'''
+		key = (platform, predicate_str)
+		parsed = self._step_filters.get(key)
+		if parsed is None:
+			platforms = None if platform == 'all' else frozenset(platform.split(','))
+			# predicate_str can be None - meaning do in any situation
+			# or a comma-separated list of predicate names to invoke
+			predicate_names = []
+			for pred_name in (predicate_str.split(',') if predicate_str else ()):
+				if pred_name.strip() not in predicate_names:
+					predicate_names.append(pred_name.strip())
+			predicate_names = tuple(predicate_names)
+			parsed = self._step_filters[key] = (platforms, predicate_names)
+		return parsed
+
+	def _evaluate_predicate(self, pred_name):
+		'''Result of the named predicate, re-used until a config key it read changes
+
+		:param pred_name: a registered predicate: see :meth:`_preprocess_script`
+		'''
+		cached = self._predicate_results.get(pred_name)
+		if cached is not None:
+			config, revisions, result = cached
+			if config is self._config and all(config.revision_of(key) == revision
+					for key, revision in revisions.iteritems()):
+				return result
+
+		keys_read = set()
+		outer_reads, self._config_reads = self._config_reads, keys_read
+		try:
+			result = self.predicates[pred_name](self)
+		finally:
+			self._config_reads = outer_reads
+		if outer_reads is not None:
+			# predicates calling predicates
+			outer_reads.update(keys_read)
+
+		if isinstance(self._config, lib.RevisionedDict):
+			revisions = dict((key, self._config.revision_of(key)) for key in keys_read)
+			self._predicate_results[pred_name] = (self._config, revisions, result)
+		return result
 	
 	def _preprocess_script(self, script):
 		"""Pad tuples out to 5 elements and filter by predicate and platform"""
+		enabled_platforms = frozenset(self.enabled_platforms)
 		result = []
 		for raw_command in script:
 			# pad incomplete command with Nones (e.g. no kw supplied)
 			# 5 is expected length: platform , predicate , func_name , (args) , {kw}
 			command = list(raw_command) + [None]*(5-len(raw_command))
-			platform , predicate = command[:2]
+			platforms, predicate_names = self._parse_step_filters(*command[:2])
 			
 			# "all" platform is wildcard
 			# can also configure >1 platform, comma separated, e.g. android,ios
-			if platform == 'all' or (set(platform.split(',')) & set(self.enabled_platforms)):
-				predicate_meths = self._get_predicate_functions(predicate)
-				if all(pred(self) for pred in predicate_meths):
+			if platforms is None or (platforms & enabled_platforms):
+				# every name is checked, even those after a predicate which is false
+				for pred_name in predicate_names:
+					if pred_name not in self.predicates:
+						raise ConfigurationError(
+								"{pred_name} has not been registered as "
+								"a predicate".format(pred_name=pred_name))
+				if all(self._evaluate_predicate(pred_name) for pred_name in predicate_names):
 					result.append(tuple(command))
 		return result
 		
@@ -346,9 +487,36 @@ class Build(object):
 		self.script = self._preprocess_script(self.script)
 		self.log.debug('{0} script:\n{1}'.format(self, pformat(self.script)))
 		
-		for command in self.script:
-			func_name , args , kw = command[2:]
-			self._run_task(func_name, args, kw)
+		if self.tool_config.get('general.incremental', False):
+			import step_cache
+			self.step_cache = step_cache.StepCache(path.join(self.orig_wd, '.step_cache'))
+			encodings_file = path.join(self.orig_wd, '.step_cache', 'encodings.json')
+			if lib.encoding_cache.cache_file != encodings_file:
+				# (a long-running process can keep using the one it has)
+				lib.encoding_cache = lib.EncodingCache(encodings_file)
+
+		trace_file = self.tool_config.get('general.trace')
+		if trace_file:
+			import instrument
+			self.profiler = instrument.StepProfiler()
+
+		try:
+			jobs = self.tool_config.get('general.jobs', 1)
+			if jobs > 1:
+				import scheduler
+				scheduler.run_script(self, self.script, jobs)
+			else:
+				for command in self.script:
+					platform , _ , func_name , args , kw = command
+					self._run_task(func_name, args, kw, platform)
+		finally:
+			if self.profiler is not None:
+				self.profiler.write_trace(path.join(self.orig_wd, trace_file))
+				self.log.info('step timings (trace written to {0}):\n{1}'.format(trace_file, self.profiler.summary()))
+
+		if self.step_cache is not None:
+			self.step_cache.save()
+			lib.encoding_cache.save()
 			
 		self.log.debug('{0} has finished'.format(self))
 	
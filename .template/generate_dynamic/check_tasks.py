@@ -47,6 +47,22 @@ def lint_javascript(build):
 	map(log.warning, [line for line in data.split('\n') if line])
 	log.info("JavaScript check complete")
 
+# schema filename -> (modification time, parsed schema)
+_schemas = {}
+
+def _load_schema(filename):
+	'Parse a JSON schema, re-using the last result if the file is unchanged'
+	mtime = path.getmtime(filename)
+	cached = _schemas.get(filename)
+	if cached is None or cached[0] != mtime:
+		with open(filename) as schema_file:
+			cached = _schemas[filename] = (mtime, json.load(schema_file))
+	return cached[1]
+
+def _setting_name(pointer):
+	'Turn a JSON pointer into local_config into a setting name, like "android.sdk"'
+	return '.'.join(token.replace('~1', '/').replace('~0', '~') for token in pointer.split('/')[1:])
+
 @task
 def check_local_config_schema(build):
 	log.info("Verifying your configuration settings...")
@@ -63,14 +79,21 @@ def check_local_config_schema(build):
 		if not path.isfile(local_conf_filename):
 			log.warning("Local configuration file '{file}' does not exist!".format(file=local_conf_filename))
 	
-	with open(path.join(path_to_lib(), "local_config_schema.json")) as local_conf_schema_file:
-		local_conf_schema = json.load(local_conf_schema_file)
+	local_conf_schema = _load_schema(path.join(path_to_lib(), "local_config_schema.json"))
 	
-	try:
-		validictory.validate(build.tool_config.all_config(), local_conf_schema)
-	except validictory.validator.UnexpectedPropertyError as e:
-		log.warning('Unexpected setting: "{error}". This will be ignored'.format(
+	problems = []
+	for error in sorted(validictory.find_errors(build.tool_config.all_config(), local_conf_schema),
+			key=lambda error: error.path):
+		if isinstance(error, validictory.validator.UnexpectedPropertyError):
+			log.warning('Unexpected setting: "{error}". This will be ignored'.format(
+				file=local_conf_filename,
+				error=_setting_name(error.path))
+			)
+		else:
+			problems.append('{setting}: {error}'.format(setting=_setting_name(error.path), error=error))
+	if problems:
+		raise ConfigurationError('Invalid settings in {file}:\n{problems}'.format(
 			file=local_conf_filename,
-			error=e)
+			problems='\n'.join(problems))
 		)
 	log.info("Configuration settings check complete")
@@ -0,0 +1,70 @@
+'''Connections to remote servers, shared by everything a build does.
+
+Each call to ``requests.get`` or ``urllib2.urlopen`` opens a new connection, and for
+HTTPS that means a new TLS handshake. Builds which make several calls to the same
+host (Heroku, the Forge servers) use the objects here instead, which keep
+connections open between calls: for the rest of the build, or, in the build daemon,
+for as long as the daemon runs.
+
+At most :data:`MAX_PER_HOST` idle connections are kept to each host.
+'''
+import threading
+
+# idle connections kept open to each host
+MAX_PER_HOST = 4
+
+_lock = threading.Lock()
+_session = None
+_opener = None
+_poster_pool = None
+# (forge build config, Remote created from it)
+_remote = None
+
+def session():
+	'A :class:`requests.Session` to use in place of the module-level ``requests`` functions'
+	global _session
+	with _lock:
+		if _session is None:
+			import requests
+			_session = requests.Session()
+			try:
+				from requests.adapters import HTTPAdapter
+			except ImportError:
+				# older requests: the session pools with its default limits
+				pass
+			else:
+				for prefix in ('http://', 'https://'):
+					_session.mount(prefix, HTTPAdapter(pool_maxsize=MAX_PER_HOST))
+		return _session
+
+def opener():
+	'A :mod:`urllib2` opener which can stream :mod:`poster` uploads, over kept-alive connections'
+	global _opener, _poster_pool
+	with _lock:
+		if _opener is None:
+			import urllib2
+			from poster.streaminghttp import ConnectionPool, get_handlers
+			_poster_pool = ConnectionPool(max_per_host=MAX_PER_HOST)
+			_opener = urllib2.build_opener(*get_handlers(_poster_pool))
+		return _opener
+
+def remote():
+	'A :class:`forge.remote.Remote` for the current Forge tools configuration'
+	global _remote
+	from forge import build_config
+	from forge.remote import Remote
+	config = build_config.load()
+	with _lock:
+		if _remote is None or _remote[0] != config:
+			_remote = (config, Remote(config))
+		return _remote[1]
+
+def close():
+	'Close any idle connections'
+	global _session, _opener, _poster_pool
+	with _lock:
+		if _session is not None:
+			_session.close()
+		if _poster_pool is not None:
+			_poster_pool.close()
+		_session = _opener = _poster_pool = None
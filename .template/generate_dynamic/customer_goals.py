@@ -18,9 +18,8 @@ def log_build(build, action):
 	This is called by every other function in this module, just before running
 	the build.
 	'''
-	from forge import build_config
 	import forge
-	from forge.remote import Remote
+	import connection_pool
 
 	log = {}
 	log['action']	     = action
@@ -28,8 +27,7 @@ def log_build(build, action):
 	log['version']	     = sys.version
 	log['uuid']	     = build.config['uuid']
 	log['tools_version'] = forge.VERSION
-	config = build_config.load()
-	remote = Remote(config)
+	remote = connection_pool.remote()
 	remote._authenticate()
 	remote._api_post('track/', data=log)
 
@@ -52,12 +50,15 @@ def generate_app_from_template(generate_module, build_to_run):
 		build_to_run.add_steps(generate_module.customer_phases.delete_tempdir(tempdir=tempdir))
 	else:
 		build_to_run.add_steps(generate_module.customer_phases.copy_user_source_to_template(ignore_patterns=build_to_run.ignore_patterns))
-	build_to_run.add_steps(generate_module.customer_phases.include_platform_in_html())
 	build_to_run.add_steps(generate_module.customer_phases.include_icons())
+	# placeholders in the same files are substituted together, in one pass per file
+	build_to_run.add_steps(generate_module.customer_phases.start_batched_rewrites())
+	build_to_run.add_steps(generate_module.customer_phases.include_platform_in_html())
 	build_to_run.add_steps(generate_module.customer_phases.include_name())
 	build_to_run.add_steps(generate_module.customer_phases.include_uuid())
 	build_to_run.add_steps(generate_module.customer_phases.include_author())
 	build_to_run.add_steps(generate_module.customer_phases.include_description())
+	build_to_run.add_steps(generate_module.customer_phases.apply_batched_rewrites())
 	build_to_run.add_steps(generate_module.customer_phases.make_installers())
 
 	log_build(build_to_run, "generate")
@@ -30,14 +30,14 @@ def run_hook(hook=None, dir=None):
 	]
 def copy_user_source_to_template(ignore_patterns=None, src='src'):
 	return [
-		('android', None, 'copy_files', (), { 'from': src, 'to': locations["android"], 'ignore_patterns': ignore_patterns }),
-		('ios', None, 'copy_files', (), { 'from': src, 'to': locations["ios"], 'ignore_patterns': ignore_patterns }),
-		('chrome', None, 'copy_files', (), {'from': src, 'to': locations["chrome"], 'ignore_patterns': ignore_patterns }),
-		('firefox', None, 'copy_files', (), {'from': src, 'to': locations["firefox"], 'ignore_patterns': ignore_patterns }),
-		('safari', None, 'copy_files', (), {'from': src, 'to': locations["safari"], 'ignore_patterns': ignore_patterns }),
-		('ie', None, 'copy_files', (), {'from': src, 'to': locations["ie"], 'ignore_patterns': ignore_patterns }),
-		('web', None, 'copy_files', (), {'from': src, 'to': locations["web"], 'ignore_patterns': ignore_patterns }),
-		('wp', None, 'copy_files', (), {'from': src, 'to': locations["wp"], 'ignore_patterns': ignore_patterns }),
+		('android', None, 'copy_files', (), { 'from': src, 'to': locations["android"], 'ignore_patterns': ignore_patterns, 'link': True }),
+		('ios', None, 'copy_files', (), { 'from': src, 'to': locations["ios"], 'ignore_patterns': ignore_patterns, 'link': True }),
+		('chrome', None, 'copy_files', (), {'from': src, 'to': locations["chrome"], 'ignore_patterns': ignore_patterns, 'link': True }),
+		('firefox', None, 'copy_files', (), {'from': src, 'to': locations["firefox"], 'ignore_patterns': ignore_patterns, 'link': True }),
+		('safari', None, 'copy_files', (), {'from': src, 'to': locations["safari"], 'ignore_patterns': ignore_patterns, 'link': True }),
+		('ie', None, 'copy_files', (), {'from': src, 'to': locations["ie"], 'ignore_patterns': ignore_patterns, 'link': True }),
+		('web', None, 'copy_files', (), {'from': src, 'to': locations["web"], 'ignore_patterns': ignore_patterns, 'link': True }),
+		('wp', None, 'copy_files', (), {'from': src, 'to': locations["wp"], 'ignore_patterns': ignore_patterns, 'link': True }),
 	]
 	
 def include_platform_in_html(server=False):
@@ -225,6 +225,16 @@ def include_icons(server=False):
 			'to': icon("wp", "SplashScreenImage.jpg")}),
 	]
 
+def start_batched_rewrites():
+	return [
+		('all', None, 'start_batched_rewrites'),
+	]
+
+def apply_batched_rewrites():
+	return [
+		('all', None, 'apply_batched_rewrites'),
+	]
+
 def include_name():
 	# TODO: Paths for server side builds?
 	return [
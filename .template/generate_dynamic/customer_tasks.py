@@ -1,6 +1,7 @@
 import codecs
 import fnmatch
 import glob
+import mmap
 import os
 from os import path
 import re
@@ -8,17 +9,23 @@ import shutil
 import sys
 import uuid
 
-import android_tasks
 from build import ConfigurationError
-import firefox_tasks
+import filecopy
 import lib
-from lib import task, walk_with_depth, read_file_as_str, cd
-import ios_tasks
-import safari_tasks
-import ie_tasks
+from lib import task, task_io, walk_with_depth, read_file_as_str
+import package_names
+import rewriter
 import utils
 
+def _rename_files_io(build, **kw):
+	# from is read, as well as removed
+	return [kw.get('from')], [kw.get('from'), kw.get('to')]
+
+def _copy_files_io(build, **kw):
+	return [kw.get('from')], [kw.get('to')]
+
 @task
+@task_io(_rename_files_io)
 def rename_files(build, **kw):
 	if 'from' not in kw or 'to' not in kw:
 		raise ConfigurationError('rename_files requires "from" and "to" keyword arguments')
@@ -26,53 +33,122 @@ def rename_files(build, **kw):
 	return _rename_or_copy_files(build, kw['from'], kw['to'], rename=True)
 
 @task
+@task_io(_copy_files_io)
 def copy_files(build, **kw):
 	if 'from' not in kw or 'to' not in kw:
 		raise ConfigurationError('copy_files requires "from" and "to" keyword arguments')
 		
-	return _rename_or_copy_files(build, kw['from'], kw['to'], rename=False, ignore_patterns=kw.get('ignore_patterns'))
+	return _rename_or_copy_files(build, kw['from'], kw['to'], rename=False, ignore_patterns=kw.get('ignore_patterns'), link=kw.get('link', False))
+
+# fnmatch.translate in Python 2.7 puts the end anchor and flags last: we add our own
+_TRANSLATE_SUFFIX = '\\Z(?ms)'
+# on case-insensitive filesystems, fnmatch.fnmatch ignores case
+_NAME_FLAGS = re.IGNORECASE if path.normcase('A') == 'a' else 0
 
-class Pattern(object):
-	def __init__(self, type, value):
-		self.type = type
-		self.value = value
+def _names_regex(patterns):
+	'One compiled regex matching a name against any of ``patterns``'
+	translated = []
+	for pattern in patterns:
+		regex = fnmatch.translate(pattern)
+		if regex.endswith(_TRANSLATE_SUFFIX):
+			regex = regex[:-len(_TRANSLATE_SUFFIX)]
+		translated.append('(?:{0})'.format(regex))
+	return re.compile('(?ms)(?:{0})\\Z'.format('|'.join(translated)), _NAME_FLAGS)
 
 def git_ignore(root, patterns):
-	classified_patterns = []
-	with cd(root):
-		for pattern in patterns:
-			if pattern:
-				if '/' in pattern[:-1]:
-					ignored_paths = (Pattern('path', match) for match in glob.glob(pattern))
-					classified_patterns.extend(ignored_paths)
-				else:
-					classified_patterns.append(Pattern('file', pattern))
+	'''Return a function suitable for the ``ignore`` argument of :func:`shutil.copytree`
+
+	:param root: the directory being copied; patterns containing a ``/`` are
+		relative to this
+	:param patterns: gitignore-style patterns; a trailing ``/`` only matches
+		directories, and a leading ``!`` re-includes things ignored by an earlier
+		pattern
+
+	The last pattern to match a name decides whether it is ignored. Consecutive
+	patterns of the same kind are merged into one rule, so each name is checked
+	against a handful of rules, rather than every pattern.
+	'''
+	# rules are [negated, kind, values], where kind is 'path', 'name' or 'dir_name'
+	rules = []
+	def add_rule(negated, kind, value):
+		if rules and rules[-1][0] == negated and rules[-1][1] == kind:
+			rules[-1][2].append(value)
+		else:
+			rules.append([negated, kind, [value]])
+
+	# globbed against root rather than by changing directory: steps run in parallel
+	# share the process' working directory
+	escaped_root = re.sub(r'([*?[])', r'[\1]', root)
+	for pattern in patterns:
+		negated = pattern.startswith('!')
+		if negated:
+			pattern = pattern[1:]
+		elif pattern.startswith('\\!'):
+			pattern = pattern[1:]
+		if not pattern:
+			continue
+
+		if '/' in pattern[:-1]:
+			for match in glob.glob(path.join(escaped_root, pattern)):
+				add_rule(negated, 'path', path.relpath(match, root))
+		elif pattern[-1] in ('/', '\\'):
+			add_rule(negated, 'dir_name', pattern[:-1])
+		else:
+			add_rule(negated, 'name', pattern)
+
+	compiled_rules = []
+	for negated, kind, values in reversed(rules):
+		matcher = frozenset(values) if kind == 'path' else _names_regex(values)
+		compiled_rules.append((negated, kind, matcher))
+	needs_dirs = any(kind == 'dir_name' for _, kind, _ in compiled_rules)
 
 	def git_ignorer(src, names):
 		relative_src = src[len(root):].lstrip(r"""\/""")
-		ignored = []
+		dirs = set(lib.scan_dir(src)[0]) if needs_dirs else ()
+		ignored = set()
 		for name in names:
-			for pattern in classified_patterns:
-				if pattern.type == 'path':
-					if path.join(relative_src, name) == os.path.normpath(pattern.value):
-						ignored.append(name)
-				elif pattern.type == 'file':
-					ignore_name = pattern.value
-					if pattern.value[-1] in ('/', '\\'):
-						if path.isdir(path.join(src, name)):
-							ignore_name = ignore_name[:-1]
+			relative_name = None
+			for negated, kind, matcher in compiled_rules:
+				if kind == 'path':
+					if relative_name is None:
+						relative_name = path.join(relative_src, name)
+					matched = relative_name in matcher
+				elif kind == 'dir_name':
+					matched = name in dirs and matcher.match(name) is not None
+				else:
+					matched = matcher.match(name) is not None
 
-					if fnmatch.fnmatch(name, ignore_name):
-						ignored.append(name)
+				if matched:
+					if not negated:
+						ignored.add(name)
+					break
 
-		return set(ignored)
+		return ignored
 
 	return git_ignorer
 
+def _mutated_later(build):
+	'''Return a function which says whether a file (relative to the user's ``src``
+	directory) is rewritten by later steps, so can't share data with the original'''
+	activation_scripts = set()
+	for activation in build.config.get('modules', {}).get('activations', []):
+		for script in activation.get('scripts', []):
+			if script.startswith('src/'):
+				activation_scripts.add(path.normpath(script[4:]))
+
+	def mutated_later(relative_name):
+		return relative_name.rpartition('.')[2] == 'html' or path.normpath(relative_name) in activation_scripts
+	return mutated_later
+
 @task
-def _rename_or_copy_files(build, frm, to, rename=True, ignore_patterns=None):
+def _rename_or_copy_files(build, frm, to, rename=True, ignore_patterns=None, link=False):
 	if ignore_patterns is None:
 		ignore_patterns = []
+	strategy = build.tool_config.get('general.copy_strategy', 'copy') if link else 'copy'
+	if strategy not in filecopy.STRATEGIES:
+		raise ConfigurationError('general.copy_strategy must be one of {0}, got "{1}"'.format(
+			', '.join(filecopy.STRATEGIES), strategy
+		))
 
 	from_, to = utils.render_string(build.config, frm), utils.render_string(build.config, to)
 	if path.isdir(from_):
@@ -83,6 +159,8 @@ def _rename_or_copy_files(build, frm, to, rename=True, ignore_patterns=None):
 	if rename:
 		build.log.debug('renaming {from_} to {to}'.format(**locals()))
 		shutil.move(from_, to)
+		build.tree_snapshot.invalidate(from_)
+		build.tree_snapshot.invalidate(to)
 	else:
 		if '*' in to:
 			# looks like a glob - last directory in path might not exist.
@@ -94,12 +172,27 @@ def _rename_or_copy_files(build, frm, to, rename=True, ignore_patterns=None):
 		
 		for found_to in tos:
 			build.log.debug('copying {from_} to {found_to}'.format(**locals()))
-			if path.isdir(from_):
+			if path.isdir(from_) and strategy != 'copy':
+				used = filecopy.copy_tree(from_, found_to, ignore=ignore_func, strategy=strategy, must_copy=_mutated_later(build))
+				build.log.debug('copied {copy} files, hard linked {hardlink} and reflinked {reflink}'.format(**used))
+			elif path.isdir(from_):
 				shutil.copytree(from_, found_to, ignore=ignore_func)
 			else:
 				shutil.copy(from_, found_to)
+			build.tree_snapshot.invalidate(found_to)
+
+def _files_io(build, *files, **kw):
+	return files, files
+
+def _find_and_replace_io(build, *files, **kw):
+	if build.pending_rewrites is not None:
+		# nothing is written until apply_batched_rewrites, which isn't cached by the
+		# step cache: the replacements it makes aren't part of any step's key
+		return None
+	return files, files
 
 @task
+@task_io(_find_and_replace_io)
 def find_and_replace(build, *files, **kwargs):
 	'''replace one string with another in a set of files
 	
@@ -132,9 +225,48 @@ def find_and_replace(build, *files, **kwargs):
 		if len(found_files) == 0:
 			build.log.warning('No files were found to match pattern "%s"' % glob_str)
 		for _file in found_files:
-			_replace_in_file(build, _file, find, replace)
+			if build.pending_rewrites is not None:
+				build.pending_rewrites.add(_file, find, replace)
+			else:
+				_replace_in_file(build, _file, find, replace)
+
+@task
+def start_batched_rewrites(build):
+	'''Hold back the replacements made by ``find_and_replace`` and ``find_and_replace_in_dir``
+	until ``apply_batched_rewrites``, so that each file is only read and written once'''
+	build.pending_rewrites = rewriter.FileRewrites(
+		lambda filename, replacements: _replace_many_in_file(build, filename, replacements)
+	)
+
+@task
+def apply_batched_rewrites(build):
+	'''Make all replacements held back since ``start_batched_rewrites``, rewriting up to
+	``general.jobs`` files at once'''
+	pending_rewrites, build.pending_rewrites = build.pending_rewrites, None
+	if pending_rewrites is not None:
+		pending_rewrites.flush(jobs=build.tool_config.get('general.jobs', 1))
+
+def _root_dir_io(build, root_dir, *args, **kw):
+	return [root_dir], [root_dir]
+
+def _find_and_replace_in_dir_io(build, root_dir, *args, **kw):
+	if build.pending_rewrites is not None:
+		# nothing is written until apply_batched_rewrites, which isn't cached
+		return None
+	return [root_dir], [root_dir]
+
+def _files_with_suffixes(build, root_dir, file_suffixes):
+	'''List ``(filename, depth)`` for each file under ``root_dir`` ending with one of
+	``file_suffixes``, where depth is how many directories down from ``root_dir`` it is'''
+	found = []
+	for root, _, files, depth in walk_with_depth(root_dir, snapshot=build.tree_snapshot):
+		for file_ in files:
+			if file_.rpartition('.')[2] in file_suffixes:
+				found.append((path.join(root, file_), depth))
+	return found
 
 @task
+@task_io(_find_and_replace_in_dir_io)
 def find_and_replace_in_dir(build, root_dir, find, replace, file_suffixes=("html",), template=False, **kw):
 	'For all files ending with one of the suffixes, under the root_dir, replace ``find`` with ``replace``'
 	if template:
@@ -148,25 +280,134 @@ def find_and_replace_in_dir(build, root_dir, find, replace, file_suffixes=("html
 	if len(found_roots) == 0:
 		build.log.warning('No files were found to match pattern "%s"' % root_dir)
 	for found_root in found_roots:
-		for root, _, files, depth in walk_with_depth(found_root):
-			for file_ in files:
-				if file_.rpartition('.')[2] in file_suffixes:
-					find_with_fixed_path = find.replace("%{back_to_parent}%", "../" * (depth+1))
-					replace_with_fixed_path = replace.replace("%{back_to_parent}%", "../" * (depth+1))
-					_replace_in_file(build, path.join(root, file_), find_with_fixed_path, replace_with_fixed_path)
+		for filename, depth in _files_with_suffixes(build, found_root, file_suffixes):
+			find_with_fixed_path = find.replace("%{back_to_parent}%", "../" * (depth+1))
+			replace_with_fixed_path = replace.replace("%{back_to_parent}%", "../" * (depth+1))
+			if build.pending_rewrites is not None:
+				build.pending_rewrites.add(filename, find_with_fixed_path, replace_with_fixed_path)
+			else:
+				_replace_in_file(build, filename, find_with_fixed_path, replace_with_fixed_path)
 
 def _replace_in_file(build, filename, find, replace):
-	build.log.debug("replacing {find} with {replace} in {filename}".format(**locals()))
-	
-	tmp_file = uuid.uuid4().hex
-	in_file_contents = read_file_as_str(filename)
-	in_file_contents = in_file_contents.replace(find, replace)
+	_replace_many_in_file(build, filename, [(find, replace)])
+
+_CHUNK_SIZE = 1024 * 1024
+# how much of a file chardet looks at
+_SAMPLE_SIZE = 64 * 1024
+_WIDE_BOMS = (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE, codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE)
+
+def _replace_many_in_file(build, filename, replacements):
+	for find, replace in replacements:
+		build.log.debug("replacing {find} with {replace} in {filename}".format(**locals()))
+
+	if not _might_contain(filename, [find for find, _ in replacements]):
+		# leave the file exactly as it is
+		return
+
+	stat = os.stat(filename)
+	try:
+		_stream_replace(filename, replacements, lib.encoding_cache.get(filename) or 'utf8')
+		return
+	except (UnicodeDecodeError, LookupError), e:
+		encoding = _detect_encoding(filename, getattr(e, 'file_offset', 0))
+	try:
+		_stream_replace(filename, replacements, encoding)
+		# the next copy of this file can skip straight to the right encoding
+		lib.encoding_cache.put(filename, encoding, stat)
+	except (UnicodeDecodeError, LookupError):
+		# the sample misled chardet: fall back to looking at the whole file
+		in_file_contents = read_file_as_str(filename)
+		in_file_contents = rewriter.multi_replace(in_file_contents, replacements)
+		_replace_file(filename, in_file_contents)
+
+def _might_contain(filename, finds):
+	'''Could ``filename`` contain any of ``finds``?
+
+	We look for the raw bytes without decoding the file, so only ASCII ``finds`` can be
+	ruled out, and not in UTF-16 or UTF-32 files.
+	'''
+	try:
+		needles = [find.encode('ascii') for find in finds]
+	except UnicodeError:
+		return True
+
+	with open(filename, 'rb') as in_file:
+		if os.fstat(in_file.fileno()).st_size == 0:
+			return False
+		contents = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			if contents[:4].startswith(_WIDE_BOMS):
+				return True
+			return any(contents.find(needle) != -1 for needle in needles)
+		finally:
+			contents.close()
+
+def _detect_encoding(filename, bad_offset):
+	'''Guess the encoding of ``filename`` from its start, and the region around
+	``bad_offset``, where decoding failed'''
+	with open(filename, 'rb') as in_file:
+		sample = in_file.read(_SAMPLE_SIZE)
+		if bad_offset >= _SAMPLE_SIZE:
+			in_file.seek(max(bad_offset - _SAMPLE_SIZE // 2, _SAMPLE_SIZE))
+			sample += in_file.read(_SAMPLE_SIZE)
+	return lib.guess_encoding(sample)
+
+def _stream_replace(filename, replacements, encoding):
+	'''Rewrite ``filename`` as UTF-8, making ``replacements`` as we go, a chunk at a time
+
+	:raises UnicodeDecodeError: if ``filename`` isn't in ``encoding``, with an extra
+		``file_offset`` attribute saying roughly where the problem is
+	'''
+	replacer = rewriter.StreamReplacer(replacements)
+	decoder = codecs.getincrementaldecoder(encoding)('strict')
+	tmp_file = _temp_file_for(filename)
+	try:
+		with open(filename, 'rb') as in_file:
+			with open(tmp_file, 'wb') as out_file:
+				offset = 0
+				for chunk in iter(lambda: in_file.read(_CHUNK_SIZE), ''):
+					try:
+						text = decoder.decode(chunk)
+					except UnicodeDecodeError, e:
+						e.file_offset = offset + e.start
+						raise
+					offset += len(chunk)
+					out_file.write(replacer.feed(text).encode('utf8'))
+				try:
+					text = decoder.decode('', final=True)
+				except UnicodeDecodeError, e:
+					e.file_offset = offset
+					raise
+				out_file.write((replacer.feed(text) + replacer.close()).encode('utf8'))
+	except:
+		os.remove(tmp_file)
+		raise
+	_move_into_place(tmp_file, filename)
+
+def _replace_file(filename, contents):
+	'''Write ``contents`` to a new file, then move it over ``filename``'''
+	tmp_file = _temp_file_for(filename)
 	with codecs.open(tmp_file, 'w', encoding='utf8') as out_file:
-		out_file.write(in_file_contents)
-	os.remove(filename)
+		out_file.write(contents)
+	_move_into_place(tmp_file, filename)
+
+def _temp_file_for(filename):
+	# in the same directory, so that moving it into place is a rename within one filesystem
+	return path.join(path.dirname(filename), '.{0}.{1}.tmp'.format(path.basename(filename), uuid.uuid4().hex))
+
+def _move_into_place(tmp_file, filename):
+	'''Replace ``filename`` with ``tmp_file``.
+
+	Replacing rather than overwriting means we never write through a hard link into
+	the user's source.
+	'''
+	if sys.platform.startswith('win'):
+		# can't rename over an existing file on Windows
+		os.remove(filename)
 	os.rename(tmp_file, filename)
 
 @task
+@task_io(_files_io)
 def set_in_biplist(build, filename, key, value):
 	# biplist import must be done here, as in the server context, biplist doesn't exist
 	import biplist
@@ -201,6 +442,7 @@ def resolve_urls(build, *url_locations):
 		build.config = utils.transform(build.config, location, resolve_url_with_uuid)
 
 @task
+@task_io(_root_dir_io)
 def wrap_activations(build, location):
 	'''Wrap user activation code to prevent running in frames if required
 	
@@ -209,15 +451,11 @@ def wrap_activations(build, location):
 		for activation in build.config['modules']['activations']:
 			if not 'all_frames' in activation or activation['all_frames'] is False:
 				for script in activation['scripts']:
-					tmp_file = uuid.uuid4().hex
 					filename = location+script[3:]
 					build.log.debug("wrapping activation {filename}".format(**locals()))
 					in_file_contents = read_file_as_str(filename)
 					in_file_contents = 'if (forge._disableFrames === undefined || window.location == window.parent.location) {\n'+in_file_contents+'\n}';
-					with codecs.open(tmp_file, 'w', encoding='utf8') as out_file:
-						out_file.write(in_file_contents)
-					os.remove(filename)
-					os.rename(tmp_file, filename)
+					_replace_file(filename, in_file_contents)
 		
 @task
 def populate_icons(build, platform, icon_list):
@@ -280,7 +518,11 @@ def run_hook(build, **kw):
 			if proc != None and proc.returncode != 0:
 				raise ConfigurationError('Hook script exited with a non-zero return code.')
 
+def _remove_files_io(build, *removes):
+	return [], removes
+
 @task
+@task_io(_remove_files_io)
 def remove_files(build, *removes):
 	build.log.info('deleting %d files' % len(removes))
 	for rem in removes:
@@ -290,15 +532,16 @@ def remove_files(build, *removes):
 			os.remove(real_rem)
 		else:
 			shutil.rmtree(real_rem, ignore_errors=True)
+		build.tree_snapshot.invalidate(real_rem)
 
 @task
 def populate_package_names(build):
 	build.config['package_name'] = re.sub("[^a-zA-Z0-9]", "", build.config["name"].lower()) + build.config["uuid"]
 	if "package_names" not in build.config["modules"]:
 		build.config["modules"]["package_names"] = {}
-	build.config["modules"]["package_names"]["android"] = android_tasks._generate_package_name(build)
-	build.config["modules"]["package_names"]["firefox"] = firefox_tasks._generate_package_name(build)
-	build.config["modules"]["package_names"]["safari"] = safari_tasks._generate_package_name(build)
-	build.config["modules"]["package_names"]["ios"] = ios_tasks._generate_package_name(build)
-	build.config["modules"]["package_names"]["ie"] = ie_tasks._generate_package_name(build)
+	build.config["modules"]["package_names"]["android"] = package_names.android(build)
+	build.config["modules"]["package_names"]["firefox"] = package_names.firefox(build)
+	build.config["modules"]["package_names"]["safari"] = package_names.safari(build)
+	build.config["modules"]["package_names"]["ios"] = package_names.ios(build)
+	build.config["modules"]["package_names"]["ie"] = package_names.ie(build)
 
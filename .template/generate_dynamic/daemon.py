@@ -0,0 +1,241 @@
+'''Keep generate_dynamic loaded between commands.
+
+Importing this package (and genshi, requests, chardet), registering every task and
+predicate, and loading schemas takes a noticeable part of a short ``forge build``.
+:func:`serve` runs a long-lived process which has all that done already, listening
+on a Unix socket; :func:`submit` hands a goal to it, streaming the build's log back
+to the caller's logger.
+
+Things which are safe to keep between builds are kept warm: compiled templates,
+the config schema, and the encodings of files which haven't changed. Directory
+listings are not, as we can't cheaply tell whether they're still current.
+
+Builds run one at a time, in the order they arrive. Interactive prompts aren't
+available to builds run by the daemon. While a build runs, everything logged in the
+daemon goes back to the client, not just the build's own log.
+
+Start the daemon with ``python .template/generate_dynamic serve``; :func:`run`
+(or ``python .template/generate_dynamic run <goal> <build.json>``) then uses it
+when it's running, and runs the goal in-process when it isn't.
+
+Protocol: the client sends one JSON object per line, ``{"goal": ..., "cwd": ...,
+"build": {keyword arguments for build.Build}}``. The daemon answers with any
+number of ``{"log": {"level": ..., "message": ...}}`` lines, then either
+``{"result": "ok"}`` or ``{"error": ..., "type": ...}``.
+'''
+import errno
+import json
+import logging
+import os
+from os import path
+import socket
+import SocketServer
+import stat
+import tempfile
+import threading
+import traceback
+
+from lib import BASE_EXCEPTION
+
+LOG = logging.getLogger(__name__)
+
+# the goals in customer_goals which can be run remotely
+GOALS = (
+	'generate_app_from_template',
+	'run_app',
+	'package_app',
+	'check_settings',
+)
+
+class DaemonError(BASE_EXCEPTION):
+	'A goal failed while running in the build daemon'
+	pass
+
+def default_socket_path():
+	'Where the daemon listens, unless told otherwise: one socket per user'
+	return path.join(tempfile.gettempdir(), 'forge-build-{0}.sock'.format(os.getuid()))
+
+def _send(connection, message):
+	connection.sendall(json.dumps(message) + '\n')
+
+class _ForwardingHandler(logging.Handler):
+	'Sends log records down a socket to the client that asked for the build'
+	def __init__(self, connection):
+		logging.Handler.__init__(self)
+		self._connection = connection
+		self._lock = threading.Lock()
+
+	def emit(self, record):
+		try:
+			message = {'log': {'level': record.levelno, 'message': self.format(record)}}
+			with self._lock:
+				_send(self._connection, message)
+		except socket.error:
+			# client's gone away: let the build finish regardless
+			pass
+
+class _BuildRequestHandler(SocketServer.StreamRequestHandler):
+	def handle(self):
+		line = self.rfile.readline()
+		if not line:
+			return
+		try:
+			request = json.loads(line)
+			self.server.run_goal(request, self.connection)
+			_send(self.connection, {'result': 'ok'})
+		except Exception, e:
+			LOG.debug(traceback.format_exc())
+			try:
+				_send(self.connection, {'error': str(e), 'type': type(e).__name__})
+			except socket.error:
+				pass
+
+def _check_socket_free(socket_path):
+	'''Remove whatever was left at ``socket_path`` by a daemon which didn't shut down
+	cleanly
+
+	:raises DaemonError: if a daemon is still listening there, or it isn't a socket
+	'''
+	try:
+		mode = os.stat(socket_path).st_mode
+	except OSError, e:
+		if e.errno == errno.ENOENT:
+			return
+		raise
+	if not stat.S_ISSOCK(mode):
+		raise DaemonError('{0} exists, and is not a socket'.format(socket_path))
+
+	probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		probe.connect(socket_path)
+	except socket.error, e:
+		if e.errno != errno.ECONNREFUSED:
+			raise
+	else:
+		raise DaemonError('a build daemon is already listening on {0}'.format(socket_path))
+	finally:
+		probe.close()
+	os.remove(socket_path)
+
+def _run_goal(generate_module, goal, build_kwargs, log):
+	import build
+	kw = dict((str(key), value) for key, value in build_kwargs.iteritems())
+	build_to_run = build.Build(log=log, **kw)
+	getattr(generate_module.customer_goals, goal)(generate_module, build_to_run)
+
+class BuildServer(SocketServer.UnixStreamServer):
+	'''Runs goals sent to ``socket_path``, one at a time
+
+	:param generate_module: the :mod:`generate_dynamic` package, to pass to goals
+	:raises DaemonError: if another daemon is already listening on ``socket_path``
+	'''
+	def __init__(self, socket_path, generate_module):
+		self.generate_module = generate_module
+		_check_socket_free(socket_path)
+		old_umask = os.umask(0077)
+		try:
+			SocketServer.UnixStreamServer.__init__(self, socket_path, _BuildRequestHandler)
+		finally:
+			os.umask(old_umask)
+
+	def run_goal(self, request, connection):
+		goal = request.get('goal')
+		if goal not in GOALS:
+			raise DaemonError('{0} cannot be run by the build daemon'.format(goal))
+
+		# everything logged while the build runs - the build's own log, and the
+		# module-level loggers of the tasks it runs - goes to the client
+		root = logging.getLogger()
+		handler = _ForwardingHandler(connection)
+		handler.setFormatter(logging.Formatter('%(message)s'))
+		old_level = root.level
+		root.addHandler(handler)
+		root.setLevel(logging.DEBUG)
+		orig_wd = os.getcwd()
+		try:
+			os.chdir(request['cwd'])
+			kw = dict(request.get('build', {}))
+			kw['extra_args'] = list(kw.get('extra_args') or []) + ['--general.interactive', 'false']
+			_run_goal(self.generate_module, goal, kw, logging.getLogger('forge.daemon'))
+		finally:
+			os.chdir(orig_wd)
+			root.removeHandler(handler)
+			root.setLevel(old_level)
+
+def serve(socket_path=None):
+	'''Run the build daemon until interrupted
+
+	:param socket_path: Unix socket to listen on (default: :func:`default_socket_path`)
+	'''
+	if not hasattr(socket, 'AF_UNIX'):
+		raise BASE_EXCEPTION("The build daemon isn't available on this platform")
+	import generate_dynamic
+	socket_path = socket_path or default_socket_path()
+	server = BuildServer(socket_path, generate_dynamic)
+	# only the daemon's own messages: builds' output goes to their clients
+	console = logging.StreamHandler()
+	console.setLevel(logging.INFO)
+	console.addFilter(logging.Filter(LOG.name))
+	LOG.setLevel(logging.INFO)
+	console.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+	logging.getLogger().addHandler(console)
+	LOG.info('build daemon listening on {0}'.format(socket_path))
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+		if path.exists(socket_path):
+			os.remove(socket_path)
+
+def submit(goal, build_kwargs, socket_path=None, log=None):
+	'''Ask a running daemon to run ``goal``, in the current directory
+
+	:param goal: name of a function in :mod:`customer_goals`
+	:param build_kwargs: keyword arguments for :class:`build.Build`; must be
+		JSON-serialisable (so no ``log``)
+	:param log: logger to replay the build's log messages to
+	:return: ``False`` if there's no daemon to talk to, so the caller should run
+		the goal itself; ``True`` if the goal succeeded
+	:raises DaemonError: if the goal failed
+	'''
+	if not hasattr(socket, 'AF_UNIX'):
+		return False
+	log = log or LOG
+	socket_path = socket_path or default_socket_path()
+	connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		connection.connect(socket_path)
+	except socket.error, e:
+		if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+			connection.close()
+			return False
+		raise
+
+	try:
+		_send(connection, {'goal': goal, 'cwd': os.getcwd(), 'build': build_kwargs})
+		responses = connection.makefile('rb')
+		for line in responses:
+			response = json.loads(line)
+			if 'log' in response:
+				log.log(response['log']['level'], response['log']['message'])
+			elif 'error' in response:
+				raise DaemonError('{type}: {error}'.format(**response))
+			else:
+				return True
+		raise DaemonError('lost connection to the build daemon')
+	finally:
+		connection.close()
+
+def run(goal, build_kwargs, socket_path=None, log=None):
+	'''Run ``goal`` in the build daemon if there is one, otherwise in this process
+
+	Takes the same arguments as :func:`submit`.
+	'''
+	log = log or LOG
+	if goal not in GOALS:
+		raise DaemonError('unknown goal {0}'.format(goal))
+	if submit(goal, build_kwargs, socket_path=socket_path, log=log):
+		return
+	log.debug('no build daemon running, running {0} here'.format(goal))
+	import generate_dynamic
+	_run_goal(generate_dynamic, goal, build_kwargs, log)
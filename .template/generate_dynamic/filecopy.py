@@ -0,0 +1,118 @@
+'''Copy files and trees, optionally sharing data with the source instead.
+
+Strategies:
+
+* ``copy``: an ordinary byte-for-byte copy
+* ``hardlink``: a new name for the same file; the copy *is* the source, so it must
+  never be written to in place
+* ``reflink``: a copy-on-write clone, on filesystems which support them (btrfs, XFS,
+  APFS); writing to it leaves the source alone
+* ``auto``: a reflink if possible, otherwise a hard link
+
+Whenever the requested strategy doesn't work for a file (e.g. when linking across
+devices), we fall back to a real copy.
+'''
+import errno
+import logging
+import os
+from os import path
+import shutil
+import sys
+
+LOG = logging.getLogger(__name__)
+
+STRATEGIES = ('copy', 'hardlink', 'reflink', 'auto')
+
+# from linux/fs.h: _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+def _reflink(src, dst):
+	'Make ``dst`` a copy-on-write clone of ``src``, or raise :class:`OSError`'
+	if sys.platform.startswith('linux'):
+		# not available on Windows
+		import fcntl
+		with open(src, 'rb') as src_file:
+			with open(dst, 'wb') as dst_file:
+				try:
+					fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+				except IOError, e:
+					dst_file.close()
+					os.remove(dst)
+					raise OSError(e.errno, e.strerror)
+	elif sys.platform == 'darwin':
+		import ctypes
+		import ctypes.util
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		if not hasattr(libc, 'clonefile'):
+			raise OSError(errno.ENOTSUP, 'clonefile is not available')
+		if libc.clonefile(src, dst, 0) != 0:
+			err = ctypes.get_errno()
+			raise OSError(err, os.strerror(err))
+	else:
+		raise OSError(errno.ENOTSUP, 'reflinks are not supported on {0}'.format(sys.platform))
+	# keep the modification time too, as shutil.copy2 does
+	shutil.copystat(src, dst)
+
+def copy_file(src, dst, strategy='copy'):
+	'''Copy ``src`` to ``dst`` (a file name, not a directory) using ``strategy``
+
+	:return: the strategy actually used
+	'''
+	if strategy in ('reflink', 'auto'):
+		try:
+			_reflink(src, dst)
+			return 'reflink'
+		except OSError, e:
+			LOG.debug("couldn't reflink {src}: {err}".format(src=src, err=e))
+	if strategy in ('hardlink', 'auto'):
+		try:
+			os.link(src, dst)
+			return 'hardlink'
+		except (OSError, AttributeError), e:
+			# AttributeError: no os.link on Windows
+			LOG.debug("couldn't hard link {src}: {err}".format(src=src, err=e))
+	shutil.copy2(src, dst)
+	return 'copy'
+
+def copy_tree(src, dst, ignore=None, strategy='copy', must_copy=None):
+	'''Like :func:`shutil.copytree`, but using ``strategy`` for each file
+
+	:param ignore: as for :func:`shutil.copytree`
+	:param must_copy: called with the path of each file relative to ``src``; if it
+		returns ``True``, that file is copied for real whatever ``strategy`` is
+	:return: dict of strategy -> number of files copied that way
+	'''
+	used = dict((name, 0) for name in STRATEGIES)
+	_copy_tree(src, dst, '', ignore, strategy, must_copy, used)
+	return used
+
+def _copy_tree(src, dst, relative, ignore, strategy, must_copy, used):
+	names = os.listdir(src)
+	ignored_names = ignore(src, names) if ignore is not None else set()
+
+	os.makedirs(dst)
+	errors = []
+	for name in names:
+		if name in ignored_names:
+			continue
+		src_name = path.join(src, name)
+		dst_name = path.join(dst, name)
+		relative_name = path.join(relative, name)
+		try:
+			if path.isdir(src_name):
+				_copy_tree(src_name, dst_name, relative_name, ignore, strategy, must_copy, used)
+			else:
+				file_strategy = strategy
+				if must_copy is not None and must_copy(relative_name):
+					file_strategy = 'copy'
+				used[copy_file(src_name, dst_name, file_strategy)] += 1
+		except shutil.Error, err:
+			errors.extend(err.args[0])
+		except EnvironmentError, why:
+			errors.append((src_name, dst_name, str(why)))
+	try:
+		shutil.copystat(src, dst)
+	except OSError, why:
+		errors.append((src, dst, str(why)))
+	if errors:
+		raise shutil.Error(errors)
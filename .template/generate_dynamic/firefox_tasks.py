@@ -5,6 +5,7 @@ import logging
 import sys
 
 from lib import task
+from package_names import firefox as _generate_package_name
 from utils import run_shell
 
 
@@ -32,10 +33,4 @@ def run_firefox(build, build_type_dir):
 	finally:
 		_clean_firefox(build_type_dir)
 
-def _generate_package_name(build):
-	if "package_names" not in build.config["modules"]:
-		build.config["modules"]["package_names"] = {}
-	if "firefox" not in build.config["modules"]["package_names"]:
-		build.config["modules"]["package_names"]["firefox"] = build.config["uuid"]
-	return build.config["modules"]["package_names"]["firefox"]
 
@@ -1,12 +1,11 @@
 import os
 from os import path
 import shutil, glob
-import uuid
-import hashlib
 from subprocess import PIPE, STDOUT
 
 import lib
 from lib import CouldNotLocate, task
+from package_names import ie as _generate_package_name
 
 class IEError(Exception):
 	pass
@@ -51,14 +50,4 @@ def package_ie(build, **kw):
 				))
 			)
 
-def _generate_package_name(build):
-	if "package_names" not in build.config["modules"]:
-		build.config["modules"]["package_names"] = {}
-	build.config["modules"]["package_names"]["ie"] =  _uuid_to_ms_clsid(build)
-	return build.config["modules"]["package_names"]["ie"]
 
-def _uuid_to_ms_clsid(build):
-	md5   = hashlib.md5(build.config['uuid'])
-	guid  = uuid.UUID(md5.hexdigest())
-	clsid = uuid.UUID(guid.bytes_le.encode('hex'))
-	return "{" + str(clsid).upper() + "}"
@@ -0,0 +1,86 @@
+'''Time a cold ``import generate_dynamic``, and check it loads no platform task modules.
+
+Each run is a fresh interpreter, so nothing is already imported. Platform task
+modules (see :mod:`task_manifest`) should only be imported when one of their tasks
+is first run. This exits non-zero if any of them is loaded by the import itself, or
+if the median import time is over budget.
+
+``python .template/generate_dynamic/import_benchmark.py [runs] [--budget ms]``
+'''
+import argparse
+import json
+from os import path
+import subprocess
+import sys
+
+TEMPLATE_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, TEMPLATE_DIR)
+
+from generate_dynamic.task_manifest import TASK_MODULES
+
+# not in the manifest as it registers no tasks, but still shouldn't be loaded up front
+PLATFORM_MODULES = sorted(set(TASK_MODULES) | set(['safari_tasks']))
+
+# median cold import time to stay within, in milliseconds: about 25ms when the
+# platform modules stopped being imported up front, so this leaves room for slower
+# machines while still catching a platform module (or similar) creeping back in
+BUDGET_MS = 100
+
+# run in the child interpreter: report how long the import took and what it loaded
+_CHILD = '''
+import json, sys, time
+sys.path.insert(0, {template_dir!r})
+start = time.time()
+import generate_dynamic
+elapsed = time.time() - start
+# failed relative imports leave None in sys.modules: they weren't loaded
+loaded = sorted(name for name, module in sys.modules.items() if module is not None)
+json.dump({{'elapsed': elapsed, 'modules': loaded}}, sys.stdout)
+'''
+
+def cold_import():
+	'''Import generate_dynamic in a new interpreter
+
+	:return: ``(seconds taken, names of the modules loaded)``
+	'''
+	output = subprocess.check_output(
+		[sys.executable, '-c', _CHILD.format(template_dir=TEMPLATE_DIR)])
+	result = json.loads(output)
+	return result['elapsed'], result['modules']
+
+def platform_modules_loaded(modules):
+	'Which of :data:`PLATFORM_MODULES` are among ``modules``'
+	return sorted(set(
+		name.rsplit('.', 1)[-1] for name in modules
+		if name.rsplit('.', 1)[-1] in PLATFORM_MODULES
+	))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Time a cold import of generate_dynamic')
+	parser.add_argument('runs', nargs='?', type=int, default=5, help='number of imports to time')
+	parser.add_argument('--budget', type=float, default=BUDGET_MS,
+			help='fail if the median import takes longer than this many milliseconds')
+	args = parser.parse_args(argv)
+
+	timings = []
+	for _ in range(args.runs):
+		elapsed, modules = cold_import()
+		timings.append(elapsed)
+		loaded = platform_modules_loaded(modules)
+		if loaded:
+			sys.stderr.write('importing generate_dynamic loaded {0}\n'.format(', '.join(loaded)))
+			return 1
+
+	timings.sort()
+	median = timings[len(timings) // 2] * 1000
+	print 'cold import of generate_dynamic over {runs} runs: best {best:.1f}ms, median {median:.1f}ms'.format(
+		runs=args.runs, best=timings[0] * 1000, median=median)
+	print 'no platform task modules loaded ({0})'.format(', '.join(PLATFORM_MODULES))
+	if median > args.budget:
+		sys.stderr.write('median import time {median:.1f}ms is over the budget of {budget:.1f}ms\n'.format(
+			median=median, budget=args.budget))
+		return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,160 @@
+'''Measure how long each build step takes, and what it does.
+
+For each step we record wall time, CPU time (ours and our child processes') and the
+bytes read and written. For steps whose tasks declare their paths with
+:func:`lib.task_io`, we also count the files under the step's outputs that were
+added, changed or removed while it ran, by comparing the size, modification time and
+inode of each before and after. The results can be written as a Chrome trace (load
+it in ``chrome://tracing``), and summarised per task and platform in the log.
+
+CPU and I/O counters are per-process. With ``general.jobs`` above 1, steps running at
+the same time each include the others' usage.
+'''
+from contextlib import contextmanager
+import json
+import os
+from os import path
+import threading
+import time
+
+import scheduler
+
+_PROC_IO = '/proc/self/io'
+
+def _io_counters():
+	'Bytes read and written by this process so far, or ``(None, None)`` if unavailable'
+	try:
+		with open(_PROC_IO) as proc_io:
+			counters = dict(line.split(':', 1) for line in proc_io if ':' in line)
+		return int(counters['rchar']), int(counters['wchar'])
+	except (IOError, KeyError, ValueError):
+		return None, None
+
+def _difference(after, before):
+	if after is None or before is None:
+		return None
+	return after - before
+
+def _snapshot(roots):
+	'''``path -> (size, mtime, inode)`` for every file at or under ``roots``
+
+	The inode is there because copies keep their source's size and modification time
+	(see :mod:`filecopy`): a file replaced by a copy of itself still shows up as new.
+	'''
+	files = {}
+	for root in roots:
+		if path.isfile(root):
+			filenames = [root]
+		else:
+			filenames = (path.join(dirpath, filename)
+					for dirpath, _, names in os.walk(root) for filename in names)
+		for filename in filenames:
+			try:
+				stat = os.stat(filename)
+			except OSError:
+				continue
+			files[filename] = (stat.st_size, stat.st_mtime, stat.st_ino)
+	return files
+
+def _files_changed(before, after):
+	'How many files were added, changed or removed between two :func:`_snapshot` results'
+	changed = sum(1 for filename, key in after.iteritems() if before.get(filename) != key)
+	return changed + sum(1 for filename in before if filename not in after)
+
+class StepProfiler(object):
+	'Collects measurements of each step run by a :class:`build.Build`'
+	def __init__(self):
+		self.records = []
+		self._lock = threading.Lock()
+		self._thread_ids = {}
+		self._start = time.time()
+
+	def _tid(self):
+		# small, stable numbers read better in trace viewers than thread idents
+		ident = threading.current_thread().ident
+		with self._lock:
+			return self._thread_ids.setdefault(ident, len(self._thread_ids))
+
+	@contextmanager
+	def step(self, build, func_name, platform, args, kw):
+		'Record the execution of the code in the ``with`` block as a step'
+		declared = scheduler.declared_paths(build, func_name, args, kw)
+		outputs = None
+		if declared is not None:
+			outputs = [scheduler._path_prefix(p) for p in declared[1]]
+			# before the clocks start, so the step isn't charged for it
+			files_before = _snapshot(outputs)
+		wall_before = time.time()
+		times_before = os.times()
+		read_before, written_before = _io_counters()
+		error = None
+		try:
+			yield
+		except Exception, e:
+			error = e
+			raise
+		finally:
+			times_after = os.times()
+			read_after, written_after = _io_counters()
+			record = {
+				'task': func_name,
+				'platform': platform or 'all',
+				'args': repr(args),
+				'start': wall_before,
+				'wall': time.time() - wall_before,
+				'cpu': (times_after[0] - times_before[0]) + (times_after[1] - times_before[1]),
+				'child_cpu': (times_after[2] - times_before[2]) + (times_after[3] - times_before[3]),
+				'read': _difference(read_after, read_before),
+				'written': _difference(written_after, written_before),
+				'files': None,
+				'tid': self._tid(),
+				'error': repr(error) if error is not None else None,
+			}
+			if outputs is not None:
+				record['files'] = _files_changed(files_before, _snapshot(outputs))
+			with self._lock:
+				self.records.append(record)
+
+	def write_trace(self, filename):
+		'Write the steps recorded so far as a Chrome trace-event JSON file'
+		events = []
+		for record in self.records:
+			event_args = dict((key, record[key]) for key in
+					('args', 'cpu', 'child_cpu', 'read', 'written', 'files', 'error'))
+			events.append({
+				'name': record['task'],
+				'cat': record['platform'],
+				'ph': 'X',
+				'ts': int((record['start'] - self._start) * 1000000),
+				'dur': int(record['wall'] * 1000000),
+				'pid': os.getpid(),
+				'tid': record['tid'],
+				'args': event_args,
+			})
+		with open(filename, 'w') as trace_file:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file, indent=1)
+
+	def summary(self):
+		'A table of time and I/O per task and platform, slowest first'
+		totals = {}
+		for record in self.records:
+			key = (record['task'], record['platform'])
+			total = totals.setdefault(key, {'steps': 0, 'wall': 0, 'cpu': 0, 'child_cpu': 0,
+					'read': None, 'written': None, 'files': None})
+			total['steps'] += 1
+			for field in ('wall', 'cpu', 'child_cpu', 'read', 'written', 'files'):
+				if record[field] is not None:
+					total[field] = (total[field] or 0) + record[field]
+
+		def kilobytes(count):
+			return '-' if count is None else count // 1024
+
+		row = '{0:<32} {1:<9} {2:>5} {3:>9} {4:>9} {5:>9} {6:>10} {7:>10} {8:>6}'
+		lines = [row.format('task', 'platform', 'steps', 'wall (s)', 'cpu (s)', 'child (s)',
+				'read (kB)', 'write (kB)', 'files')]
+		for (task, platform), total in sorted(totals.items(), key=lambda item: -item[1]['wall']):
+			lines.append(row.format(task, platform, total['steps'],
+				'%.3f' % total['wall'], '%.3f' % total['cpu'], '%.3f' % total['child_cpu'],
+				kilobytes(total['read']), kilobytes(total['written']),
+				'-' if total['files'] is None else total['files']))
+		return '\n'.join(lines)
@@ -16,6 +16,7 @@ from zipfile import ZipFile
 
 import lib
 from lib import temp_file, task, read_file_as_str
+from package_names import ios as _generate_package_name
 from utils import run_shell, ensure_lib_available
 
 LOG = logging.getLogger(__name__)
@@ -186,7 +187,7 @@ class IOSRunner(object):
 							
 							
 				from poster.encode import multipart_encode
-				from poster.streaminghttp import register_openers
+				import connection_pool
 				import urllib2
 
 				class FileWithProgress:
@@ -221,9 +222,6 @@ class IOSRunner(object):
 					'password': certificate_password
 				}
 
-				# Register the streaming http handlers with urllib2
-				register_openers()
-
 				# headers contains the necessary Content-Type and Content-Length
 				# datagen is a generator object that yields the encoded parameters
 				datagen, headers = multipart_encode(files)
@@ -232,7 +230,7 @@ class IOSRunner(object):
 				request = urllib2.Request("https://trigger.io/codesign/sign", datagen, headers)
 
 				with temp_file() as signed_zip_file:
-					resp = urllib2.urlopen(request)
+					resp = connection_pool.opener().open(request)
 					
 					# Read the log lines from the start of the response
 					while True:
@@ -531,9 +529,3 @@ def package_ios(build):
 		certificate_password=certificate_password,
 	)
 
-def _generate_package_name(build):
-	if "package_names" not in build.config["modules"]:
-		build.config["modules"]["package_names"] = {}
-	if "ios" not in build.config["modules"]["package_names"]:
-		build.config["modules"]["package_names"]["ios"] = "io.trigger.forge"+build.config["uuid"]
-	return build.config["modules"]["package_names"]["ios"]
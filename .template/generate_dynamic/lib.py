@@ -1,5 +1,6 @@
 from contextlib import contextmanager
 from functools import wraps
+import json
 import os
 import shutil
 from os import error, listdir
@@ -8,11 +9,24 @@ import tempfile
 import subprocess
 import sys
 import logging
+import re
 import traceback
 import signal
+import threading
+import uuid
 
 import chardet
-import requests
+
+import connection_pool
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		# fall back to listdir, and a stat per entry
+		scandir = None
 
 LOG = logging.getLogger(__name__)
 
@@ -37,6 +51,19 @@ def task(function):
 		return function(*args, **kw)
 	return wrapper
 	
+def task_io(io_function):
+	'''Declare which paths a task reads and writes, so that the scheduler can run it
+	alongside other steps which don't touch the same files.
+
+	``io_function`` is called with the same arguments as the task, and should return
+	an ``(inputs, outputs)`` pair of lists of paths (which may be globs or templates).
+	Tasks without a declaration are assumed to touch anything, including ``build.config``.
+	'''
+	def decorator(function):
+		Build.task_io[function.func_name] = io_function
+		return function
+	return decorator
+
 def predicate(function):
 	Build.predicates[function.func_name] = function
 	
@@ -45,8 +72,156 @@ def predicate(function):
 		return function(*args, **kw)
 	return wrapper
 	
+class RevisionedDict(dict):
+	'''A dictionary which counts changes to its top-level keys, so that values derived
+	from it can be cached until it next changes.
+
+	Changes to nested values are *not* counted, unless reported with :meth:`changed`.
+	'''
+	def __init__(self, *args, **kw):
+		super(RevisionedDict, self).__init__(*args, **kw)
+		self.revision = 0
+		self._key_revisions = {}
+		self._all_revision = 0
+
+	def _changed(self, keys=None):
+		self.revision += 1
+		if keys is None:
+			self._all_revision = self.revision
+		else:
+			for key in keys:
+				self._key_revisions[key] = self.revision
+
+	def changed(self, *keys):
+		'Count a change to values nested under ``keys`` (or to anything, if none are given)'
+		self._changed(keys or None)
+
+	def revision_of(self, key):
+		'The revision at which ``key`` last changed (``None`` meaning any key)'
+		if key is None:
+			return self.revision
+		return max(self._key_revisions.get(key, 0), self._all_revision)
+
+	def __setitem__(self, key, value):
+		super(RevisionedDict, self).__setitem__(key, value)
+		self._changed((key,))
+	def __delitem__(self, key):
+		super(RevisionedDict, self).__delitem__(key)
+		self._changed((key,))
+	def clear(self):
+		super(RevisionedDict, self).clear()
+		self._changed()
+	def pop(self, key, *args):
+		self._changed((key,))
+		return super(RevisionedDict, self).pop(key, *args)
+	def popitem(self):
+		item = super(RevisionedDict, self).popitem()
+		self._changed((item[0],))
+		return item
+	def setdefault(self, key, *args):
+		self._changed((key,))
+		return super(RevisionedDict, self).setdefault(key, *args)
+	def update(self, *args, **kw):
+		super(RevisionedDict, self).update(*args, **kw)
+		self._changed()
+	def copy(self):
+		return type(self)(self)
+
+class ConfigReads(object):
+	'''Read-only view of a :class:`RevisionedDict`, noting which top-level keys are read
+
+	:param config: the dictionary to look at
+	:param keys_read: a set, which will have each key read added to it; ``None`` is
+		added if the whole dictionary was looked at
+	'''
+	def __init__(self, config, keys_read):
+		self._config = config
+		self._keys_read = keys_read
+
+	def __getitem__(self, key):
+		self._keys_read.add(key)
+		return self._config[key]
+	def __contains__(self, key):
+		self._keys_read.add(key)
+		return key in self._config
+	def get(self, key, default=None):
+		self._keys_read.add(key)
+		return self._config.get(key, default)
+	def has_key(self, key):
+		return key in self
+	def __iter__(self):
+		self._keys_read.add(None)
+		return iter(self._config)
+	def __len__(self):
+		self._keys_read.add(None)
+		return len(self._config)
+	def __getattr__(self, name):
+		# keys(), items() and so on
+		self._keys_read.add(None)
+		return getattr(self._config, name)
+
+def scan_dir(top):
+	'''List ``top``, returning ``(dirs, nondirs, links)``: names of subdirectories,
+	names of everything else, and the set of subdirectories which are symlinks'''
+	dirs, nondirs, links = [], [], set()
+	if scandir is not None:
+		# the entry type normally comes straight from the directory listing, no stat needed
+		for entry in scandir(top):
+			if entry.is_dir():
+				dirs.append(entry.name)
+				if entry.is_symlink():
+					links.add(entry.name)
+			else:
+				nondirs.append(entry.name)
+	else:
+		for name in listdir(top):
+			if isdir(join(top, name)):
+				dirs.append(name)
+				if islink(join(top, name)):
+					links.add(name)
+			else:
+				nondirs.append(name)
+	return dirs, nondirs, links
+
+class TreeSnapshot(object):
+	'''Remembers directory listings, so that walking the same tree several times in
+	one build only reads it from disk once.
+
+	Tasks which create, rename or delete files must :meth:`invalidate` the paths they
+	touch; changing the contents of existing files doesn't affect the snapshot.
+	'''
+	def __init__(self):
+		self._listings = {}
+		self._lock = threading.Lock()
+
+	def listing(self, top):
+		'Like :func:`scan_dir`, but served from memory if ``top`` has been listed before'
+		key = os.path.abspath(top)
+		with self._lock:
+			cached = self._listings.get(key)
+		if cached is None:
+			cached = scan_dir(top)
+			with self._lock:
+				self._listings[key] = cached
+		dirs, nondirs, links = cached
+		# callers may prune the lists they're given
+		return list(dirs), list(nondirs), links
+
+	def invalidate(self, target=None):
+		'''Forget listings at or below ``target``, and of its parent directory
+		(or everything, if ``target`` is None)'''
+		with self._lock:
+			if target is None:
+				self._listings.clear()
+				return
+			target = os.path.abspath(target)
+			self._listings.pop(os.path.dirname(target), None)
+			for key in self._listings.keys():
+				if key == target or key.startswith(target.rstrip(os.sep) + os.sep):
+					del self._listings[key]
+
 # modified os.walk() function from Python 2.4 standard library
-def walk_with_depth(top, topdown=True, onerror=None, deeplevel=0): # fix 0
+def walk_with_depth(top, topdown=True, onerror=None, deeplevel=0, snapshot=None):
 	"""Modified directory tree generator.
 
 	For each directory in the directory tree rooted at top (including top
@@ -63,34 +238,36 @@ def walk_with_depth(top, topdown=True, onerror=None, deeplevel=0): # fix 0
 
 	----------------------------------------------------------------------
 	+ deeplevel is 0-based deep level from top directory
+	+ snapshot is an optional :class:`TreeSnapshot` to read listings from
 	----------------------------------------------------------------------
 	...
 
 	"""
+	scan = snapshot.listing if snapshot is not None else scan_dir
+
+	# (dirpath, deeplevel, listing) - listing is only set for bottom-up
+	# walks, once dirpath's children have been queued up
+	stack = [(top, deeplevel, None)]
+	while stack:
+		dirpath, depth, listing = stack.pop()
+		if listing is not None:
+			yield dirpath, listing[0], listing[1], depth
+			continue
 
-	try:
-		names = listdir(top)
-	except error, err:
-		if onerror is not None:
-			onerror(err)
-		return
-
-	dirs, nondirs = [], []
-	for name in names:
-		if isdir(join(top, name)):
-			dirs.append(name)
-		else:
-			nondirs.append(name)
+		try:
+			dirs, nondirs, links = scan(dirpath)
+		except error, err:
+			if onerror is not None:
+				onerror(err)
+			continue
 
-	if topdown:
-		yield top, dirs, nondirs, deeplevel # fix 1
-	for name in dirs:
-		path = join(top, name)
-		if not islink(path):
-			for x in walk_with_depth(path, topdown, onerror, deeplevel+1): # fix 2
-				yield x
-	if not topdown:
-		yield top, dirs, nondirs, deeplevel # fix 3
+		if topdown:
+			yield dirpath, dirs, nondirs, depth
+		else:
+			stack.append((dirpath, depth, (dirs, nondirs)))
+		for name in reversed(dirs):
+			if name not in links:
+				stack.append((join(dirpath, name), depth + 1, None))
 
 
 @contextmanager
@@ -124,17 +301,116 @@ def temp_dir():
 	finally:
 		shutil.rmtree(dir)
 
+class EncodingCache(object):
+	'''Remembers the encodings of files, keyed on their path, size and modification
+	time, so that chardet needn't look at unchanged files again.
+
+	The inode is deliberately left out: each build copies the source files afresh,
+	and the copies (see :mod:`filecopy`) keep the size and modification time of their
+	source, but not its inode.
+
+	:param cache_file: JSON file to keep the encodings in between builds; if ``None``,
+		they're only remembered for as long as this object lives
+	'''
+	def __init__(self, cache_file=None):
+		self.cache_file = cache_file
+		self._lock = threading.Lock()
+		# absolute path -> [size, mtime, encoding]
+		self._encodings = {}
+		if cache_file is not None and os.path.isfile(cache_file):
+			try:
+				with open(cache_file) as in_file:
+					self._encodings = json.load(in_file)
+			except ValueError:
+				LOG.debug('ignoring corrupt encoding cache')
+
+	def get(self, filename):
+		'The encoding last recorded for ``filename``, or ``None`` if it has changed since'
+		stat = os.stat(filename)
+		known = self._encodings.get(os.path.abspath(filename))
+		# entries from older caches have more fields, so never match
+		if known is not None and known[:-1] == [stat.st_size, stat.st_mtime]:
+			return known[-1]
+		return None
+
+	def put(self, filename, encoding, stat=None):
+		'''Record the encoding of ``filename``
+
+		:param stat: result of :func:`os.stat` at the time ``encoding`` was detected,
+			if the file might have changed since
+		'''
+		if stat is None:
+			stat = os.stat(filename)
+		with self._lock:
+			self._encodings[os.path.abspath(filename)] = [stat.st_size, stat.st_mtime, encoding]
+
+	def save(self):
+		'Write the encodings out to ``cache_file``, if we have one'
+		if self.cache_file is None:
+			return
+		if not os.path.isdir(os.path.dirname(self.cache_file)):
+			os.makedirs(os.path.dirname(self.cache_file))
+		tmp_file = self.cache_file + '.' + uuid.uuid4().hex
+		with self._lock:
+			with open(tmp_file, 'w') as out_file:
+				json.dump(self._encodings, out_file)
+		if os.path.isfile(self.cache_file):
+			os.remove(self.cache_file)
+		os.rename(tmp_file, self.cache_file)
+
+# replaced by Build.run with one that persists, for incremental builds
+encoding_cache = EncodingCache()
+
+# how much of a file chardet looks at before we try it on the whole thing
+DETECT_SAMPLE_SIZE = 256 * 1024
+_NON_ASCII = re.compile(r'[\x80-\xff]')
+
+def detect_encoding(file_contents, sample_size=DETECT_SAMPLE_SIZE):
+	'''Work out the encoding of ``file_contents``, preferring UTF-8
+
+	:param sample_size: only show chardet this many bytes at first; the whole of
+		``file_contents`` is used if the guess turns out to be wrong
+	:return: ``(encoding, decoded contents)``
+	'''
+	if _NON_ASCII.search(file_contents) is None:
+		# ASCII is valid UTF-8; no need to risk an exception
+		return 'utf8', file_contents.decode('utf8')
+	try:
+		return 'utf8', file_contents.decode('utf8', errors='strict')
+	except UnicodeDecodeError:
+		pass
+
+	if sample_size is not None and len(file_contents) > sample_size:
+		encoding = guess_encoding(file_contents[:sample_size])
+		try:
+			return encoding, file_contents.decode(encoding)
+		except (UnicodeDecodeError, LookupError):
+			LOG.debug('sample was misleading: detecting encoding from the whole file')
+
+	encoding = guess_encoding(file_contents)
+	return encoding, file_contents.decode(encoding)
+
+def guess_encoding(sample):
+	'Ask chardet for the encoding of ``sample``, defaulting to UTF-8'
+	char_result = chardet.detect(sample)
+	encoding = char_result.get('encoding', 'utf8')
+	return 'utf8' if encoding is None else encoding
+
 def read_file_as_str(filename):
+	stat = os.stat(filename)
 	with open(filename, 'rb') as in_file:
 		file_contents = in_file.read()
 
-	try:
-		unicode_res = file_contents.decode('utf8', errors='strict')
-	except UnicodeDecodeError:
-		char_result = chardet.detect(file_contents)
-		encoding = char_result.get('encoding', 'utf8')
-		encoding = 'utf8' if encoding is None else encoding
-		unicode_res = file_contents.decode(encoding)
+	encoding = encoding_cache.get(filename)
+	if encoding is not None:
+		try:
+			return file_contents.decode(encoding)
+		except (UnicodeDecodeError, LookupError):
+			# changed without its size or modification time changing
+			pass
+
+	encoding, unicode_res = detect_encoding(file_contents)
+	encoding_cache.put(filename, encoding, stat)
 	return unicode_res
 
 # TODO: this is duplicated in build tools, we should figure out a way to share
@@ -258,7 +534,7 @@ def current_call():
 def download_with_progress_bar(progress_bar_title, url, destination_path):
 	"""Download something from a given URL, emitting progress events if possible
 	"""
-	download_response = requests.get(url)
+	download_response = connection_pool.session().get(url)
 	content_length = download_response.headers.get('content-length')
 
 	with ProgressBar(progress_bar_title) as bar:
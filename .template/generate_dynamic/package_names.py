@@ -0,0 +1,48 @@
+'''Package names for each platform, derived from the app's config.
+
+These are needed when generating any platform (see
+``customer_tasks.populate_package_names``), so they're kept apart from the
+platform-specific task modules.
+'''
+import hashlib
+import uuid
+
+def android(build):
+	if "package_names" not in build.config["modules"]:
+		build.config["modules"]["package_names"] = {}
+	if "android" not in build.config["modules"]["package_names"]:
+		build.config["modules"]["package_names"]["android"] = "io.trigger.forge"+build.config["uuid"]
+	return build.config["modules"]["package_names"]["android"]
+
+def firefox(build):
+	if "package_names" not in build.config["modules"]:
+		build.config["modules"]["package_names"] = {}
+	if "firefox" not in build.config["modules"]["package_names"]:
+		build.config["modules"]["package_names"]["firefox"] = build.config["uuid"]
+	return build.config["modules"]["package_names"]["firefox"]
+
+def safari(build):
+	if "package_names" not in build.config["modules"]:
+		build.config["modules"]["package_names"] = {}
+	if "safari" not in build.config["modules"]["package_names"]:
+		build.config["modules"]["package_names"]["safari"] = "forge.safari.{package_name}".format(package_name=build.config["package_name"])
+	return build.config["modules"]["package_names"]["safari"]
+
+def ios(build):
+	if "package_names" not in build.config["modules"]:
+		build.config["modules"]["package_names"] = {}
+	if "ios" not in build.config["modules"]["package_names"]:
+		build.config["modules"]["package_names"]["ios"] = "io.trigger.forge"+build.config["uuid"]
+	return build.config["modules"]["package_names"]["ios"]
+
+def ie(build):
+	if "package_names" not in build.config["modules"]:
+		build.config["modules"]["package_names"] = {}
+	build.config["modules"]["package_names"]["ie"] =  _uuid_to_ms_clsid(build)
+	return build.config["modules"]["package_names"]["ie"]
+
+def _uuid_to_ms_clsid(build):
+	md5   = hashlib.md5(build.config['uuid'])
+	guid  = uuid.UUID(md5.hexdigest())
+	clsid = uuid.UUID(guid.bytes_le.encode('hex'))
+	return "{" + str(clsid).upper() + "}"
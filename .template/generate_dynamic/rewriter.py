@@ -0,0 +1,140 @@
+'''Apply many string replacements to a file in one pass.'''
+from os import path
+import Queue
+import re
+import sys
+import threading
+
+def multi_replace(text, replacements):
+	'''Replace every ``find`` in ``text`` with its ``replace``, scanning ``text`` once
+
+	:param replacements: sequence of ``(find, replace)`` pairs; no ``find`` should
+		overlap another (see :func:`_interferes`)
+	'''
+	if len(replacements) == 1:
+		find, replace = replacements[0]
+		return text.replace(find, replace)
+
+	lookup = dict(replacements)
+	return _pattern(replacements).sub(lambda match: lookup[match.group(0)], text)
+
+def _pattern(replacements):
+	return re.compile('|'.join(re.escape(find) for find, _ in replacements))
+
+class StreamReplacer(object):
+	'''Like :func:`multi_replace`, for text which arrives in pieces.
+
+	Only the last ``len(longest find) - 1`` characters seen are held back, as they
+	could be the start of a match.
+	'''
+	def __init__(self, replacements):
+		self._lookup = dict(replacements)
+		self._pattern = _pattern(replacements)
+		self._overlap = max(len(find) for find, _ in replacements) - 1
+		self._pending = u''
+
+	def feed(self, text):
+		'Add ``text`` to the stream, returning whatever output is now settled'
+		self._pending += text
+		return self._replace(len(self._pending) - self._overlap)
+
+	def close(self):
+		'Return the rest of the output'
+		return self._replace(len(self._pending))
+
+	def _replace(self, cut):
+		# matches starting before cut can't be affected by text still to come
+		pending, out, pos = self._pending, [], 0
+		for match in self._pattern.finditer(pending):
+			if match.start() >= cut:
+				break
+			out.append(pending[pos:match.start()])
+			out.append(self._lookup[match.group(0)])
+			pos = match.end()
+		end = max(pos, cut)
+		out.append(pending[pos:end])
+		self._pending = pending[end:]
+		return u''.join(out)
+
+def _overlaps(a, b):
+	'Could a match of ``a`` and a match of ``b`` share any characters?'
+	if a in b or b in a:
+		return True
+	for length in range(1, min(len(a), len(b))):
+		if a[-length:] == b[:length] or b[-length:] == a[:length]:
+			return True
+	return False
+
+def _interferes(find, earlier_find, earlier_replace):
+	'''Would applying ``find`` in the same pass as an earlier replacement give a
+	different result to applying them one after the other?
+
+	Applied one after the other, ``find`` could match text which includes some
+	or all of ``earlier_replace``, e.g. ``yb`` after ``a`` -> ``xy`` in ``ab``.
+	'''
+	return _overlaps(find, earlier_replace) or _overlaps(find, earlier_find)
+
+class FileRewrites(object):
+	'''Collects ``find`` -> ``replace`` substitutions per file, so that each file is
+	read and written once, however many placeholders it has.
+
+	:param apply_fn: called with ``(filename, replacements)`` to actually rewrite a file
+	'''
+	def __init__(self, apply_fn):
+		self._apply = apply_fn
+		self._pending = {}
+		self._order = []
+		self._lock = threading.Lock()
+
+	def add(self, filename, find, replace):
+		'Queue a replacement in ``filename``'
+		filename = path.abspath(filename)
+		with self._lock:
+			if filename not in self._pending:
+				self._pending[filename] = []
+				self._order.append(filename)
+			pending = self._pending[filename]
+
+			if any(_interferes(find, f, r) for f, r in pending):
+				# can't be done in the same pass: catch this file up first
+				self._apply(filename, pending)
+				pending = self._pending[filename] = []
+			pending.append((find, replace))
+
+	def flush(self, jobs=1):
+		'''Rewrite every file with replacements queued
+
+		:param jobs: how many files to rewrite at once
+		'''
+		with self._lock:
+			pending, order = self._pending, self._order
+			self._pending, self._order = {}, []
+		order = [filename for filename in order if pending[filename]]
+		if jobs <= 1 or len(order) <= 1:
+			for filename in order:
+				self._apply(filename, pending[filename])
+			return
+
+		todo = Queue.Queue()
+		for filename in order:
+			todo.put(filename)
+		errors = []
+
+		def worker():
+			while not errors:
+				try:
+					filename = todo.get_nowait()
+				except Queue.Empty:
+					return
+				try:
+					self._apply(filename, pending[filename])
+				except Exception:
+					errors.append(sys.exc_info())
+
+		threads = [threading.Thread(target=worker) for _ in range(min(jobs, len(order)))]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		if errors:
+			raise errors[0][0], errors[0][1], errors[0][2]
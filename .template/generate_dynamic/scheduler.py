@@ -0,0 +1,177 @@
+'''Run independent steps of a build script concurrently.
+
+Tasks can declare the paths they read and write using :func:`lib.task_io`. Steps
+running such tasks are collected into batches, separated by "barrier" steps: tasks
+with no declaration, which may touch anything (including ``build.config``) and so
+are run on their own. Within a batch, a step only waits for earlier steps whose
+paths overlap its own; everything else is handed straight to a pool of threads.
+'''
+import logging
+import os
+from os import path
+import Queue
+import sys
+import threading
+
+import utils
+
+LOG = logging.getLogger(__name__)
+
+_GLOB_CHARS = ('*', '?', '[')
+
+class Step(object):
+	'A single command from a build script, along with the paths it touches'
+	def __init__(self, command, inputs, outputs):
+		self.platform, _, self.func_name, self.args, self.kw = command
+		self.inputs = inputs
+		self.outputs = outputs
+		self.waiting_on = set()
+		self.dependents = []
+
+	def conflicts_with(self, other):
+		'Must this step be ordered relative to ``other``?'
+		return _overlap(self.outputs, other.inputs + other.outputs) or \
+				_overlap(other.outputs, self.inputs)
+
+	def __repr__(self):
+		return '<Step {0} ({1})>'.format(self.func_name, self.platform)
+
+def _render(build, raw_path):
+	if '$' in raw_path:
+		return utils.render_string(build.config, raw_path)
+	return raw_path
+
+def declared_paths(build, func_name, args, kw):
+	'''Return the rendered ``(inputs, outputs)`` declared by the task for a step,
+	or ``None`` if the task could touch anything'''
+	io_function = build.task_io.get(func_name)
+	if io_function is None:
+		return None
+
+	declared = io_function(build, *(args or ()), **(kw or {}))
+	if declared is None:
+		return None
+
+	inputs, outputs = declared
+	return (
+		[_render(build, p) for p in inputs if p],
+		[_render(build, p) for p in outputs if p],
+	)
+
+def _path_prefix(rendered_path):
+	'Absolute path to the deepest directory or file we know ``rendered_path`` lies under'
+	crumbs = []
+	for crumb in path.normpath(rendered_path).split(os.sep):
+		if any(char in crumb for char in _GLOB_CHARS):
+			break
+		crumbs.append(crumb)
+	return path.abspath(os.sep.join(crumbs))
+
+def _overlap(ours, theirs):
+	'Is any path in ``ours`` the same as, or a parent or child of, a path in ``theirs``?'
+	for a in ours:
+		for b in theirs:
+			if a == b or a.startswith(b.rstrip(os.sep) + os.sep) or b.startswith(a.rstrip(os.sep) + os.sep):
+				return True
+	return False
+
+def _make_step(build, command):
+	'Return a :class:`Step` for ``command``, or ``None`` if it must run as a barrier'
+	declared = declared_paths(build, *command[2:])
+	if declared is None:
+		return None
+
+	inputs, outputs = declared
+	return Step(
+		command,
+		[_path_prefix(p) for p in inputs],
+		[_path_prefix(p) for p in outputs],
+	)
+
+def run_script(build, script, jobs):
+	'''Run a preprocessed script, using up to ``jobs`` threads for independent steps
+
+	:param build: the :class:`build.Build` the script belongs to
+	:param script: list of padded 5-tuple commands
+	:param jobs: maximum number of steps to run at once
+	'''
+	batch = []
+	for command in script:
+		step = _make_step(build, command)
+		if step is not None:
+			batch.append(step)
+			continue
+
+		# barrier: everything before it must finish, and nothing after it can start
+		_run_batch(build, batch, jobs)
+		batch = []
+		platform, _, func_name, args, kw = command
+		build._run_task(func_name, args, kw, platform)
+	_run_batch(build, batch, jobs)
+
+def _run_batch(build, steps, jobs):
+	'Run a list of steps, respecting the ordering of any which conflict with each other'
+	if not steps:
+		return
+	if len(steps) == 1:
+		build._run_task(steps[0].func_name, steps[0].args, steps[0].kw, steps[0].platform)
+		return
+
+	for i, step in enumerate(steps):
+		for earlier in steps[:i]:
+			if step.conflicts_with(earlier):
+				step.waiting_on.add(earlier)
+				earlier.dependents.append(step)
+
+	ready = Queue.Queue()
+	finished = Queue.Queue()
+
+	def worker():
+		while True:
+			step = ready.get()
+			if step is None:
+				return
+			try:
+				build._run_task(step.func_name, step.args, step.kw, step.platform)
+				finished.put((step, None))
+			except Exception:
+				finished.put((step, sys.exc_info()))
+
+	num_threads = min(jobs, len(steps))
+	LOG.debug('running {0} steps on {1} threads'.format(len(steps), num_threads))
+	threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+
+	in_flight = 0
+	for step in steps:
+		if not step.waiting_on:
+			ready.put(step)
+			in_flight += 1
+
+	error = None
+	try:
+		while in_flight:
+			step, exc_info = finished.get()
+			in_flight -= 1
+			if exc_info is not None:
+				# let running steps finish, but don't start any more
+				error = error or exc_info
+				continue
+			if error is not None:
+				continue
+			for dependent in step.dependents:
+				dependent.waiting_on.discard(step)
+				if not dependent.waiting_on:
+					ready.put(dependent)
+					in_flight += 1
+	finally:
+		for _ in threads:
+			ready.put(None)
+		# don't leave workers behind, e.g. still running as the interpreter exits
+		for thread in threads:
+			thread.join()
+
+	if error is not None:
+		raise error[0], error[1], error[2]
@@ -0,0 +1,205 @@
+'''Skip build steps whose inputs haven't changed since a previous build.
+
+Only steps whose tasks declare their paths with :func:`lib.task_io` are cached. A
+step's key is a hash of the task name and arguments, the current app config and the
+contents of every file it reads. After a step runs, the files under its outputs are
+copied into a content-addressed blob store, along with a manifest; when the same
+key comes up again, the outputs are restored from the manifest instead.
+'''
+from glob import glob
+import hashlib
+import json
+import logging
+import os
+from os import path
+import shutil
+import uuid
+
+import scheduler
+
+LOG = logging.getLogger(__name__)
+
+# bump this whenever the behaviour of a cached task changes
+CACHE_VERSION = 1
+
+class StepCache(object):
+	def __init__(self, cache_dir):
+		'''Persistent cache of step outputs
+
+		:param cache_dir: directory to keep manifests and file contents in; created
+			if necessary
+		'''
+		self.cache_dir = cache_dir
+		self._blob_dir = path.join(cache_dir, 'blobs')
+		self._step_dir = path.join(cache_dir, 'steps')
+		self._hashes_file = path.join(cache_dir, 'hashes.json')
+		for directory in (self._blob_dir, self._step_dir):
+			if not path.isdir(directory):
+				os.makedirs(directory)
+
+		# absolute path -> [size, mtime, sha1], to avoid re-reading unchanged files
+		self._hashes = {}
+		if path.isfile(self._hashes_file):
+			try:
+				with open(self._hashes_file) as hashes_file:
+					self._hashes = json.load(hashes_file)
+			except ValueError:
+				LOG.debug('ignoring corrupt step cache hashes')
+
+	def save(self):
+		'Persist the file hash memo for the next build'
+		tmp_file = self._hashes_file + '.' + uuid.uuid4().hex
+		with open(tmp_file, 'w') as out_file:
+			json.dump(self._hashes, out_file)
+		if path.isfile(self._hashes_file):
+			os.remove(self._hashes_file)
+		os.rename(tmp_file, self._hashes_file)
+
+	def run_task(self, build, func_name, args, kw):
+		'Run a task, or restore its outputs from a previous run with identical inputs'
+		declared = scheduler.declared_paths(build, func_name, args, kw)
+		if declared is None:
+			build.tasks[func_name](build, *args, **kw)
+			return
+
+		inputs, outputs = declared
+		key = self._key(build, func_name, args, kw, inputs)
+		if self._restore(key):
+			for pattern in outputs:
+				build.tree_snapshot.invalidate(scheduler._path_prefix(pattern))
+			build.log.debug('restored outputs of %s(%s, %s) from step cache' % (func_name, args, kw))
+			return
+
+		build.tasks[func_name](build, *args, **kw)
+		self._record(key, outputs)
+
+	def file_hash(self, filename):
+		'SHA1 of the contents of ``filename``, re-read only if its size or mtime have changed'
+		stat = os.stat(filename)
+		known = self._hashes.get(path.abspath(filename))
+		if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime:
+			return known[2]
+
+		sha1 = hashlib.sha1()
+		with open(filename, 'rb') as in_file:
+			for chunk in iter(lambda: in_file.read(1024 * 1024), ''):
+				sha1.update(chunk)
+		return self._remember(filename, sha1.hexdigest())
+
+	def _remember(self, filename, digest):
+		stat = os.stat(filename)
+		self._hashes[path.abspath(filename)] = [stat.st_size, stat.st_mtime, digest]
+		return digest
+
+	def _files_under(self, root):
+		'Yield every file at or under ``root``, relative to ``root``'
+		if path.isfile(root):
+			yield ''
+			return
+		for dirpath, dirnames, filenames in os.walk(root):
+			dirnames.sort()
+			for filename in sorted(filenames):
+				yield path.relpath(path.join(dirpath, filename), root)
+
+	def _key(self, build, func_name, args, kw, inputs):
+		sha1 = hashlib.sha1()
+		sha1.update(repr((CACHE_VERSION, func_name, args, sorted((kw or {}).items()))))
+		sha1.update(json.dumps(build.config, sort_keys=True, default=repr))
+		for pattern in inputs:
+			matches = sorted(glob(pattern))
+			sha1.update(repr((pattern, len(matches))))
+			for root in matches:
+				for relative in self._files_under(root):
+					sha1.update(relative)
+					sha1.update(self.file_hash(_join(root, relative)))
+		return sha1.hexdigest()
+
+	def _blob_path(self, digest):
+		return path.join(self._blob_dir, digest[:2], digest)
+
+	def _manifest_path(self, key):
+		return path.join(self._step_dir, key + '.json')
+
+	def _record(self, key, outputs):
+		'Copy the current state of ``outputs`` into the cache, under ``key``'
+		manifest = {}
+		for pattern in outputs:
+			matches = glob(pattern)
+			for root in matches:
+				files = {}
+				for relative in self._files_under(root):
+					filename = _join(root, relative)
+					digest = self.file_hash(filename)
+					blob = self._blob_path(digest)
+					if not path.isfile(blob):
+						if not path.isdir(path.dirname(blob)):
+							os.makedirs(path.dirname(blob))
+						tmp_blob = blob + '.' + uuid.uuid4().hex
+						shutil.copyfile(filename, tmp_blob)
+						os.rename(tmp_blob, blob)
+					files[relative] = [digest, os.stat(filename).st_mode & 0777]
+				manifest[root] = {'is_file': path.isfile(root), 'files': files}
+			if not matches:
+				# the step removed (or never created) this path
+				manifest[pattern] = None
+
+		tmp_file = self._manifest_path(key) + '.' + uuid.uuid4().hex
+		with open(tmp_file, 'w') as out_file:
+			json.dump(manifest, out_file)
+		os.rename(tmp_file, self._manifest_path(key))
+
+	def _restore(self, key):
+		'Make the outputs recorded under ``key`` current; return ``False`` on a cache miss'
+		if not path.isfile(self._manifest_path(key)):
+			return False
+		try:
+			with open(self._manifest_path(key)) as manifest_file:
+				manifest = json.load(manifest_file)
+		except ValueError:
+			return False
+
+		for root, entry in manifest.items():
+			if entry is None:
+				continue
+			for digest, _ in entry['files'].values():
+				if not path.isfile(self._blob_path(digest)):
+					LOG.debug('step cache blob %s has gone missing' % digest)
+					return False
+
+		for root, entry in manifest.items():
+			if entry is None:
+				for existing in glob(root):
+					_remove(existing)
+				continue
+
+			if path.isdir(root) if entry['is_file'] else path.isfile(root):
+				_remove(root)
+			if path.isdir(root):
+				for relative in list(self._files_under(root)):
+					if relative not in entry['files']:
+						os.remove(path.join(root, relative))
+			elif not entry['is_file']:
+				os.makedirs(root)
+
+			for relative, (digest, mode) in entry['files'].items():
+				filename = _join(root, relative)
+				if path.isfile(filename) and self.file_hash(filename) == digest:
+					continue
+				if path.isfile(filename):
+					# don't write through a hard link into the user's source
+					os.remove(filename)
+				elif not path.isdir(path.dirname(path.abspath(filename))):
+					os.makedirs(path.dirname(path.abspath(filename)))
+				shutil.copyfile(self._blob_path(digest), filename)
+				os.chmod(filename, mode)
+				self._remember(filename, digest)
+		return True
+
+def _join(root, relative):
+	return path.join(root, relative) if relative else root
+
+def _remove(filename):
+	if path.isdir(filename):
+		shutil.rmtree(filename)
+	else:
+		os.remove(filename)
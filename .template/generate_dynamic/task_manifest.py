@@ -0,0 +1,23 @@
+'''Tasks which live in platform-specific modules, so aren't imported up front.
+
+The first time one of these tasks is run, :meth:`build.Build._run_task` imports its
+module, which registers the module's tasks as usual. Keep this in step with the
+``@task`` functions in each module.
+'''
+
+TASK_MODULES = {
+	'android_tasks': ('clean_android', 'run_android', 'package_android'),
+	'chrome_tasks': ('run_chrome', 'package_chrome'),
+	'firefox_tasks': ('clean_firefox', 'run_firefox'),
+	'ie_tasks': ('package_ie',),
+	'ios_tasks': ('run_ios', 'package_ios'),
+	'web_tasks': ('run_web', 'package_web'),
+	'wp_tasks': ('build_wp', 'package_wp', 'test_wp', 'run_wp'),
+}
+
+# task name -> module name
+MODULE_FOR_TASK = dict(
+	(task_name, module_name)
+	for module_name, task_names in TASK_MODULES.iteritems()
+	for task_name in task_names
+)
@@ -1,4 +1,5 @@
 # XXX should consolidate this with lib
+from collections import OrderedDict
 import logging
 from os import path
 import subprocess
@@ -108,19 +109,56 @@ def _handle_all(obj, steps, fn):
 #
 # # # # # # # # # # # # # # # # # # # 
 
+# compiled templates, most recently used last
+_TEMPLATE_CACHE_SIZE = 256
+_template_cache = OrderedDict()
+_template_cache_lock = threading.Lock()
+
+# (config, revision, encoded config) for the last config rendered with
+_encoded_config = (None, None, None)
+
 def render_string(config, in_s):
 	'''Render a Genshi template as a string
 	
 	:param config: data dictionary
 	:param in_s: genshi template
 	'''
-	tmpl = NewTextTemplate(in_s)
+	if '$' not in in_s and '{%' not in in_s and '{#' not in in_s:
+		# nothing for Genshi to do
+		return in_s
+
+	tmpl = _compiled_template(in_s)
 
 	# older versions of python don't allow unicode keyword arguments
 	# so we have to encode the keys (for best compatibility in the client side tools)
-	config = _encode_unicode_keys(config)
+	config = _encoded_config_for(config)
 	return tmpl.generate(**config).render('text')
 
+def _compiled_template(in_s):
+	'Return a (possibly cached) template for ``in_s``'
+	with _template_cache_lock:
+		tmpl = _template_cache.pop(in_s, None)
+		if tmpl is None:
+			tmpl = NewTextTemplate(in_s)
+			if len(_template_cache) >= _TEMPLATE_CACHE_SIZE:
+				_template_cache.popitem(last=False)
+		_template_cache[in_s] = tmpl
+	return tmpl
+
+def _encoded_config_for(config):
+	''':func:`_encode_unicode_keys` for ``config``, re-used until ``config`` changes
+	(if it's a :class:`lib.RevisionedDict`)'''
+	global _encoded_config
+	revision = getattr(config, 'revision', None)
+	if revision is None:
+		return _encode_unicode_keys(config)
+
+	cached_config, cached_revision, encoded = _encoded_config
+	if cached_config is not config or cached_revision != revision:
+		encoded = _encode_unicode_keys(config)
+		_encoded_config = (config, revision, encoded)
+	return encoded
+
 def _encode_unicode_keys(dictionary):
 	'''Returns a new dictionary constructed from the given one, but with the keys encoded as strings.
 	:param dictionary: dictionary to encode the keys for
@@ -238,10 +276,8 @@ def ensure_lib_available(build, file):
 	# File doesn't exist, or has the wrong hash or has no known hash - download
 	build.log.info("Downloading lib file: %s, this will only happen when a new file is available." % file)
 	
-	from forge.remote import Remote
-	from forge import build_config
-	config = build_config.load()
-	remote = Remote(config)
+	import connection_pool
+	remote = connection_pool.remote()
 
 	remote._get_file("https://%s/lib-static/%s/%s" % (remote.hostname, build.config['platform_version'], file), file_path)
 	
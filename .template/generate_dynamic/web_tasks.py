@@ -14,6 +14,7 @@ from urlparse import urljoin
 
 import requests
 
+import connection_pool
 import lib
 from lib import cd, task
 from utils import run_shell, ShellError
@@ -195,7 +196,7 @@ def _check_heroku_response(response):
 
 
 def _heroku_get_api_key(username, password):
-	response = requests.post(
+	response = connection_pool.session().post(
 		'https://api.heroku.com/login',
 		data={
 			'username': username,
@@ -226,7 +227,7 @@ def _heroku_get(api_key, api_url):
 		'Accept': 'application/json',
 	}
 	url = urljoin('https://api.heroku.com/', api_url)
-	response = requests.get(url, auth=auth, headers=headers)
+	response = connection_pool.session().get(url, auth=auth, headers=headers)
 	_check_heroku_response(response)
 	return response
 
@@ -239,7 +240,7 @@ def _heroku_post(api_key, api_url, data):
 		'Accept': 'application/json',
 	}
 	url = urljoin('https://api.heroku.com/', api_url)
-	response = requests.post(url, data=data, auth=auth, headers=headers)
+	response = connection_pool.session().post(url, data=data, auth=auth, headers=headers)
 	_check_heroku_response(response)
 	return response
 
@@ -6,22 +6,22 @@ as multipart/form-data suitable for a HTTP POST or PUT request.
 multipart/form-data is the standard way to upload files over HTTP"""
 
 __all__ = ['gen_boundary', 'encode_and_quote', 'MultipartParam',
-        'encode_string', 'encode_file_header', 'get_body_size', 'get_headers',
-        'multipart_encode']
+        'FileRegion', 'encode_string', 'encode_file_header', 'get_body_size',
+        'get_headers', 'multipart_encode', 'BLOCKSIZE']
 
-try:
-    import uuid
-    def gen_boundary():
-        """Returns a random string to use as the boundary for a message"""
-        return uuid.uuid4().hex
-except ImportError:
-    import random, sha
-    def gen_boundary():
-        """Returns a random string to use as the boundary for a message"""
-        bits = random.getrandbits(160)
-        return sha.new(str(bits)).hexdigest()
+import urllib, re, os, mimetypes, stat
+
+# default number of bytes to read from files, and to gather before sending;
+# large enough that per-block overhead is small next to the cost of the I/O
+BLOCKSIZE = 256 * 1024
 
-import urllib, re, os, mimetypes
+def gen_boundary():
+    """Returns a random string to use as the boundary for a message
+
+    The boundary is 128 bits from ``os.urandom``, chosen after the data to
+    send already exists, so the chance of it occurring in that data is
+    negligible and the data need not be searched for it."""
+    return os.urandom(16).encode('hex')
 try:
     from email.header import Header
 except ImportError:
@@ -38,6 +38,30 @@ def encode_and_quote(data):
         data = data.encode("utf-8")
     return urllib.quote_plus(data)
 
+def _is_real_file(fileobj):
+    """True if ``fileobj`` is a plain file object open on a regular file, so
+    its data can be sent straight from its file descriptor"""
+    if not isinstance(fileobj, file):
+        return False
+    try:
+        return stat.S_ISREG(os.fstat(fileobj.fileno()).st_mode)
+    except (OSError, ValueError):
+        return False
+
+class FileRegion(object):
+    """``size`` bytes of ``fileobj``, starting at its current position.
+
+    Yielded by :meth:`MultipartParam.iter_encode` in place of a file's data
+    when the caller can send it without reading it into memory, e.g. with
+    ``sendfile``. Whoever sends it must leave ``fileobj`` positioned at the
+    end of the region."""
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
 def _strify(s):
     """If s is a unicode string, encode it to UTF-8 and return the results,
     otherwise return str(s), or None if s is None"""
@@ -205,26 +229,36 @@ class MultipartParam(object):
 
         return "\r\n".join(headers)
 
-    def encode(self, boundary):
-        """Returns the string encoding of this parameter"""
+    def encode(self, boundary, check_boundary=True):
+        """Returns the string encoding of this parameter
+
+        If ``check_boundary`` is false, the value is not searched for
+        ``boundary``: only do that for boundaries from :func:`gen_boundary`."""
         if self.value is None:
             value = self.fileobj.read()
         else:
             value = self.value
 
-        if re.search("^--%s$" % re.escape(boundary), value, re.M):
+        if check_boundary and re.search("^--%s$" % re.escape(boundary), value, re.M):
             raise ValueError("boundary found in encoded string")
 
         return "%s%s\r\n" % (self.encode_hdr(boundary), value)
 
-    def iter_encode(self, boundary, blocksize=4096):
+    def iter_encode(self, boundary, blocksize=BLOCKSIZE, check_boundary=True,
+                    regions=False):
         """Yields the encoding of this parameter
         If self.fileobj is set, then blocks of ``blocksize`` bytes are read and
-        yielded."""
+        yielded.
+
+        If ``check_boundary`` is false, the data is not searched for
+        ``boundary``: only do that for boundaries from :func:`gen_boundary`.
+
+        If ``regions`` is true as well, and self.fileobj is a real file, a
+        single :class:`FileRegion` is yielded instead of its data."""
         total = self.get_size(boundary)
         current = 0
         if self.value is not None:
-            block = self.encode(boundary)
+            block = self.encode(boundary, check_boundary)
             current += len(block)
             yield block
             if self.cb:
@@ -235,6 +269,17 @@ class MultipartParam(object):
             yield block
             if self.cb:
                 self.cb(self, current, total)
+            if regions and not check_boundary and _is_real_file(self.fileobj):
+                region = FileRegion(self.fileobj, self.filesize)
+                current += len(region)
+                yield region
+                if self.cb:
+                    self.cb(self, current, total)
+                current += 2
+                yield "\r\n"
+                if self.cb:
+                    self.cb(self, current, total)
+                return
             last_block = ""
             encoded_boundary = "--%s" % encode_and_quote(boundary)
             boundary_exp = re.compile("^%s$" % re.escape(encoded_boundary),
@@ -247,10 +292,11 @@ class MultipartParam(object):
                     if self.cb:
                         self.cb(self, current, total)
                     break
-                last_block += block
-                if boundary_exp.search(last_block):
-                    raise ValueError("boundary found in file data")
-                last_block = last_block[-len(encoded_boundary)-2:]
+                if check_boundary:
+                    last_block += block
+                    if boundary_exp.search(last_block):
+                        raise ValueError("boundary found in file data")
+                    last_block = last_block[-len(encoded_boundary)-2:]
                 current += len(block)
                 yield block
                 if self.cb:
@@ -312,16 +358,25 @@ def get_headers(params, boundary):
     return headers
 
 class multipart_yielder:
-    def __init__(self, params, boundary, cb):
+    """Iterates over the multipart/form-data encoding of ``params``.
+
+    Small strings, such as each parameter's header, are gathered together
+    with the data that follows them, so each block yielded is at least
+    ``blocksize`` bytes, except the last one and those before a
+    :class:`FileRegion`."""
+    def __init__(self, params, boundary, cb, check_boundary=True,
+                 blocksize=BLOCKSIZE):
         self.params = params
         self.boundary = boundary
         self.cb = cb
+        self.check_boundary = check_boundary
+        self.blocksize = blocksize
+        self.regions = False
 
-        self.i = 0
         self.p = None
-        self.param_iter = None
         self.current = 0
         self.total = get_body_size(params, boundary)
+        self._blocks = None
 
     def __iter__(self):
         return self
@@ -329,41 +384,72 @@ class multipart_yielder:
     def next(self):
         """generator function to yield multipart/form-data representation
         of parameters"""
-        if self.param_iter is not None:
-            try:
-                block = self.param_iter.next()
-                self.current += len(block)
-                if self.cb:
-                    self.cb(self.p, self.current, self.total)
-                return block
-            except StopIteration:
-                self.p = None
-                self.param_iter = None
-
-        if self.i is None:
-            raise StopIteration
-        elif self.i >= len(self.params):
-            self.param_iter = None
-            self.p = None
-            self.i = None
-            block = "--%s--\r\n" % self.boundary
-            self.current += len(block)
-            if self.cb:
-                self.cb(self.p, self.current, self.total)
-            return block
-
-        self.p = self.params[self.i]
-        self.param_iter = self.p.iter_encode(self.boundary)
-        self.i += 1
-        return self.next()
+        if self._blocks is None:
+            self._blocks = self._coalesce(self._iter_pieces())
+        block = self._blocks.next()
+        self.current += len(block)
+        if self.cb:
+            self.cb(self.p, self.current, self.total)
+        return block
+
+    def _iter_pieces(self):
+        """Yields each part of the encoding as it is produced, without
+        gathering small ones together"""
+        for param in self.params:
+            self.p = param
+            for piece in param.iter_encode(self.boundary, self.blocksize,
+                    check_boundary=self.check_boundary, regions=self.regions):
+                yield piece
+        self.p = None
+        yield "--%s--\r\n" % self.boundary
+
+    def _coalesce(self, pieces):
+        pending = []
+        pending_size = 0
+        for piece in pieces:
+            if isinstance(piece, FileRegion):
+                if pending:
+                    yield "".join(pending)
+                    pending, pending_size = [], 0
+                yield piece
+                continue
+            pending.append(piece)
+            pending_size += len(piece)
+            if pending_size >= self.blocksize:
+                yield pending[0] if len(pending) == 1 else "".join(pending)
+                pending, pending_size = [], 0
+        if pending:
+            yield "".join(pending)
 
     def reset(self):
-        self.i = 0
+        self._blocks = None
+        self.p = None
         self.current = 0
         for param in self.params:
             param.reset()
 
-def multipart_encode(params, boundary=None, cb=None):
+    def iter_regions(self):
+        """Yields the same data as iterating over this object, but with a
+        :class:`FileRegion` in place of the data of each real file which
+        doesn't need searching for the boundary"""
+        self.regions = True
+        try:
+            for block in self:
+                yield block
+        finally:
+            self.regions = False
+
+    def iter_buffers(self):
+        """Yields the encoding as a ``memoryview`` of each part as it is
+        produced, without copying small parts together, for senders which can
+        write several buffers at once (e.g. with ``socket.sendmsg``)"""
+        if self._blocks is not None:
+            raise ValueError("iter_buffers must be used from the start: call reset() first")
+        self._blocks = self._iter_pieces()
+        for block in self:
+            yield memoryview(block)
+
+def multipart_encode(params, boundary=None, cb=None, blocksize=BLOCKSIZE):
     """Encode ``params`` as multipart/form-data.
 
     ``params`` should be a sequence of (name, value) pairs or MultipartParam
@@ -372,16 +458,19 @@ def multipart_encode(params, boundary=None, cb=None):
     the parameter value.  The file-like objects must support .read() and either
     .fileno() or both .seek() and .tell().
 
-    If ``boundary`` is set, then it as used as the MIME boundary.  Otherwise
-    a randomly generated boundary will be used.  In either case, if the
-    boundary string appears in the parameter values a ValueError will be
-    raised.
+    If ``boundary`` is set, then it as used as the MIME boundary, and if it
+    appears in the parameter values a ValueError will be raised.  Otherwise
+    a boundary from :func:`gen_boundary` will be used, and the parameter
+    values aren't searched for it.
 
     If ``cb`` is set, it should be a callback which will get called as blocks
     of data are encoded.  It will be called with (param, current, total),
     indicating the current parameter being encoded, the current amount encoded,
     and the total amount to encode.
 
+    ``blocksize`` is how many bytes to read from files at a time, and the
+    smallest block to yield, where possible.
+
     Returns a tuple of `datagen`, `headers`, where `datagen` is a
     generator that will yield blocks of data that make up the encoded
     parameters, and `headers` is a dictionary with the assoicated
@@ -405,10 +494,13 @@ def multipart_encode(params, boundary=None, cb=None):
     """
     if boundary is None:
         boundary = gen_boundary()
+        check_boundary = False
     else:
         boundary = urllib.quote_plus(boundary)
+        check_boundary = True
 
     headers = get_headers(params, boundary)
     params = MultipartParam.from_params(params)
 
-    return multipart_yielder(params, boundary, cb), headers
+    return multipart_yielder(params, boundary, cb, check_boundary,
+            blocksize), headers
@@ -26,18 +26,117 @@ Example usage:
 ...                       {'Content-Length': str(len(s))})
 """
 
-import httplib, urllib2, socket
+import httplib, urllib2, socket, select, errno, os, sys, threading
 from httplib import NotConnected
 
+from poster.encode import FileRegion, BLOCKSIZE
+
 __all__ = ['StreamingHTTPConnection', 'StreamingHTTPRedirectHandler',
-        'StreamingHTTPHandler', 'register_openers']
+        'StreamingHTTPHandler', 'ConnectionPool', 'KeepAliveHTTPHandler',
+        'register_openers']
 
 if hasattr(httplib, 'HTTPS'):
-    __all__.extend(['StreamingHTTPSHandler', 'StreamingHTTPSConnection'])
+    __all__.extend(['StreamingHTTPSHandler', 'StreamingHTTPSConnection',
+        'KeepAliveHTTPSHandler'])
+
+# sendfile(out_fd, in_fd, offset, count) -> bytes sent, where available
+try:
+    from os import sendfile as _sendfile
+except ImportError:
+    try:
+        # the pysendfile backport
+        from sendfile import sendfile as _sendfile
+    except ImportError:
+        _sendfile = None
+        if sys.platform.startswith('linux'):
+            try:
+                import ctypes, ctypes.util
+                _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+                _libc.sendfile64.restype = ctypes.c_ssize_t
+                _libc.sendfile64.argtypes = [ctypes.c_int, ctypes.c_int,
+                        ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+
+                def _sendfile(out_fd, in_fd, offset, count):
+                    offset = ctypes.c_int64(offset)
+                    sent = _libc.sendfile64(out_fd, in_fd, ctypes.byref(offset), count)
+                    if sent < 0:
+                        err = ctypes.get_errno()
+                        raise OSError(err, os.strerror(err))
+                    return sent
+            except (ImportError, OSError, AttributeError):
+                _sendfile = None
+
+# errors meaning sendfile can't be used for this pair of descriptors
+_SENDFILE_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK,
+        getattr(errno, 'ENOTSUP', errno.EINVAL),
+        getattr(errno, 'EOPNOTSUPP', errno.EINVAL))
+
+def _send_region(sock, region, blocksize):
+    """Send ``region`` down ``sock`` with sendfile, falling back to reading
+    it in ``blocksize`` blocks if that isn't supported for this file"""
+    fileobj = region.fileobj
+    start = fileobj.tell()
+    offset, end = start, start + region.size
+    out_fd, in_fd = sock.fileno(), fileobj.fileno()
+    while offset < end:
+        try:
+            sent = _sendfile(out_fd, in_fd, offset, end - offset)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                # sockets with a timeout are non-blocking underneath
+                if not select.select([], [out_fd], [], sock.gettimeout())[1]:
+                    raise socket.timeout("timed out")
+                continue
+            if e.errno in _SENDFILE_UNSUPPORTED and offset == start:
+                break
+            raise socket.error(e.errno, e.strerror)
+        if sent == 0:
+            raise IOError("%r ended before %d bytes could be sent" %
+                    (fileobj, region.size))
+        offset += sent
+    fileobj.seek(offset)
+
+    while offset < end:
+        data = fileobj.read(min(blocksize, end - offset))
+        if not data:
+            raise IOError("%r ended before %d bytes could be sent" %
+                    (fileobj, region.size))
+        sock.sendall(data)
+        offset += len(data)
+
+# most buffers to pass to one sendmsg call; POSIX guarantees at least 16
+_MAX_BUFFERS = 16
+
+def _send_buffers(sock, buffers, blocksize):
+    """Send each memoryview from ``buffers`` down ``sock``, gathering up to
+    ``blocksize`` bytes into each call to sendmsg"""
+    pending = []
+    pending_size = 0
+    for buf in buffers:
+        pending.append(buf)
+        pending_size += len(buf)
+        if pending_size >= blocksize or len(pending) >= _MAX_BUFFERS:
+            _sendmsg_all(sock, pending)
+            pending, pending_size = [], 0
+    if pending:
+        _sendmsg_all(sock, pending)
+
+def _sendmsg_all(sock, buffers):
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers = buffers[1:]
+        if sent:
+            buffers[0] = buffers[0][sent:]
 
 class _StreamingHTTPMixin:
     """Mixin class for HTTP and HTTPS connections that implements a streaming
     send method."""
+    # whether file data can be passed straight from its descriptor to ours;
+    # not with TLS, which has to encrypt it on the way
+    _can_sendfile = False
+
     def send(self, value):
         """Send ``value`` to the server.
 
@@ -60,7 +159,7 @@ class _StreamingHTTPMixin:
         if self.debuglevel > 0:
             print "send:", repr(value)
         try:
-            blocksize = 8192
+            blocksize = getattr(value, 'blocksize', BLOCKSIZE)
             if hasattr(value, 'read') :
                 if hasattr(value, 'seek'):
                     value.seek(0)
@@ -75,8 +174,19 @@ class _StreamingHTTPMixin:
                     value.reset()
                 if self.debuglevel > 0:
                     print "sendIng an iterable"
-                for data in value:
-                    self.sock.sendall(data)
+                if (self._can_sendfile and _sendfile is not None and
+                        hasattr(value, 'iter_regions')):
+                    for data in value.iter_regions():
+                        if isinstance(data, FileRegion):
+                            _send_region(self.sock, data, blocksize)
+                        else:
+                            self.sock.sendall(data)
+                elif (hasattr(self.sock, 'sendmsg') and
+                        hasattr(value, 'iter_buffers')):
+                    _send_buffers(self.sock, value.iter_buffers(), blocksize)
+                else:
+                    for data in value:
+                        self.sock.sendall(data)
             else:
                 self.sock.sendall(value)
         except socket.error, v:
@@ -87,6 +197,7 @@ class _StreamingHTTPMixin:
 class StreamingHTTPConnection(_StreamingHTTPMixin, httplib.HTTPConnection):
     """Subclass of `httplib.HTTPConnection` that overrides the `send()` method
     to support iterable body objects"""
+    _can_sendfile = True
 
 class StreamingHTTPRedirectHandler(urllib2.HTTPRedirectHandler):
     """Subclass of `urllib2.HTTPRedirectHandler` that overrides the
@@ -181,18 +292,226 @@ if hasattr(httplib, 'HTTPS'):
             return urllib2.HTTPSHandler.do_request_(self, req)
 
 
-def get_handlers():
-    handlers = [StreamingHTTPHandler, StreamingHTTPRedirectHandler]
+class ConnectionPool(object):
+    """Idle HTTP(S) connections, kept open so later requests to the same host
+    can use them rather than connecting (and for HTTPS, handshaking) again.
+
+    At most ``max_per_host`` idle connections are kept for each host; any
+    more are closed when their response has been read."""
+    def __init__(self, max_per_host=4):
+        self.max_per_host = max_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns an idle connection for ``key``, or None"""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        return None
+
+    def put(self, key, connection):
+        """Keeps ``connection`` for reuse, or closes it if we have enough"""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """Closes all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+class _PooledResponse(object):
+    """Wraps a response so its connection goes back to the pool once the body
+    has been read, or is closed if the response is closed before that"""
+    def __init__(self, response, release, discard):
+        self._response = response
+        self._release = release
+        self._discard = discard
+        self._done = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self._finish(self._release)
+        return data
+    recv = read
+
+    def close(self):
+        if self._response.isclosed():
+            self._finish(self._release)
+        else:
+            self._response.close()
+            self._finish(self._discard)
+
+    def _finish(self, finish):
+        if not self._done:
+            self._done = True
+            finish()
+
+# requests which can safely be sent again if a reused connection fails after
+# sending them, since the server may already have acted on them
+_IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'TRACE', 'PUT', 'DELETE'])
+# errors from the first send on a connection the server has already closed
+_STALE_SEND_ERRORS = (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED)
+
+def _is_dropped(sock):
+    """Has the server closed this idle connection?
+
+    An idle connection has nothing to read: if it's readable, the server has
+    either closed it or sent something we can't make sense of, and either way it
+    shouldn't be reused."""
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+class _KeepAliveMixin:
+    """Mixin for urllib2 handlers which reuses connections from a
+    :class:`ConnectionPool`, instead of opening one per request"""
+    def _keepalive_open(self, http_class, req, **http_conn_args):
+        if req._tunnel_host:
+            # connections through a proxy are set up per target host
+            return self.do_open(http_class, req, **http_conn_args)
+
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        key = (http_class, host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers = dict(
+            (name.title(), val) for name, val in headers.items())
+
+        h = self.pool.get(key)
+        while h is not None and (h.sock is None or _is_dropped(h.sock)):
+            h.close()
+            h = self.pool.get(key)
+        if h is not None:
+            sent = []
+            try:
+                r = self._request(h, req, headers, sent)
+            except (socket.error, httplib.HTTPException), err:
+                h.close()
+                if not self._can_retry(req, err, sent):
+                    if isinstance(err, socket.error):
+                        raise urllib2.URLError(err)
+                    raise
+                # the server closed the idle connection: try a new one
+                h = None
+        if h is None:
+            h = http_class(host, timeout=req.timeout, **http_conn_args)
+            try:
+                r = self._request(h, req, headers, [])
+            except socket.error, err:
+                h.close()
+                raise urllib2.URLError(err)
+
+        def release():
+            if h.sock is not None:
+                self.pool.put(key, h)
+
+        r = _PooledResponse(r, release, h.close)
+        if r.isclosed():
+            # no body, e.g. a HEAD request
+            r.close()
+        fp = socket._fileobject(r, close=True)
+
+        resp = urllib2.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+    def _can_retry(self, req, err, sent):
+        """May ``req`` be sent again on a new connection, having failed with
+        ``err`` on a reused one? ``sent`` records the sends completed first."""
+        if not sent and isinstance(err, socket.error) and \
+                err.errno in _STALE_SEND_ERRORS:
+            # nothing of the request got through
+            return True
+        # otherwise the server may have acted on it: only send it again if that
+        # would make no difference, and we still have the body to send
+        return req.get_method() in _IDEMPOTENT_METHODS and \
+                (req.data is None or isinstance(req.data, str))
+
+    def _request(self, h, req, headers, sent):
+        """Send ``req`` on ``h`` and return the response, appending to ``sent``
+        for each completed send"""
+        h.set_debuglevel(self._debuglevel)
+        if h.sock is not None:
+            # reused: this request may want a different timeout
+            timeout = req.timeout
+            if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                timeout = socket.getdefaulttimeout()
+            h.sock.settimeout(timeout)
+        send = h.send
+        def counting_send(data):
+            send(data)
+            sent.append(True)
+        h.send = counting_send
+        try:
+            h.request(req.get_method(), req.get_selector(), req.data, headers)
+        finally:
+            del h.send
+        try:
+            return h.getresponse(buffering=True)
+        except TypeError: # buffering kw not supported
+            return h.getresponse()
+
+class KeepAliveHTTPHandler(_KeepAliveMixin, StreamingHTTPHandler):
+    """Subclass of :class:`StreamingHTTPHandler` which keeps connections
+    open in ``pool`` between requests"""
+    def __init__(self, pool, debuglevel=0):
+        StreamingHTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def http_open(self, req):
+        return self._keepalive_open(StreamingHTTPConnection, req)
+
+if hasattr(httplib, 'HTTPS'):
+    class KeepAliveHTTPSHandler(_KeepAliveMixin, StreamingHTTPSHandler):
+        """Subclass of :class:`StreamingHTTPSHandler` which keeps
+        connections open in ``pool`` between requests"""
+        def __init__(self, pool, debuglevel=0):
+            StreamingHTTPSHandler.__init__(self, debuglevel)
+            self.pool = pool
+
+        def https_open(self, req):
+            return self._keepalive_open(StreamingHTTPSConnection, req)
+
+def get_handlers(pool=None):
+    """Returns the streaming handlers; if ``pool`` is given, ones which keep
+    connections open in that :class:`ConnectionPool`"""
+    if pool is None:
+        handlers = [StreamingHTTPHandler, StreamingHTTPRedirectHandler]
+        if hasattr(httplib, "HTTPS"):
+            handlers.append(StreamingHTTPSHandler)
+        return handlers
+
+    handlers = [KeepAliveHTTPHandler(pool), StreamingHTTPRedirectHandler]
     if hasattr(httplib, "HTTPS"):
-        handlers.append(StreamingHTTPSHandler)
+        handlers.append(KeepAliveHTTPSHandler(pool))
     return handlers
-    
-def register_openers():
+
+def register_openers(pool=None):
     """Register the streaming http handlers in the global urllib2 default
-    opener object.
+    opener object. If ``pool`` is given, connections are kept open in it
+    for reuse.
 
     Returns the created OpenerDirector object."""
-    opener = urllib2.build_opener(*get_handlers())
+    opener = urllib2.build_opener(*get_handlers(pool))
 
     urllib2.install_opener(opener)
 
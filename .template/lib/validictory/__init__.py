@@ -2,9 +2,13 @@
 
 from validictory.validator import SchemaValidator, ValidationError, SchemaError
 
-__all__ = ['validate', 'SchemaValidator', 'ValidationError', 'SchemaError']
+__all__ = ['validate', 'find_errors', 'SchemaValidator', 'ValidationError', 'SchemaError']
 __version__ = '0.8.0'
 
+# (required_by_default, blank_by_default) -> SchemaValidator, so that schemas
+# validated repeatedly with the default settings are only compiled once
+_default_validators = {}
+
 
 def validate(data, schema, validator_cls=SchemaValidator, default_location="_data",
              format_validators=None, required_by_default=True, blank_by_default=False):
@@ -22,10 +26,39 @@ def validate(data, schema, validator_cls=SchemaValidator, default_location="_dat
     :param format_validators: optional dictionary of custom format validators
     :param required_by_default: defaults to True, set to False to make
         ``required`` schema attribute False by default.
+
+    Schemas are compiled the first time they're used with the default
+    validator and format validators, and the compiled form is reused for
+    later calls with the same schema object, so don't modify a schema after
+    passing it in.
     '''
-    v = validator_cls(format_validators, required_by_default, blank_by_default)
+    v = _validator(validator_cls, format_validators, required_by_default, blank_by_default)
     return v.validate(data, schema, default_location)
 
+
+def find_errors(data, schema, validator_cls=SchemaValidator, format_validators=None,
+                required_by_default=True, blank_by_default=False):
+    '''
+    Validates a parsed json document against the provided schema, returning
+    every :class:`ValidationError` found rather than raising the first.
+
+    Each error has ``path`` (a JSON pointer to the offending value),
+    ``keyword`` (the schema attribute that failed) and ``value`` set. Takes
+    the same parameters as :func:`validate`.
+    '''
+    v = _validator(validator_cls, format_validators, required_by_default, blank_by_default)
+    return v.find_errors(data, schema)
+
+
+def _validator(validator_cls, format_validators, required_by_default, blank_by_default):
+    if validator_cls is SchemaValidator and format_validators is None:
+        key = (required_by_default, blank_by_default)
+        v = _default_validators.get(key)
+        if v is None:
+            v = _default_validators[key] = validator_cls(None, required_by_default, blank_by_default)
+        return v
+    return validator_cls(format_validators, required_by_default, blank_by_default)
+
 if __name__ == '__main__':
     import sys
     import json
@@ -1,6 +1,7 @@
 import re
 import sys
 import copy
+import threading
 from datetime import datetime
 import warnings
 from collections import Mapping, Container
@@ -14,6 +15,38 @@ else:
 # if given in properties in a schema, will be used to match against any non-explicit properties found
 FIELD_WILDCARD = "*"
 
+# regular expressions used by schemas, compiled once per pattern
+_regexes = {}
+
+# most compiled schemas a validator keeps; some schemas are built on the fly
+# during validation, so there's no natural limit
+_MAX_COMPILED = 1000
+
+def _json_pointer(tokens):
+    return ''.join('/' + unicode(token).replace('~', '~0').replace('/', '~1')
+                   for token in tokens)
+
+class _Root(dict):
+    """
+    the wrapper :meth:`SchemaValidator._validate` puts data in, so it can be
+    checked as a field: not part of the path to anything
+    """
+
+class _FindErrorsState(threading.local):
+    # errors found so far by find_errors in this thread; None when validate
+    # should raise on the first error instead
+    errors = None
+
+    def __init__(self):
+        # keys and indices leading to the field being checked
+        self.path = []
+
+def _regex(pattern):
+    regex = _regexes.get(pattern)
+    if regex is None:
+        regex = _regexes[pattern] = re.compile(pattern)
+    return regex
+
 class SchemaError(ValueError):
     """
     errors encountered in processing a schema (subclass of :class:`ValueError`)
@@ -24,7 +57,14 @@ class ValidationError(ValueError):
     """
     validation errors encountered during validation (subclass of
     :class:`ValueError`)
+
+    Errors returned by :meth:`SchemaValidator.find_errors` also have
+    ``path``, a JSON pointer to the offending value, ``keyword``, the schema
+    attribute which failed, and ``value``, the offending value itself.
     """
+    path = None
+    keyword = None
+    value = None
 
 class UnexpectedPropertyError(ValidationError):
     """
@@ -82,6 +122,9 @@ class SchemaValidator(object):
         self._format_validators = format_validators
         self.required_by_default = required_by_default
         self.blank_by_default = blank_by_default
+        # id(schema) -> (schema, compiled checker), see _compile
+        self._compiled = {}
+        self._state = _FindErrorsState()
 
     def register_format_validator(self, format_name, format_validator_fun):
         self._format_validators[format_name] = format_validator_fun
@@ -196,13 +239,13 @@ class SchemaValidator(object):
                     else:
                         for itemIndex in range(len(items)):
                             try:
-                                self.validate(value[itemIndex], items[itemIndex])
+                                self._descend(itemIndex, self.validate, value[itemIndex], items[itemIndex])
                             except ValueError as e:
                                 raise type(e)("Failed to validate field '%s' list schema: %s" % (fieldname, e))
                 elif isinstance(items, dict):
-                    for eachItem in value:
+                    for itemIndex, eachItem in enumerate(value):
                         try:
-                            self._validate(eachItem, items)
+                            self._descend(itemIndex, self._validate, eachItem, items)
                         except ValueError as e:
                             # a bit of a hack: replace reference to config
                             # with 'list item' so error messages make sense
@@ -240,9 +283,10 @@ class SchemaValidator(object):
         value_obj = x.get(fieldname)
 
         for pattern, schema in patternproperties.items():
+            regex = _regex(pattern)
             for key, value in value_obj.items():
-                if re.match(pattern, key):
-                    self.validate(value, schema)
+                if regex.match(key):
+                    self._descend(key, self.validate, value, schema)
 
     def validate_additionalItems(self, x, fieldname, schema, additionalItems=False):
         value = x.get(fieldname)
@@ -258,9 +302,12 @@ class SchemaValidator(object):
                 self._error("Length of list %(value)r for field '%(fieldname)s' is not equal to length of schema list",
                              value, fieldname)
 
-        remaining = value[len(schema['items']):]
-        if len(remaining) > 0:
-            self._validate(remaining, {'items': additionalItems})
+        for itemIndex in range(len(schema['items']), len(value)):
+            try:
+                self._descend(itemIndex, self._validate, value[itemIndex], additionalItems)
+            except ValueError as e:
+                old_error = str(e).replace("field 'config'", 'list item')
+                raise type(e)("Failed to validate field '%s' list schema: %s" % (fieldname, old_error))
 
     def validate_additionalProperties(self, x, fieldname, schema,
                                       additionalProperties=None):
@@ -286,7 +333,12 @@ class SchemaValidator(object):
                     # then we don't accept any additional properties.
                     if (isinstance(additionalProperties, bool) and
                         not additionalProperties):
-                        raise UnexpectedPropertyError(eachProperty)
+                        error = UnexpectedPropertyError(eachProperty)
+                        if self._state.errors is None:
+                            raise error
+                        self._add_error(error, 'additionalProperties',
+                                        value[eachProperty], eachProperty)
+                        continue
                     self.__validate(eachProperty, value,
                                     additionalProperties)
         else:
@@ -395,7 +447,7 @@ class SchemaValidator(object):
         '''
         value = x.get(fieldname)
         if isinstance(value, _str_type):
-            if not re.match(pattern, value):
+            if not _regex(pattern).match(value):
                 self._error("Value %(value)r for field '%(fieldname)s' does not match regular expression '%(pattern)s'",
                             value, fieldname, pattern=pattern)
 
@@ -485,46 +537,135 @@ class SchemaValidator(object):
         '''
         self._validate(data, schema, location="")
 
+    def find_errors(self, data, schema):
+        '''
+        Validates a piece of json data against the provided json-schema,
+        carrying on past errors rather than raising the first one.
+
+        :return: list of every :class:`ValidationError` found, with ``path``,
+            ``keyword`` and ``value`` set
+        '''
+        state = self._state
+        state.errors = []
+        try:
+            self._validate(data, schema, location="")
+            return state.errors
+        finally:
+            state.errors = None
+            state.path = []
+
     def _validate(self, data, schema, location="config"):
-        self.__validate("config", {"config": data}, schema, location)
+        self.__validate("config", _Root(config=data), schema, location)
+
+    def _descend(self, token, validate, data, schema):
+        '''
+        Calls ``validate(data, schema)`` for the value found at ``token`` in
+        the field being checked
+        '''
+        path = self._state.path
+        path.append(token)
+        try:
+            validate(data, schema)
+        finally:
+            path.pop()
+
+    def _add_error(self, error, keyword, value, token=None):
+        path = self._state.path
+        if token is not None:
+            path = path + [token]
+        error.path = _json_pointer(path)
+        error.keyword = keyword
+        error.value = value
+        self._state.errors.append(error)
+
+    def _compile(self, schema):
+        '''
+        Returns a function checking a field against ``schema``, with the
+        validator for each of its attributes looked up in advance.
+
+        Compiled schemas are kept for the lifetime of the validator, keyed on
+        the schema's identity, so a schema must not be modified once it has
+        been used. Schemas nested in it are compiled when first visited.
+        '''
+        compiled = self._compiled.get(id(schema))
+        if compiled is not None and compiled[0] is schema:
+            return compiled[1]
+
+        if not isinstance(schema, dict):
+            raise SchemaError("Schema structure is invalid.")
+
+        newschema = copy.copy(schema)
+
+        # handle 'optional', replace it with 'required'
+        if 'required' in schema and 'optional' in schema:
+            raise SchemaError('cannot specify optional and required')
+        elif 'optional' in schema:
+            warnings.warn('The "optional" attribute has been replaced by "required"', DeprecationWarning)
+            newschema['required'] = not schema['optional']
+        elif 'required' not in schema:
+            newschema['required'] = self.required_by_default
+
+        if 'blank' not in schema:
+            newschema['blank'] = self.blank_by_default
+
+        # in the order of newschema, as that decides which error is reported
+        checks = []
+        for schemaprop in newschema:
+            validator = getattr(self, "validate_" + schemaprop, None)
+            if (schemaprop == "properties") or (schemaprop == "required"):
+                checks.append((schemaprop, validator, newschema[schemaprop], True))
+            elif validator:
+                checks.append((schemaprop, validator, newschema[schemaprop], False))
+
+        if isinstance(newschema.get('pattern'), _str_type):
+            _regex(newschema['pattern'])
+        if isinstance(newschema.get('patternProperties'), dict):
+            for pattern in newschema['patternProperties']:
+                _regex(pattern)
+
+        checks = tuple(checks)
+
+        def check_field(fieldname, data, location):
+            state = self._state
+            if state.errors is None:
+                for _, validator, value, wants_location in checks:
+                    if wants_location:
+                        validator(data, fieldname, schema, value, location)
+                    else:
+                        validator(data, fieldname, schema, value)
+                return
+
+            in_path = type(data) is not _Root
+            if in_path:
+                state.path.append(fieldname)
+            try:
+                for schemaprop, validator, value, wants_location in checks:
+                    try:
+                        if wants_location:
+                            validator(data, fieldname, schema, value, location)
+                        else:
+                            validator(data, fieldname, schema, value)
+                    except ValidationError as e:
+                        self._add_error(e, schemaprop, data.get(fieldname))
+            finally:
+                if in_path:
+                    state.path.pop()
+
+        if len(self._compiled) >= _MAX_COMPILED:
+            self._compiled.clear()
+        self._compiled[id(schema)] = (schema, check_field)
+        return check_field
 
     def __validate(self, fieldname, data, schema, location):
 
         if schema is not None:
-            if not isinstance(schema, dict):
-                raise SchemaError("Schema structure is invalid.")
-
-            newschema = copy.copy(schema)
-
-            # handle 'optional', replace it with 'required'
-            if 'required' in schema and 'optional' in schema:
-                raise SchemaError('cannot specify optional and required')
-            elif 'optional' in schema:
-                warnings.warn('The "optional" attribute has been replaced by "required"', DeprecationWarning)
-                newschema['required'] = not schema['optional']
-            elif 'required' not in schema:
-                newschema['required'] = self.required_by_default
-
-            if 'blank' not in schema:
-                newschema['blank'] = self.blank_by_default
-
-            def validate_one_field(fieldname, data, schema, location):
-                for schemaprop in newschema:
-
-                    validatorname = "validate_" + schemaprop
-                    validator = getattr(self, validatorname, None)
-                    if (schemaprop == "properties") or (schemaprop == "required"):
-                        validator(data, fieldname, schema,
-                                newschema.get(schemaprop), location)
-                    elif validator:
-                        validator(data, fieldname, schema,
-                                newschema.get(schemaprop))
+            check_field = self._compile(schema)
 
             if fieldname == FIELD_WILDCARD:
                 for fieldname in data:
-                    validate_one_field(fieldname, data, schema, location)
+                    check_field(fieldname, data, location)
             else:
-                validate_one_field(fieldname, data, schema, location)
+                check_field(fieldname, data, location)
 
         return data
 